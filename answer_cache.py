@@ -0,0 +1,276 @@
+"""
+Answer caching for PDF Knowledge Assistant
+Per-collection version counters, a semantic cache that returns a stored
+answer when a new question embeds close to one already answered, and a
+disk-backed exact-match cache of LLM responses shared across processes
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+from embeddings import normalize_text
+
+
+_versions: Dict[Hashable, int] = {}
+_answer_caches: Dict[tuple, "SemanticAnswerCache"] = {}
+_response_caches: Dict[str, "ResponseCache"] = {}
+_registry_lock = threading.Lock()
+
+
+def collection_version(collection: Hashable) -> int:
+    """Current version of a collection; it changes whenever documents are added or removed"""
+    return _versions.get(collection, 0)
+
+
+def invalidate_collection(collection: Hashable) -> int:
+    """Bump a collection's version and drop every cached answer for it"""
+    with _registry_lock:
+        _versions[collection] = _versions.get(collection, 0) + 1
+        caches = list(_answer_caches.values())
+    for cache in caches:
+        cache.invalidate(collection)
+    return _versions[collection]
+
+
+def get_answer_cache(threshold: float = 0.95, max_entries: int = 1000) -> "SemanticAnswerCache":
+    """Return the process-wide SemanticAnswerCache for these settings"""
+    key = (threshold, max_entries)
+    with _registry_lock:
+        if key not in _answer_caches:
+            _answer_caches[key] = SemanticAnswerCache(threshold, max_entries)
+        return _answer_caches[key]
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """LRU of answered questions, matched by cosine similarity of their embeddings
+
+    Entries are keyed by collection, collection version and a caller-chosen
+    scope (e.g. LLM provider and model), so an answer is only reused for the
+    same documents and the same kind of generator. Adding or removing
+    documents bumps the version, which makes older answers unreachable.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, collection: Hashable, version: int, query_embedding,
+               scope: Hashable = ()) -> Optional[Dict[str, Any]]:
+        """Closest cached answer at or above the threshold, or None"""
+        vector = _unit(query_embedding)
+        with self._lock:
+            keys = [key for key in self._entries if key[:3] == (collection, version, scope)]
+            if keys:
+                matrix = np.stack([self._entries[key]["vector"] for key in keys])
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    entry = self._entries[keys[best]]
+                    return {
+                        "question": entry["question"],
+                        "answer": entry["answer"],
+                        "sources": list(entry["sources"]),
+                        "similarity": float(similarities[best]),
+                    }
+            self.misses += 1
+            return None
+
+    def store(self, collection: Hashable, version: int, query: str, query_embedding,
+              answer: str, sources: List[str], scope: Hashable = ()):
+        """Remember the answer to query, evicting the least recently used entry if full"""
+        key = (collection, version, scope, normalize_text(query))
+        with self._lock:
+            self._entries[key] = {
+                "question": query,
+                "vector": _unit(query_embedding),
+                "answer": answer,
+                "sources": list(sources),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection: Hashable):
+        """Drop every cached answer for a collection"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == collection]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every cached answer"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters since this cache object was created"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+def get_response_cache(path: str, max_size_mb: float = 64, ttl_seconds: float = 86400) -> "ResponseCache":
+    """Return the process-wide ResponseCache for path, opening it on first use"""
+    with _registry_lock:
+        if path not in _response_caches:
+            _response_caches[path] = ResponseCache(path, max_size_mb, ttl_seconds)
+        return _response_caches[path]
+
+
+def response_key(provider: str, model: Optional[str], temperature: Optional[float], prompt: str) -> str:
+    """Cache key for an LLM call: SHA-256 of provider, model, temperature and the rendered prompt"""
+    payload = json.dumps([provider, model, temperature, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed cache of response_key -> LLM response text
+
+    The database file can be shared by several processes on the same host.
+    Entries expire ttl_seconds after they were stored. Each row records its
+    size and a one-row total is updated in the same transaction as every
+    write, so the size limit holds across processes. When the stored
+    responses exceed max_size_mb, expired entries are dropped first and
+    then the least recently used, down to 90% of the limit.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 64, ttl_seconds: float = 86400):
+        self.path = path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+                " created REAL NOT NULL, last_access REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(responses)")]
+            if "size" not in columns:
+                # Files written before sizes were recorded
+                self._conn.execute("ALTER TABLE responses ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+                self._conn.execute("UPDATE responses SET size = LENGTH(CAST(response AS BLOB))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses_size (bytes INTEGER NOT NULL)")
+            self._conn.execute(
+                "INSERT INTO responses_size SELECT COALESCE(SUM(size), 0) FROM responses"
+                " WHERE NOT EXISTS (SELECT 1 FROM responses_size)"
+            )
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT bytes FROM responses_size").fetchone()[0]
+
+    def _delete(self, condition: str, params: tuple = ()):
+        """Delete matching rows and take their sizes off the running total (inside a transaction)"""
+        self._conn.execute(
+            f"UPDATE responses_size SET bytes = bytes - (SELECT COALESCE(SUM(size), 0) FROM responses WHERE {condition})",
+            params
+        )
+        self._conn.execute(f"DELETE FROM responses WHERE {condition}", params)
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached response for key, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                with self._conn:
+                    self._delete("key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        """Store a response, evicting old entries if over the size limit"""
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            with self._conn:
+                # The first write takes the database write lock, so the total stays exact across processes
+                self._delete("key = ?", (key,))
+                self._conn.execute("INSERT INTO responses VALUES (?, ?, ?, ?, ?)", (key, response, now, now, size))
+                self._conn.execute("UPDATE responses_size SET bytes = bytes + ?", (size,))
+                if self._stored_bytes() > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under 90% of the size limit"""
+        target = int(self.max_bytes * 0.9)
+        self._delete("created < ?", (time.time() - self.ttl_seconds,))
+        stored = self._stored_bytes()
+        while stored > target:
+            rows = self._conn.execute(
+                "SELECT rowid, size FROM responses ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            freed = 0
+            doomed = []
+            for rowid, size in rows:
+                doomed.append((rowid,))
+                freed += size
+                if stored - freed <= target:
+                    break
+            self._conn.executemany("DELETE FROM responses WHERE rowid = ?", doomed)
+            self._conn.execute("UPDATE responses_size SET bytes = bytes - ?", (freed,))
+            stored -= freed
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.execute("UPDATE responses_size SET bytes = 0")
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters since this cache object was created, and the stored size"""
+        total = self.hits + self.misses
+        with self._lock:
+            stored = self._stored_bytes()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_mb": stored / (1024 * 1024),
+        }
+
+    def close(self):
+        """Close the underlying database connection"""
+        self._conn.close()
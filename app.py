@@ -2,15 +2,13 @@ import streamlit as st
 import os
 import tempfile
 from pathlib import Path
-import PyPDF2
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 import chromadb
-from sentence_transformers import SentenceTransformer
 import json
 from datetime import datetime
 import base64
-import uuid
 import re
+import time
 
 # Set environment variable to avoid tokenizers warning
 os.environ['TOKENIZERS_PARALLELISM'] = 'false'
@@ -19,11 +17,34 @@ os.environ['TOKENIZERS_PARALLELISM'] = 'false'
 import openai
 import anthropic
 import google.generativeai as genai
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+from config import (
+    CONTEXT_CONFIG, EMBEDDING_CACHE_CONFIG, LLM_ASYNC_CONFIG, LLM_POOL_CONFIG, PDF_CONFIG, QUERY_CACHE_CONFIG,
+    RATE_LIMIT_CONFIG, RERANK_CONFIG, RESPONSE_CACHE_CONFIG, VECTOR_DB_CONFIG,
+    get_api_key, get_azure_endpoint, get_default_model
+)
+from embeddings import EmbeddingEngine, get_embedding_cache, get_embedding_model, get_query_cache
+from answer_cache import (
+    collection_version, get_answer_cache, get_response_cache, invalidate_collection, response_key
+)
+from context import encoding_for_model, pack_context
+from reranker import get_reranker
+from metrics import StageTimer, get_latency_recorder, timed_stream
+from llm_clients import client_key, get_client_pool
+from llm_async import get_llm_router, run_sync
+from rate_limit import get_rate_limiter, rate_limit_stats
+from vector_backends import get_numpy_client
+from sharding import get_sharded_client
+from lexical_index import drop_lexical_index, get_lexical_index, reciprocal_rank_fusion
+from ingestion import (
+    chunk_hash, chunk_id, content_hash, extract_pages, get_token_encoding,
+    iter_pages, run_ingestion
+)
+
 # Page configuration
 st.set_page_config(
     page_title="PDF Knowledge Assistant",
@@ -432,28 +453,58 @@ if 'uploaded_pdfs' not in st.session_state:
 if 'vector_db' not in st.session_state:
     st.session_state.vector_db = None
 if 'embeddings_model' not in st.session_state:
+    # Name of the embedding model; the weights live in the process-wide registry
     st.session_state.embeddings_model = None
 if 'current_collection' not in st.session_state:
     st.session_state.current_collection = None
 
 class PDFProcessor:
-    def __init__(self):
-        self.embeddings_model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, model_name: str = None, backend: str = None):
+        self.model_name = model_name or VECTOR_DB_CONFIG["embedding_model"]
+        self.engine = EmbeddingEngine(
+            self.model_name,
+            backend or VECTOR_DB_CONFIG["embedding_backend"],
+            VECTOR_DB_CONFIG["embedding_batch_size"]
+        )
+        self.embedding_cache = None
+        if EMBEDDING_CACHE_CONFIG["enabled"]:
+            self.embedding_cache = get_embedding_cache(
+                EMBEDDING_CACHE_CONFIG["path"],
+                EMBEDDING_CACHE_CONFIG["max_size_mb"]
+            )
+    
+    @property
+    def embeddings_model(self):
+        """Shared SentenceTransformer from the process-wide model registry"""
+        return self.engine.model
+    
+    @property
+    def embedding_key(self) -> str:
+        """Model and backend the embeddings come from, as keyed in the embedding cache"""
+        return self.engine.key
     
-    def extract_text_from_pdf(self, pdf_file) -> str:
-        """Extract text from uploaded PDF file"""
+    def extract_text_from_pdf(self, pdf_file, workers: int = None) -> str:
+        """Extract text from uploaded PDF file, optionally across a process pool"""
         try:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+            if workers is None:
+                workers = PDF_CONFIG["extraction_workers"]
+            pages = extract_pages(pdf_file, workers, PDF_CONFIG["min_pages_per_worker"],
+                                  PDF_CONFIG["pages_per_span"])
+            return "".join(page + "\n" for page in pages)
         except Exception as e:
             st.error(f"Error processing PDF: {str(e)}")
             return ""
     
+    def iter_pages_from_pdf(self, pdf_file, workers: int = None):
+        """Stream page texts from uploaded PDF file without joining them"""
+        if workers is None:
+            workers = PDF_CONFIG["extraction_workers"]
+        return iter_pages(pdf_file, workers, PDF_CONFIG["min_pages_per_worker"], PDF_CONFIG["pages_per_span"])
+    
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """Split text into overlapping chunks"""
+        if overlap >= chunk_size:
+            raise ValueError("overlap must be smaller than chunk_size")
         chunks = []
         start = 0
         while start < len(text):
@@ -464,62 +515,335 @@ class PDFProcessor:
         return chunks
     
     def create_embeddings(self, chunks: List[str]) -> List[List[float]]:
-        """Create embeddings for text chunks"""
-        return self.embeddings_model.encode(chunks).tolist()
+        """Create embeddings for text chunks, encoding only embedding cache misses"""
+        if not self.embedding_cache:
+            return self.engine.encode(chunks).tolist()
+        
+        embeddings = self.embedding_cache.get_many(self.engine.key, chunks)
+        misses = list(dict.fromkeys(chunk for chunk, embedding in zip(chunks, embeddings) if embedding is None))
+        if misses:
+            encoded = dict(zip(misses, self.engine.encode(misses).tolist()))
+            self.embedding_cache.put_many(self.engine.key, misses, list(encoded.values()))
+            embeddings = [
+                embedding if embedding is not None else encoded[chunk]
+                for chunk, embedding in zip(chunks, embeddings)
+            ]
+        return embeddings
 
 class VectorDatabase:
-    def __init__(self):
-        self.client = chromadb.Client()
+    def __init__(self, persist_directory: str = None, backend: str = None):
+        self.backend = backend or VECTOR_DB_CONFIG["backend"]
+        if self.backend == "numpy":
+            # In-process NumPy index exposing the same client/collection API as chromadb
+            self.client = get_numpy_client(persist_directory)
+        elif self.backend == "sharded":
+            # Chunks spread by document hash over worker processes, queried scatter-gather
+            self.client = get_sharded_client(
+                persist_directory, VECTOR_DB_CONFIG["num_shards"], VECTOR_DB_CONFIG["shard_backend"]
+            )
+        elif persist_directory:
+            self.client = chromadb.PersistentClient(path=persist_directory)
+        else:
+            self.client = chromadb.Client()
+        self.persist_directory = persist_directory
         self.collection = None
+        self.lexical = None
     
-    def create_collection(self, name: str):
-        """Create a new collection for PDF documents"""
+    def create_collection(self, name: str, index_params: Dict[str, Any] = None):
+        """Create a new collection for PDF documents
+        
+        index_params overrides VECTOR_DB_CONFIG["index"] (space, M,
+        construction_ef, search_ef) for this collection only; an existing
+        collection keeps the settings it was created with.
+        """
         try:
-            self.collection = self.client.create_collection(name=name)
-            return True
+            self.collection = self.client.create_collection(
+                name=name,
+                metadata=self._collection_metadata(index_params)
+            )
         except:
             self.collection = self.client.get_collection(name=name)
-            return True
+        self._attach_lexical_index(name)
+        return True
     
-    def add_documents(self, chunks: List[str], embeddings: List[List[float]], metadata: List[Dict]):
-        """Add document chunks to the vector database"""
+    def _collection_metadata(self, index_params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Index and backend-specific settings stored with a new collection"""
+        params = {**VECTOR_DB_CONFIG["index"], **(index_params or {})}
+        metadata = {f"hnsw:{key}": value for key, value in params.items()}
+        numpy_store = self.backend == "numpy" or (
+            self.backend == "sharded" and VECTOR_DB_CONFIG["shard_backend"] == "numpy"
+        )
+        if numpy_store and VECTOR_DB_CONFIG["quantization"]:
+            metadata.update({
+                "quantization": VECTOR_DB_CONFIG["quantization"],
+                "quantization:subvectors": VECTOR_DB_CONFIG["pq_subvectors"],
+                "quantization:rerank_factor": VECTOR_DB_CONFIG["rerank_factor"]
+            })
+        return metadata
+    
+    def open_collection(self, name: str) -> bool:
+        """Reopen an existing collection without creating it"""
+        try:
+            self.collection = self.client.get_collection(name=name)
+        except Exception:
+            return False
+        self._attach_lexical_index(name)
+        return True
+    
+    @property
+    def collection_key(self):
+        """Process-wide identity of the open collection for cache invalidation"""
+        if not self.collection:
+            return None
+        directory = os.path.abspath(self.persist_directory) if self.persist_directory else None
+        return (self.backend, directory, self.collection.name)
+    
+    @property
+    def version(self) -> int:
+        """Collection version; bumped on every add or remove"""
+        return collection_version(self.collection_key)
+    
+    def _attach_lexical_index(self, name: str):
+        """Open the collection's BM25 index, rebuilding it if it is out of step with the store or lacks document scopes"""
+        self.lexical = get_lexical_index(self.persist_directory, name)
+        if self.lexical.scoped and len(self.lexical) == self.collection.count():
+            return
+        drop_lexical_index(self.persist_directory, name)
+        self.lexical = get_lexical_index(self.persist_directory, name)
+        page_size = VECTOR_DB_CONFIG["upsert_batch_size"]
+        for offset in range(0, self.collection.count(), page_size):
+            page = self.collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            self.lexical.add(page['ids'], page['documents'], page['metadatas'])
+    
+    def list_documents(self) -> List[Dict[str, Any]]:
+        """Rebuild the processed documents list from stored chunk metadata"""
+        if not self.collection:
+            return []
+        documents = {}
+        all_data = self.collection.get(include=["metadatas"])
+        for metadata in all_data['metadatas']:
+            if not metadata or 'filename' not in metadata:
+                continue
+            key = metadata.get('document_id', metadata['filename'])
+            if key not in documents:
+                documents[key] = {
+                    "filename": metadata['filename'],
+                    "chunks": 0,
+                    "text": "",
+                    "upload_time": metadata.get('upload_time', ''),
+                    "document_id": metadata.get('document_id'),
+                    "content_hash": metadata.get('content_hash')
+                }
+            documents[key]["chunks"] += 1
+        
+        # Use each document's first chunk as its preview
+        first_chunks = self.collection.get(where={"chunk_index": 0}, include=["documents", "metadatas"])
+        for text, metadata in zip(first_chunks['documents'], first_chunks['metadatas']):
+            key = metadata.get('document_id', metadata.get('filename'))
+            if key in documents:
+                documents[key]["text"] = text[:500] + "..." if len(text) > 500 else text
+        return sorted(documents.values(), key=lambda doc: doc["upload_time"])
+    
+    def add_documents(self, chunks: List[str], embeddings: List[List[float]], metadata: List[Dict],
+                      ids: List[str] = None, batch_size: int = None):
+        """Upsert document chunks into the vector database in fixed-size batches
+        
+        IDs default to chunk_id(document_id, chunk_index) from each chunk's
+        metadata (falling back to a hash of the chunk text and its position),
+        so re-adding the same document overwrites instead of duplicating.
+        """
         if self.collection:
-            self.collection.add(
-                embeddings=embeddings,
-                documents=chunks,
-                metadatas=metadata,
-                ids=[f"chunk_{i}" for i in range(len(chunks))]
-            )
+            if ids is None:
+                ids = [
+                    chunk_id(meta['document_id'], meta.get('chunk_index', i))
+                    if meta and meta.get('document_id') else chunk_id(chunk_hash(chunk), i)
+                    for i, (chunk, meta) in enumerate(zip(chunks, metadata))
+                ]
+            batch_size = batch_size or VECTOR_DB_CONFIG["upsert_batch_size"]
+            for start in range(0, len(chunks), batch_size):
+                stop = start + batch_size
+                self.collection.upsert(
+                    embeddings=embeddings[start:stop],
+                    documents=chunks[start:stop],
+                    metadatas=metadata[start:stop],
+                    ids=ids[start:stop]
+                )
+                if self.lexical is not None:
+                    self.lexical.add(ids[start:stop], chunks[start:stop], metadata[start:stop])
+            if chunks:
+                invalidate_collection(self.collection_key)
     
-    def search_similar(self, query: str, embeddings_model, n_results: int = 5):
-        """Search for similar documents"""
+    def has_content_hash(self, file_hash: str) -> bool:
+        """Check whether a document with this content hash was completely indexed"""
         if self.collection:
-            query_embedding = embeddings_model.encode([query]).tolist()
-            results = self.collection.query(
-                query_embeddings=query_embedding,
-                n_results=n_results
+            found = self.collection.get(
+                where={"$and": [{"content_hash": file_hash}, {"document_complete": True}]},
+                limit=1, include=[]
+            )
+            return bool(found['ids'])
+        return False
+    
+    def get_embeddings_by_chunk_hash(self, hashes: List[str]) -> Dict[str, List[float]]:
+        """Look up stored embeddings for chunks with the given chunk hashes"""
+        if not self.collection or not hashes:
+            return {}
+        found = self.collection.get(
+            where={"chunk_hash": {"$in": list(set(hashes))}},
+            include=["embeddings", "metadatas"]
+        )
+        return {
+            metadata['chunk_hash']: list(embedding)
+            for metadata, embedding in zip(found['metadatas'], found['embeddings'])
+        }
+    
+    def get_embeddings(self, ids: List[str]) -> List[Optional[List[float]]]:
+        """Stored embeddings for chunk IDs, in the order given (None for IDs no longer stored)"""
+        if not self.collection or not ids:
+            return []
+        found = self.collection.get(ids=list(ids), include=["embeddings"])
+        by_id = dict(zip(found['ids'], found['embeddings']))
+        return [list(by_id[id]) if id in by_id else None for id in ids]
+    
+    def embed_query(self, query: str, embeddings_model=None):
+        """Query embedding through the process-wide query LRU"""
+        return self.embed_queries([query], embeddings_model)[0]
+    
+    def embed_queries(self, queries: List[str], embeddings_model=None):
+        """Query embeddings as a matrix; cache misses are encoded in one forward pass"""
+        if embeddings_model is None:
+            embeddings_model = get_embedding_model(
+                VECTOR_DB_CONFIG["embedding_model"],
+                VECTOR_DB_CONFIG["embedding_backend"]
             )
+        return get_query_cache(QUERY_CACHE_CONFIG["query_embeddings"]).encode_many(embeddings_model, queries)
+    
+    def search_similar(self, query: str, embeddings_model=None, n_results: int = 5, hybrid: bool = None,
+                       query_embedding=None, filenames: List[str] = None, document_ids: List[str] = None):
+        """Search for similar documents
+        
+        The query embedding comes from the query LRU unless one is passed in.
+        filenames / document_ids scope the search to those documents with a
+        store-side filter applied before ranking.
+        In hybrid mode the dense top candidates and the BM25 top candidates
+        are merged with reciprocal rank fusion, so exact identifiers that
+        the embedding misses can still rank. Fused results keep the
+        collection.query layout plus per-result 'scores'; 'distances' is
+        None for chunks found only lexically.
+        """
+        results = self.search_similar_batch(
+            [query], embeddings_model, n_results, hybrid,
+            None if query_embedding is None else [query_embedding],
+            filenames, document_ids
+        )
+        return results[0] if results else None
+    
+    def search_similar_batch(self, queries: List[str], embeddings_model=None, n_results: int = 5,
+                             hybrid: bool = None, query_embeddings=None, filenames: List[str] = None,
+                             document_ids: List[str] = None) -> List[Dict[str, Any]]:
+        """Search for several queries with one encode pass and one store query
+        
+        Returns one result per query, each laid out like search_similar's.
+        """
+        if not self.collection or not queries:
+            return []
+        if hybrid is None:
+            hybrid = VECTOR_DB_CONFIG["hybrid_search"]
+        hybrid = hybrid and self.lexical is not None
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(queries, embeddings_model)
+        query_embeddings = [[float(value) for value in embedding] for embedding in query_embeddings]
+        
+        candidates = max(n_results, VECTOR_DB_CONFIG["hybrid_candidates"]) if hybrid else n_results
+        where = self.document_filter(filenames, document_ids)
+        dense = self.collection.query(query_embeddings=query_embeddings, n_results=candidates, where=where)
+        # Split the batched response into single-query results
+        results = [
+            {key: [value[i]] if isinstance(value, list) else value for key, value in dense.items()}
+            for i in range(len(queries))
+        ]
+        if not hybrid:
             return results
-        return None
+        
+        # BM25 is restricted to the same chunks as the store filter, looked up in the lexical index
+        allowed = (self.lexical.scoped_ids("document_id", document_ids or []) |
+                   self.lexical.scoped_ids("filename", filenames or [])) if where else None
+        fused = [
+            reciprocal_rank_fusion(
+                [result['ids'][0], [id for id, _ in self.lexical.search(query, candidates, allowed)]],
+                VECTOR_DB_CONFIG["rrf_k"]
+            )[:n_results]
+            for query, result in zip(queries, results)
+        ]
+        # Fetch chunks found only lexically for all queries in one call
+        dense_ids = {id for result in results for id in result['ids'][0]}
+        missing = list({id for ranking in fused for id, _ in ranking if id not in dense_ids})
+        extra = self.collection.get(ids=missing, include=["documents", "metadatas"]) if missing else None
+        return [self._fused_results(ranking, result, extra) for ranking, result in zip(fused, results)]
+    
+    def _fused_results(self, fused: List, dense: Dict[str, Any], extra: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Lay out fused (id, score) pairs like a single-query collection.query result"""
+        found = {
+            id: (document, metadata, distance)
+            for id, document, metadata, distance in zip(
+                dense['ids'][0], dense['documents'][0], dense['metadatas'][0], dense['distances'][0]
+            )
+        }
+        if extra:
+            for id, document, metadata in zip(extra['ids'], extra['documents'], extra['metadatas']):
+                found.setdefault(id, (document, metadata, None))
+        fused = [(id, score) for id, score in fused if id in found]
+        return {
+            "ids": [[id for id, _ in fused]],
+            "documents": [[found[id][0] for id, _ in fused]],
+            "metadatas": [[found[id][1] for id, _ in fused]],
+            "distances": [[found[id][2] for id, _ in fused]],
+            "scores": [[score for _, score in fused]]
+        }
+    
+    @staticmethod
+    def document_filter(filenames: List[str] = None, document_ids: List[str] = None) -> Dict[str, Any]:
+        """Store-side where clause matching chunks by document_id and/or filename (None if unscoped)"""
+        clauses = []
+        if document_ids:
+            clauses.append({"document_id": {"$in": list(document_ids)}})
+        if filenames:
+            clauses.append({"filename": {"$in": list(filenames)}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$or": clauses}
     
     def remove_document(self, filename: str):
         """Remove all chunks for a specific document"""
-        if self.collection:
-            try:
-                # Get all documents and find chunks to remove
-                all_data = self.collection.get()
-                chunks_to_remove = []
-                
-                for i, metadata in enumerate(all_data['metadatas']):
-                    if metadata and metadata.get('filename') == filename:
-                        chunks_to_remove.append(all_data['ids'][i])
-                
-                if chunks_to_remove:
-                    self.collection.delete(ids=chunks_to_remove)
-                    return True
-            except Exception as e:
-                st.error(f"Error removing document: {str(e)}")
-        return False
+        return self.remove_documents(filenames=[filename])["removed"] > 0
+    
+    def remove_documents(self, filenames: List[str] = None, document_ids: List[str] = None) -> Dict[str, Any]:
+        """Remove all chunks of several documents with a store-side metadata filter
+        
+        Documents are matched by document_id and/or filename; only the
+        matching chunks are touched. Returns the number of chunks removed and
+        the time taken.
+        """
+        result = {"removed": 0, "seconds": 0.0}
+        if not self.collection:
+            return result
+        where = self.document_filter(filenames, document_ids)
+        if not where:
+            return result
+        
+        start = time.perf_counter()
+        try:
+            # Only the matching IDs come back, so the BM25 index can drop the same chunks
+            ids = self.collection.get(where=where, include=[])['ids']
+            if ids:
+                self.collection.delete(ids=ids)
+                if self.lexical is not None:
+                    self.lexical.remove(ids)
+                invalidate_collection(self.collection_key)
+            result["removed"] = len(ids)
+        except Exception as e:
+            st.error(f"Error removing document: {str(e)}")
+        result["seconds"] = time.perf_counter() - start
+        return result
 
 class LLMProvider:
     def __init__(self, provider: str, api_key: str, model: str = None, azure_endpoint: str = None):
@@ -527,9 +851,45 @@ class LLMProvider:
         self.api_key = api_key
         self.model = model
         self.azure_endpoint = azure_endpoint
+        # Claude and Gemini run at their SDK's default temperature
+        self.temperature = 0.7 if provider in ("OpenAI", "Azure") else None
         self.client = None
+        self.async_client = None
+        self.rate_limiter = get_rate_limiter(
+            provider, model,
+            **self._limits(),
+            # LangChain's Gemini chat model retries internally whatever max_retries says, so there
+            # the limiter only queues instead of adding its own retries on top
+            max_attempts=1 if provider == "Grok" else RATE_LIMIT_CONFIG["max_attempts"],
+            base_delay=RATE_LIMIT_CONFIG["base_delay"],
+            max_delay=RATE_LIMIT_CONFIG["max_delay"],
+            deadline_seconds=RATE_LIMIT_CONFIG["deadline_seconds"]
+        ) if RATE_LIMIT_CONFIG["enabled"] else None
+        # The rate limiter retries within its deadline; SDK retries on top would multiply attempts
+        self.sdk_retries = {"max_retries": 0} if self.rate_limiter else {}
         self.setup_client()
     
+    def _limits(self) -> Dict[str, float]:
+        """Per-minute budgets for this provider and model"""
+        limits = RATE_LIMIT_CONFIG["limits"]
+        return limits.get(f"{self.provider}/{self.model}") or limits.get(self.provider) or RATE_LIMIT_CONFIG["default_limits"]
+    
+    def _estimated_tokens(self, prompt: str) -> float:
+        """Tokens reserved for a call: the prompt estimated from its length plus the expected completion"""
+        return len(prompt) / RATE_LIMIT_CONFIG["chars_per_token"] + RATE_LIMIT_CONFIG["completion_tokens"]
+    
+    def _limited(self, call, prompt: str):
+        """Run call within the rate limits, retrying transient errors"""
+        if self.rate_limiter is None:
+            return call()
+        return self.rate_limiter.call(call, self._estimated_tokens(prompt))
+    
+    async def _alimited(self, call, prompt: str):
+        """Await call within the rate limits, retrying transient errors"""
+        if self.rate_limiter is None:
+            return await call()
+        return await self.rate_limiter.acall(call, self._estimated_tokens(prompt))
+    
     def setup_client(self):
         """Setup the LLM client based on provider"""
         try:
@@ -538,12 +898,14 @@ class LLMProvider:
                 self.client = ChatOpenAI(
                     openai_api_key=self.api_key,
                     model_name=self.model or "gpt-3.5-turbo",
-                    temperature=0.7
+                    temperature=self.temperature,
+                    **self.sdk_retries
                 )
             elif self.provider == "Claude":
                 self.client = ChatAnthropic(
                     anthropic_api_key=self.api_key,
-                    model_name=self.model or "claude-3-sonnet-20240229"
+                    model_name=self.model or "claude-3-sonnet-20240229",
+                    **self.sdk_retries
                 )
             elif self.provider == "Azure":
                 # Use Azure OpenAI client directly
@@ -551,68 +913,173 @@ class LLMProvider:
                     api_version="2024-12-01-preview",
                     azure_endpoint=self.azure_endpoint,
                     api_key=self.api_key,
+                    **self.sdk_retries
                 )
             elif self.provider == "Grok":
                 genai.configure(api_key=self.api_key)
                 self.client = ChatGoogleGenerativeAI(
                     google_api_key=self.api_key,
-                    model=self.model or "gemini-pro"
+                    model=self.model or "gemini-pro",
+                    **self.sdk_retries
                 )
         except Exception as e:
             st.error(f"Error setting up {self.provider} client: {str(e)}")
     
+    def close(self):
+        """Close the provider SDK's HTTP connections"""
+        for client in (self.client, getattr(self.client, "root_client", None), getattr(self.client, "_client", None)):
+            close = getattr(client, "close", None)
+            if callable(close):
+                close()
+        if self.async_client is not None:
+            run_sync(self.async_client.close())
+            self.async_client = None
+    
+    def build_prompt(self, query: str, context: str) -> str:
+        """Prompt sent to every provider for a question and its document context"""
+        return f"""Context: {context}
+
+Question: {query}
+
+Please provide a comprehensive answer based on the context provided. If the context doesn't contain enough information to answer the question, please say so."""
+    
+    def _azure_request(self, prompt: str) -> Dict[str, Any]:
+        """chat.completions.create arguments for the Azure OpenAI client"""
+        return {
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are a helpful assistant  that answers questions based on the provided document context.",
+                },
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            "max_tokens": 4096,
+            "temperature": self.temperature,
+            "top_p": 1.0,
+            "model": self.model or "gpt-4o"
+        }
+    
+    def response_cache_key(self, query: str, context: str) -> str:
+        """Response cache key of this provider, model and temperature for the rendered prompt"""
+        return response_key(self.provider, self.model, self.temperature, self.build_prompt(query, context))
+    
     def generate_response(self, query: str, context: str) -> str:
-        """Generate response using the selected LLM"""
+        """Generate response using the selected LLM, reusing a cached response to the same prompt"""
         try:
             if not self.client:
                 return "Error: LLM client not properly configured"
             
-            prompt = f"""Context: {context}
-
-Question: {query}
-
-Please provide a comprehensive answer based on the context provided. If the context doesn't contain enough information to answer the question, please say so."""
+            prompt = self.build_prompt(query, context)
+            response_cache = get_response_cache(
+                RESPONSE_CACHE_CONFIG["path"],
+                RESPONSE_CACHE_CONFIG["max_size_mb"],
+                RESPONSE_CACHE_CONFIG["ttl_seconds"]
+            ) if RESPONSE_CACHE_CONFIG["enabled"] else None
+            key = response_key(self.provider, self.model, self.temperature, prompt)
+            cached = response_cache.get(key) if response_cache else None
+            if cached is not None:
+                return cached
             
             if self.provider == "Azure":
                 # Use Azure OpenAI client directly
-                response = self.client.chat.completions.create(
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are a helpful assistant  that answers questions based on the provided document context.",
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt,
-                        }
-                    ],
-                    max_tokens=4096,
-                    temperature=0.7,
-                    top_p=1.0,
-                    model=self.model or "gpt-4o"
-                )
-                return response.choices[0].message.content
+                response = self._limited(lambda: self.client.chat.completions.create(**self._azure_request(prompt)), prompt)
+                text = response.choices[0].message.content
             else:
                 # Use LangChain for other providers
-                response = self.client.invoke(prompt)
-                return response.content
+                response = self._limited(lambda: self.client.invoke(prompt), prompt)
+                text = response.content
+            if response_cache and text:
+                response_cache.put(key, text)
+            return text
                 
         except Exception as e:
             return f"Error generating response: {str(e)}"
+    
+    async def agenerate_response(self, query: str, context: str) -> str:
+        """Generate a response without blocking the event loop; errors are raised
+        
+        Must run on the LLM loop (llm_async.run_sync), which owns the async
+        HTTP connections.
+        """
+        if not self.client:
+            raise RuntimeError("LLM client not properly configured")
+        
+        prompt = self.build_prompt(query, context)
+        
+        if self.provider == "Azure":
+            if self.async_client is None:
+                self.async_client = AsyncAzureOpenAI(
+                    api_version="2024-12-01-preview",
+                    azure_endpoint=self.azure_endpoint,
+                    api_key=self.api_key,
+                    **self.sdk_retries
+                )
+            response = await self._alimited(
+                lambda: self.async_client.chat.completions.create(**self._azure_request(prompt)), prompt
+            )
+            return response.choices[0].message.content
+        response = await self._alimited(lambda: self.client.ainvoke(prompt), prompt)
+        return response.content
+    
+    def stream_response(self, query: str, context: str) -> Iterator[str]:
+        """Yield the answer as text pieces as the provider produces them
+        
+        Unlike generate_response, errors are raised (possibly after some
+        text has been yielded) so the caller can tell them from an answer.
+        Transient errors are retried only until the first piece arrives.
+        """
+        if not self.client:
+            raise RuntimeError("LLM client not properly configured")
+        
+        prompt = self.build_prompt(query, context)
+        
+        def pieces() -> Iterator[str]:
+            if self.provider == "Azure":
+                for chunk in self.client.chat.completions.create(**self._azure_request(prompt), stream=True):
+                    # Azure sends content-filter chunks without choices
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            else:
+                for chunk in self.client.stream(prompt):
+                    content = chunk.content
+                    if isinstance(content, list):
+                        # Anthropic chunks may carry a list of content blocks
+                        content = "".join(
+                            part.get("text", "") if isinstance(part, dict) else str(part) for part in content
+                        )
+                    if content:
+                        yield content
+        
+        def open_stream():
+            stream = pieces()
+            return next(stream, None), stream
+        
+        first, stream = self._limited(open_stream, prompt)
+        if first is not None:
+            yield first
+            yield from stream
 
-def remove_document(filename: str):
-    """Remove a document from the system"""
-    if st.session_state.vector_db:
-        if st.session_state.vector_db.remove_document(filename):
+def remove_documents(pdfs: List[Dict[str, Any]]):
+    """Remove several documents from the system in one store call"""
+    if st.session_state.vector_db and pdfs:
+        document_ids = [pdf['document_id'] for pdf in pdfs if pdf.get('document_id')]
+        filenames = [pdf['filename'] for pdf in pdfs if not pdf.get('document_id')]
+        result = st.session_state.vector_db.remove_documents(filenames=filenames, document_ids=document_ids)
+        names = ", ".join(pdf['filename'] for pdf in pdfs)
+        if result["removed"]:
             # Remove from session state
+            removed = {id(pdf) for pdf in pdfs}
             st.session_state.uploaded_pdfs = [
-                pdf for pdf in st.session_state.uploaded_pdfs 
-                if pdf['filename'] != filename
+                pdf for pdf in st.session_state.uploaded_pdfs
+                if id(pdf) not in removed
             ]
-            st.success(f"✅ Removed {filename} from the system")
+            st.success(f"✅ Removed {names} from the system ({result['seconds'] * 1000:.0f} ms)")
             st.rerun()
         else:
-            st.error(f"❌ Failed to remove {filename}")
+            st.error(f"❌ Failed to remove {names}")
 
 def main():
     # Header with modern design
@@ -676,6 +1143,20 @@ def main():
                 help="Select the Google Gemini model to use"
             )
         
+        # Optional hedge: a second provider (keyed from the environment) raced against slow answers
+        hedge_options = ["Off"] + [name for name in ["OpenAI", "Claude", "Azure", "Grok"] if name != provider]
+        hedge_provider = st.selectbox(
+            "Hedge slow answers with:",
+            hedge_options,
+            index=hedge_options.index(LLM_ASYNC_CONFIG["hedge_provider"])
+            if LLM_ASYNC_CONFIG["hedge_provider"] in hedge_options else 0,
+            help=f"If {provider} has not answered after {LLM_ASYNC_CONFIG['hedge_delay_ms']} ms, "
+                 "also ask this provider and use whichever answers first (API key from the environment)"
+        )
+        if hedge_provider != "Off" and not get_api_key(hedge_provider):
+            st.warning(f"No {hedge_provider} API key in the environment; hedging is off")
+            hedge_provider = "Off"
+        
         # Vector database settings
         st.markdown("""
         <div class="modern-card">
@@ -689,23 +1170,50 @@ def main():
             help="Name for the vector database collection"
         )
         
-        chunk_size = st.slider(
-            "Chunk Size:",
-            min_value=500,
-            max_value=2000,
-            value=1000,
-            step=100,
-            help="Size of text chunks for processing"
+        chunk_unit = st.radio(
+            "Chunk By:",
+            ["tokens", "characters"],
+            index=["tokens", "characters"].index(VECTOR_DB_CONFIG["chunk_unit"]),
+            horizontal=True,
+            help="Tokens respect sentence and paragraph boundaries; characters slice a fixed window"
         )
         
-        overlap = st.slider(
-            "Chunk Overlap:",
-            min_value=0,
-            max_value=500,
-            value=200,
-            step=50,
-            help="Overlap between consecutive chunks"
-        )
+        if chunk_unit == "tokens":
+            chunk_size = st.slider(
+                "Chunk Size (tokens):",
+                min_value=64,
+                max_value=512,
+                value=VECTOR_DB_CONFIG["chunk_tokens"],
+                step=8,
+                help="Maximum tokens per chunk"
+            )
+            
+            overlap = st.slider(
+                "Chunk Overlap (tokens):",
+                min_value=0,
+                max_value=128,
+                value=VECTOR_DB_CONFIG["chunk_overlap_tokens"],
+                step=8,
+                help="Tokens of whole sentences repeated between consecutive chunks"
+            )
+        else:
+            chunk_size = st.slider(
+                "Chunk Size:",
+                min_value=500,
+                max_value=2000,
+                value=1000,
+                step=100,
+                help="Size of text chunks for processing"
+            )
+            
+            overlap = st.slider(
+                "Chunk Overlap:",
+                min_value=0,
+                max_value=500,
+                value=200,
+                step=50,
+                help="Overlap between consecutive chunks"
+            )
         
         # Status indicator
         if st.session_state.vector_db:
@@ -716,6 +1224,15 @@ def main():
             </div>
             """, unsafe_allow_html=True)
     
+    # Warm start: reopen a persisted collection instead of re-ingesting its documents
+    if st.session_state.vector_db is None and VECTOR_DB_CONFIG["persist_directory"]:
+        vector_db = VectorDatabase(VECTOR_DB_CONFIG["persist_directory"])
+        if vector_db.open_collection(collection_name) and vector_db.collection.count():
+            st.session_state.vector_db = vector_db
+            st.session_state.embeddings_model = VECTOR_DB_CONFIG["embedding_model"]
+            st.session_state.current_collection = collection_name
+            st.session_state.uploaded_pdfs = vector_db.list_documents()
+    
     # Main content area
     col1, col2 = st.columns([1, 1])
     
@@ -743,7 +1260,7 @@ def main():
                 with st.spinner("Processing PDFs..."):
                     # Initialize components
                     processor = PDFProcessor()
-                    vector_db = VectorDatabase()
+                    vector_db = st.session_state.vector_db or VectorDatabase(VECTOR_DB_CONFIG["persist_directory"])
                     
                     # Create collection
                     vector_db.create_collection(collection_name)
@@ -754,51 +1271,70 @@ def main():
                     status_text = st.empty()
                     
                     total_chunks = 0
+                    cache_before = processor.embedding_cache.stats() if processor.embedding_cache else None
+                    encoding = get_token_encoding(VECTOR_DB_CONFIG["token_encoding"]) if chunk_unit == "tokens" else None
                     for i, pdf_file in enumerate(uploaded_files):
                         status_text.text(f"Processing {pdf_file.name}...")
                         progress_bar.progress((i + 1) / len(uploaded_files))
                         
-                        # Extract text
-                        text = processor.extract_text_from_pdf(pdf_file)
-                        if text:
-                            # Chunk text
-                            chunks = processor.chunk_text(text, chunk_size, overlap)
-                            
-                            # Create embeddings
-                            embeddings = processor.create_embeddings(chunks)
-                            
-                            # Prepare metadata
-                            metadata = [
+                        # Skip uploads whose exact bytes are already indexed
+                        file_hash = content_hash(pdf_file.getvalue())
+                        if vector_db.has_content_hash(file_hash):
+                            st.info(f"ℹ️ {pdf_file.name} is already indexed, skipping")
+                            continue
+                        
+                        # Stream pages -> chunks -> embeddings -> vector database in batches
+                        upload_time = datetime.now().isoformat()
+                        document_id = file_hash[:32]
+                        try:
+                            result = run_ingestion(
+                                processor.iter_pages_from_pdf(pdf_file),
+                                processor,
+                                vector_db,
                                 {
                                     "filename": pdf_file.name,
-                                    "chunk_index": j,
-                                    "total_chunks": len(chunks),
-                                    "upload_time": datetime.now().isoformat(),
-                                    "document_id": str(uuid.uuid4())
-                                }
-                                for j in range(len(chunks))
-                            ]
-                            
-                            # Add to vector database
-                            vector_db.add_documents(chunks, embeddings, metadata)
-                            total_chunks += len(chunks)
+                                    "upload_time": upload_time,
+                                    "document_id": document_id,
+                                    "content_hash": file_hash
+                                },
+                                chunk_size,
+                                overlap,
+                                VECTOR_DB_CONFIG["ingest_batch_size"],
+                                unit=chunk_unit,
+                                encoding=encoding
+                            )
+                        except Exception as e:
+                            # Drop the batches already written so a retry starts clean
+                            vector_db.remove_documents(document_ids=[document_id])
+                            st.error(f"Error processing PDF: {str(e)}")
+                            continue
+                        
+                        if result["chunks"]:
+                            total_chunks += result["chunks"]
                             
                             # Store in session state
                             st.session_state.uploaded_pdfs.append({
                                 "filename": pdf_file.name,
-                                "chunks": len(chunks),
-                                "text": text[:500] + "..." if len(text) > 500 else text,
-                                "upload_time": datetime.now().isoformat(),
-                                "document_id": metadata[0]["document_id"]
+                                "chunks": result["chunks"],
+                                "text": result["preview"],
+                                "upload_time": upload_time,
+                                "document_id": document_id,
+                                "content_hash": file_hash
                             })
                     
                     st.session_state.vector_db = vector_db
-                    st.session_state.embeddings_model = processor.embeddings_model
+                    st.session_state.embeddings_model = processor.model_name
                     
                     progress_bar.progress(1.0)
                     status_text.text("✅ Processing complete!")
                     
                     st.success(f"✅ Processed {len(uploaded_files)} PDF(s) with {total_chunks} total chunks!")
+                    if cache_before:
+                        # The cache is shared by the whole process, so report this run's delta
+                        cache_stats = processor.embedding_cache.stats()
+                        hits = cache_stats['hits'] - cache_before['hits']
+                        misses = cache_stats['misses'] - cache_before['misses']
+                        st.caption(f"Embedding cache: {hits} hits, {misses} misses")
                     
                     # Clear progress indicators
                     progress_bar.empty()
@@ -812,6 +1348,19 @@ def main():
             </div>
             """, unsafe_allow_html=True)
             
+            if len(st.session_state.uploaded_pdfs) > 1:
+                col_select, col_bulk = st.columns([3, 1])
+                with col_select:
+                    selected = st.multiselect(
+                        "Select documents to remove:",
+                        range(len(st.session_state.uploaded_pdfs)),
+                        format_func=lambda i: st.session_state.uploaded_pdfs[i]['filename'],
+                        key="bulk_remove"
+                    )
+                with col_bulk:
+                    if st.button("🗑️ Remove Selected", type="secondary", disabled=not selected):
+                        remove_documents([st.session_state.uploaded_pdfs[i] for i in selected])
+            
             for pdf in st.session_state.uploaded_pdfs:
                 # Create a modern document card
                 with st.container():
@@ -848,7 +1397,7 @@ def main():
                 
                 with col_remove:
                     if st.button(f"🗑️ Remove", key=f"remove_{pdf['filename']}", type="secondary"):
-                        remove_document(pdf['filename'])
+                        remove_documents([pdf])
     
     with col2:
         st.markdown("""
@@ -872,6 +1421,24 @@ def main():
             
             with col_send:
                 send_button = st.button("🔍", help="Send question", key="send_button")
+            
+            # Optional document scope, applied as a store-side filter before ranking
+            scope_options = {
+                pdf.get('document_id') or pdf['filename']: pdf
+                for pdf in st.session_state.uploaded_pdfs
+            }
+            scoped_pdfs = [
+                scope_options[key] for key in st.multiselect(
+                    "Limit search to:",
+                    list(scope_options),
+                    format_func=lambda key: scope_options[key]['filename'],
+                    placeholder="All documents",
+                    help="Only search the selected PDFs",
+                    key="search_scope"
+                ) if key in scope_options
+            ]
+            scope_document_ids = sorted(pdf['document_id'] for pdf in scoped_pdfs if pdf.get('document_id'))
+            scope_filenames = sorted(pdf['filename'] for pdf in scoped_pdfs if not pdf.get('document_id'))
         
         # Process chat
         if (user_query and send_button) or (user_query and st.session_state.get('auto_send', False)):
@@ -883,28 +1450,165 @@ def main():
                 st.error("Please enter your Azure endpoint for Azure OpenAI!")
             else:
                 with st.spinner("Searching and generating answer..."):
-                    # Search for relevant context
-                    search_results = st.session_state.vector_db.search_similar(
-                        user_query, 
-                        st.session_state.embeddings_model
+                    vector_db = st.session_state.vector_db
+                    timer = StageTimer()
+                    with timer.stage("embed"):
+                        query_embedding = vector_db.embed_query(
+                            user_query,
+                            get_embedding_model(
+                                st.session_state.embeddings_model,
+                                VECTOR_DB_CONFIG["embedding_backend"]
+                            )
+                        )
+                    # Answers are reused only for the same documents, search scope, embedding model and LLM
+                    version = vector_db.version
+                    scope = (
+                        st.session_state.embeddings_model, provider, model,
+                        tuple(scope_document_ids), tuple(scope_filenames)
                     )
+                    answer_cache = get_answer_cache(
+                        QUERY_CACHE_CONFIG["similarity_threshold"],
+                        QUERY_CACHE_CONFIG["max_answers"]
+                    ) if QUERY_CACHE_CONFIG["answers_enabled"] else None
+                    with timer.stage("answer_cache"):
+                        cached = answer_cache.lookup(
+                            vector_db.collection_key, version, query_embedding, scope
+                        ) if answer_cache else None
+                    
+                    if cached:
+                        get_latency_recorder().record(timer.timings)
+                        st.session_state.chat_history.append({
+                            "user": user_query,
+                            "assistant": cached["answer"],
+                            "timestamp": datetime.now().strftime("%H:%M"),
+                            "context_sources": cached["sources"],
+                            "cached": True,
+                            "timings_ms": timer.milliseconds()
+                        })
+                        st.rerun()
+                    
+                    # Search for relevant context; with re-ranking, fetch a larger candidate set
+                    n_results = VECTOR_DB_CONFIG["max_results"]
+                    with timer.stage("search"):
+                        search_results = vector_db.search_similar(
+                            user_query,
+                            n_results=max(n_results, RERANK_CONFIG["candidates"]) if RERANK_CONFIG["enabled"] else n_results,
+                            query_embedding=query_embedding,
+                            filenames=scope_filenames,
+                            document_ids=scope_document_ids
+                        )
+                    
+                    if search_results and search_results['documents'] and RERANK_CONFIG["enabled"]:
+                        reranker = get_reranker(
+                            RERANK_CONFIG["model"],
+                            RERANK_CONFIG["batch_size"],
+                            RERANK_CONFIG["time_budget_ms"],
+                            RERANK_CONFIG["reprobe_seconds"]
+                        )
+                        with timer.stage("rerank"):
+                            search_results, _ = reranker.rerank(user_query, search_results, n_results)
                     
                     if search_results and search_results['documents']:
                         # Combine relevant context
-                        context = "\n\n".join(search_results['documents'][0])
+                        packed = None
+                        context_sources = [metadata.get('filename', 'Unknown') for metadata in search_results['metadatas'][0]]
+                        if CONTEXT_CONFIG["enabled"]:
+                            with timer.stage("pack"):
+                                packed = pack_context(
+                                    search_results['documents'][0],
+                                    search_results['metadatas'][0],
+                                    CONTEXT_CONFIG["budget_tokens"].get(model, CONTEXT_CONFIG["default_budget_tokens"]),
+                                    encoding_for_model(model, CONTEXT_CONFIG["default_encoding"]),
+                                    query_embedding,
+                                    lambda: vector_db.get_embeddings(search_results['ids'][0]),
+                                    CONTEXT_CONFIG["mmr_lambda"],
+                                    CONTEXT_CONFIG["max_similarity"]
+                                )
+                            context, context_sources = packed["context"], packed["sources"]
+                        else:
+                            context = "\n\n".join(search_results['documents'][0])
                         
-                        # Initialize LLM provider
-                        llm = LLMProvider(provider, api_key, model, azure_endpoint)
+                        # Reuse the pooled client (and its open connections) for this provider, model and key
+                        llm_pool = get_client_pool(LLM_POOL_CONFIG["idle_seconds"], LLM_POOL_CONFIG["max_clients"])
+                        llm_key = client_key(provider, model, azure_endpoint, api_key)
                         
-                        # Generate response
-                        response = llm.generate_response(user_query, context)
+                        response_cache = get_response_cache(
+                            RESPONSE_CACHE_CONFIG["path"],
+                            RESPONSE_CACHE_CONFIG["max_size_mb"],
+                            RESPONSE_CACHE_CONFIG["ttl_seconds"]
+                        ) if RESPONSE_CACHE_CONFIG["enabled"] else None
+                        
+                        answer_placeholder = st.empty()
+                        response, failed, answered_by, response_cached = "", False, None, False
+                        with llm_pool.lease(llm_key, lambda: LLMProvider(provider, api_key, model, azure_endpoint)) as llm:
+                            if llm.client is None:
+                                llm_pool.discard(llm_key)
+                            # Exact repeats of a prompt (same provider, model and temperature) skip the LLM
+                            answer_key = llm.response_cache_key(user_query, context)
+                            with timer.stage("response_cache"):
+                                cached_response = response_cache.get(answer_key) if response_cache else None
+                            if cached_response is not None:
+                                response, response_cached = cached_response, True
+                            elif hedge_provider != "Off":
+                                # Hedged answers are not streamed: the first complete answer wins
+                                hedge_model = LLM_ASYNC_CONFIG["hedge_model"] or get_default_model(hedge_provider)
+                                hedge_endpoint = get_azure_endpoint() if hedge_provider == "Azure" else None
+                                hedge_key = client_key(hedge_provider, hedge_model, hedge_endpoint, get_api_key(hedge_provider))
+                                router = get_llm_router(LLM_ASYNC_CONFIG["concurrency"], LLM_ASYNC_CONFIG["default_concurrency"])
+                                with llm_pool.lease(hedge_key, lambda: LLMProvider(
+                                    hedge_provider, get_api_key(hedge_provider), hedge_model, hedge_endpoint
+                                )) as hedge_llm:
+                                    try:
+                                        with timer.stage("llm"):
+                                            result = run_sync(router.hedged(
+                                                (provider, lambda: llm.agenerate_response(user_query, context)),
+                                                (hedge_provider, lambda: hedge_llm.agenerate_response(user_query, context)),
+                                                LLM_ASYNC_CONFIG["hedge_delay_ms"] / 1000
+                                            ))
+                                        response, answered_by = result["answer"], result["provider"]
+                                        if answered_by == hedge_provider:
+                                            answer_key = hedge_llm.response_cache_key(user_query, context)
+                                    except Exception as e:
+                                        failed = True
+                                        response = f"Error generating response: {str(e)}"
+                            else:
+                                # Stream the response into the chat column as it is generated
+                                router = get_llm_router(LLM_ASYNC_CONFIG["concurrency"], LLM_ASYNC_CONFIG["default_concurrency"])
+                                try:
+                                    pieces = router.stream(provider, llm.stream_response(user_query, context))
+                                    for token in timed_stream(pieces, timer):
+                                        response += token
+                                        answer_placeholder.markdown(f"""
+                                        <div class="chat-message assistant-message">
+                                            <strong>🤖 Assistant</strong>
+                                            <div style="margin: 0.5rem 0;">{response}▌</div>
+                                        </div>
+                                        """, unsafe_allow_html=True)
+                                except Exception as e:
+                                    failed = True
+                                    response = f"{response}\n\nError generating response: {str(e)}".lstrip()
+                        answer_placeholder.empty()
+                        if response_cache and not failed and not response_cached and response:
+                            response_cache.put(answer_key, response)
+                        if answer_cache and not failed:
+                            answer_cache.store(
+                                vector_db.collection_key, version, user_query, query_embedding,
+                                response, context_sources, scope
+                            )
+                        get_latency_recorder().record(timer.timings)
                         
                         # Add to chat history
                         st.session_state.chat_history.append({
                             "user": user_query,
                             "assistant": response,
                             "timestamp": datetime.now().strftime("%H:%M"),
-                            "context_sources": [search_results['metadatas'][0][i].get('filename', 'Unknown') for i in range(len(search_results['metadatas'][0]))]
+                            "context_sources": context_sources,
+                            "context_tokens": packed["tokens"] if packed else None,
+                            "tokens_saved": packed["tokens_saved"] if packed else None,
+                            "answered_by": answered_by if answered_by and answered_by != provider else None,
+                            "cached": response_cached,
+                            "cache": "response" if response_cached else None,
+                            "timings_ms": timer.milliseconds()
                         })
                         
                         # Clear input by rerunning to reset the form
@@ -912,6 +1616,50 @@ def main():
                     else:
                         st.warning("No relevant context found in the documents.")
         
+        query_stats = get_query_cache(QUERY_CACHE_CONFIG["query_embeddings"]).stats()
+        caption = f"Query embedding cache: {query_stats['hit_rate']:.0%} hits ({query_stats['hits']}/{query_stats['hits'] + query_stats['misses']})"
+        if QUERY_CACHE_CONFIG["answers_enabled"]:
+            answer_stats = get_answer_cache(
+                QUERY_CACHE_CONFIG["similarity_threshold"],
+                QUERY_CACHE_CONFIG["max_answers"]
+            ).stats()
+            caption += f" · Answer cache: {answer_stats['hit_rate']:.0%} hits ({answer_stats['hits']}/{answer_stats['hits'] + answer_stats['misses']})"
+        if RESPONSE_CACHE_CONFIG["enabled"]:
+            response_stats = get_response_cache(
+                RESPONSE_CACHE_CONFIG["path"],
+                RESPONSE_CACHE_CONFIG["max_size_mb"],
+                RESPONSE_CACHE_CONFIG["ttl_seconds"]
+            ).stats()
+            caption += f" · Response cache: {response_stats['hit_rate']:.0%} hits ({response_stats['hits']}/{response_stats['hits'] + response_stats['misses']})"
+        router = get_llm_router(LLM_ASYNC_CONFIG["concurrency"], LLM_ASYNC_CONFIG["default_concurrency"])
+        if router.requests:
+            hedge_stats = router.stats()
+            caption += (f" · Hedged: {hedge_stats['hedge_rate']:.0%} of {hedge_stats['requests']} answers "
+                        f"({hedge_stats['hedge_wins']} won), p50 {hedge_stats['p50_ms']:.0f} ms / p99 {hedge_stats['p99_ms']:.0f} ms")
+        st.caption(caption)
+        
+        latency_summary = get_latency_recorder().summary()
+        if latency_summary:
+            with st.expander("⏱️ Pipeline stage timings"):
+                st.table({
+                    stage: {key: round(value, 1) for key, value in stats.items()}
+                    for stage, stats in latency_summary.items()
+                })
+                st.download_button(
+                    label="Download timings (JSON)",
+                    data=get_latency_recorder().export_json(),
+                    file_name=f"stage_timings_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                    mime="application/json"
+                )
+        
+        limiter_stats = {name: stats for name, stats in rate_limit_stats().items() if stats["calls"]}
+        if limiter_stats:
+            with st.expander("🚦 Rate limits"):
+                st.table({
+                    name: {key: round(value, 1) for key, value in stats.items()}
+                    for name, stats in limiter_stats.items()
+                })
+        
         # Enhanced chat history display
         if st.session_state.chat_history:
             st.markdown("""
@@ -942,7 +1690,7 @@ def main():
                     <strong>🤖 Assistant</strong>
                     <div style="margin: 0.5rem 0;">{message['assistant']}</div>
                     {sources_text}
-                    <span class="message-timestamp">{message['timestamp']}</span>
+                    <span class="message-timestamp">{message['timestamp']}{(" · ⚡ cached response" if message.get('cache') == "response" else " · ⚡ cached answer") if message.get('cached') else ""}{f" · first token {message['timings_ms']['ttft']:.0f} ms" if 'ttft' in message.get('timings_ms', {}) else ""}{f" · answered by {message['answered_by']} (hedge)" if message.get('answered_by') else ""}{f" · {message['context_tokens']} context tokens ({message['tokens_saved']} saved)" if message.get('context_tokens') is not None else ""}</span>
                 </div>
                 """, unsafe_allow_html=True)
         
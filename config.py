@@ -37,18 +37,129 @@ LLM_PROVIDERS = {
 
 # Vector Database Configuration
 VECTOR_DB_CONFIG = {
+    "backend": "chroma",  # "chroma", "numpy" (in-process memory-mapped matrix) or "sharded"
+    "num_shards": 4,  # worker processes for the "sharded" backend; fixed, a persisted store keeps its count
+    "shard_backend": "chroma",  # store inside each shard: "chroma" or "numpy"
     "default_collection": "pdf_knowledge_base",
+    "chunk_unit": "tokens",  # "tokens" (tiktoken, boundary-respecting) or "characters"
     "chunk_size": 1000,
     "chunk_overlap": 200,
+    "chunk_tokens": 200,
+    "chunk_overlap_tokens": 32,
+    "token_encoding": "cl100k_base",
     "embedding_model": "all-MiniLM-L6-v2",
-    "max_results": 5
+    "embedding_backend": "torch",  # "int8" = dynamically quantized CPU inference
+    "embedding_batch_size": 64,
+    "max_results": 5,
+    "index": {  # per-collection ANN settings, stored as hnsw:* collection metadata at creation
+        "space": "cosine",  # "cosine", "l2" or "ip"; MiniLM embeddings are meant for cosine similarity
+        "M": 16,  # graph links per node: higher = better recall, more memory, slower build
+        "construction_ef": 100,  # candidate list size while building the graph
+        "search_ef": 10  # candidate list size while querying (at least n_results is used)
+    },
+    "hybrid_search": True,  # fuse BM25 and dense rankings with reciprocal rank fusion
+    "hybrid_candidates": 20,  # candidates taken from each ranking before fusion
+    "rrf_k": 60,
+    "ingest_batch_size": 512,  # chunks embedded and written per batch while streaming; several embedding batches so they can be length-bucketed
+    "upsert_batch_size": 1000,  # max chunks per collection.upsert request
+    "quantization": None,  # numpy backend: None, "int8" (scalar) or "pq" (product quantization); queries scan the codes, re-ranking a shortlist at full precision
+    "pq_subvectors": 48,  # bytes per vector with "pq"; must divide the embedding dimension
+    "rerank_factor": 10,  # shortlist of rerank_factor * k rows re-scored at full precision
+    "persist_directory": os.path.join("data", "chroma")  # backend data directory; None keeps the index in memory
+}
+
+# Embedding Cache Configuration
+EMBEDDING_CACHE_CONFIG = {
+    "enabled": True,
+    "path": os.path.join(".cache", "embeddings.sqlite3"),
+    "max_size_mb": 512
+}
+
+# Query Cache Configuration
+QUERY_CACHE_CONFIG = {
+    "query_embeddings": 1024,  # LRU size of the query text -> embedding cache
+    "answers_enabled": True,  # reuse answers to semantically near-identical questions
+    "similarity_threshold": 0.95,  # min cosine similarity to reuse a cached answer
+    "max_answers": 1000
+}
+
+# Context Packing Configuration
+CONTEXT_CONFIG = {
+    "enabled": True,  # merge overlapping chunks; over the token budget, pack them in MMR order
+    "mmr_lambda": 0.7,  # 1.0 = pure relevance, lower values favour diverse passages
+    "max_similarity": 0.95,  # over budget, passages this similar to one already packed are dropped
+    "default_encoding": "cl100k_base",  # tiktoken encoding for models tiktoken does not know
+    "default_budget_tokens": 3000,
+    "budget_tokens": {  # context tokens per model, leaving room for the question and answer
+        "gpt-3.5-turbo": 2500,
+        "gpt-35-turbo": 2500,
+        "gpt-4": 5000,
+        "gpt-4-32k": 12000,
+        "gpt-4-turbo-preview": 12000,
+        "gpt-4o": 12000
+    }
+}
+
+# LLM Rate Limit Configuration
+RATE_LIMIT_CONFIG = {
+    "enabled": True,
+    # Per-minute budgets per provider; "Provider/model" keys override a single model
+    "limits": {
+        "OpenAI": {"requests_per_minute": 500, "tokens_per_minute": 60000},
+        "Claude": {"requests_per_minute": 50, "tokens_per_minute": 40000},
+        "Azure": {"requests_per_minute": 300, "tokens_per_minute": 50000},
+        "Grok": {"requests_per_minute": 60, "tokens_per_minute": 32000}
+    },
+    "default_limits": {"requests_per_minute": 60, "tokens_per_minute": 40000},
+    "chars_per_token": 4,  # prompt tokens are estimated from its length
+    "completion_tokens": 1000,  # output tokens reserved per call
+    "max_attempts": 5,  # tries per call, including the first
+    "base_delay": 0.5,  # seconds; the backoff ceiling doubles per retry (full jitter)
+    "max_delay": 20,
+    "deadline_seconds": 60  # give up queueing or retrying after this long
+}
+
+# LLM Response Cache Configuration
+RESPONSE_CACHE_CONFIG = {
+    "enabled": True,  # reuse responses to the exact same provider, model, temperature and prompt
+    "path": os.path.join(".cache", "responses.sqlite3"),  # shared by every process on the host
+    "ttl_seconds": 24 * 3600,
+    "max_size_mb": 64
+}
+
+# Re-ranking Configuration
+RERANK_CONFIG = {
+    "enabled": False,  # re-score a larger candidate set with a CPU cross-encoder
+    "model": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    "candidates": 20,  # bi-encoder candidates fetched for re-ranking
+    "batch_size": 32,  # most candidates scored per forward pass
+    "time_budget_ms": 250,  # per query; bi-encoder order is kept when it would be exceeded
+    "reprobe_seconds": 30  # after skipping for a predicted overrun, score again to refresh the estimate
+}
+
+# LLM Client Pool Configuration
+LLM_POOL_CONFIG = {
+    "idle_seconds": 600,  # clients unused for this long are closed
+    "max_clients": 32  # least recently used idle clients are closed beyond this
+}
+
+# Async LLM Configuration
+LLM_ASYNC_CONFIG = {
+    "concurrency": {"OpenAI": 8, "Claude": 4, "Azure": 8, "Grok": 4},  # simultaneous calls per provider
+    "default_concurrency": 4,
+    "hedge_provider": None,  # e.g. "Claude": also ask this provider when the selected one is slow (key from env)
+    "hedge_model": None,  # None = the hedge provider's default model
+    "hedge_delay_ms": 2000  # wait this long for the selected provider before sending the hedge
 }
 
 # PDF Processing Configuration
 PDF_CONFIG = {
     "supported_formats": [".pdf"],
     "max_file_size_mb": 50,
-    "text_extraction_method": "PyPDF2"
+    "text_extraction_method": "PyPDF2",
+    "extraction_workers": os.cpu_count() or 1,  # 1 disables the process pool
+    "min_pages_per_worker": 25,
+    "pages_per_span": 100  # pages per pool task; at most extraction_workers tasks are in flight
 }
 
 # Chat Configuration
@@ -0,0 +1,173 @@
+"""
+Context packing for PDF Knowledge Assistant
+Turns retrieved chunks into the prompt context: merges overlapping or
+adjacent chunks of the same document and, when they overflow the
+per-model token budget, fills it in maximal marginal relevance order
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from ingestion import get_token_encoding
+
+
+def encoding_for_model(model: Optional[str], default: str = "cl100k_base"):
+    """tiktoken encoding of an OpenAI model; other providers are approximated with default"""
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model) if model else get_token_encoding(default)
+    except KeyError:
+        return get_token_encoding(default)
+
+
+def overlap_length(left: str, right: str, limit: int = 4000) -> int:
+    """Length of the longest suffix of left that is also a prefix of right"""
+    for size in range(min(len(left), len(right), limit), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_chunks(documents: List[str], metadatas: List[Dict[str, Any]],
+                 embeddings: Optional[List[List[float]]] = None) -> List[Dict[str, Any]]:
+    """Merge overlapping or adjacent chunks of the same document into passages
+
+    Chunks are adjacent when their start_char/end_char offsets touch or
+    overlap; chunks stored without offsets are merged when their
+    chunk_index values are consecutive and the text overlap can be found.
+    Each passage keeps the best (lowest) retrieval rank of its chunks and
+    the mean embedding of its chunks.
+    """
+    items = []
+    for rank, (text, metadata) in enumerate(zip(documents, metadatas)):
+        metadata = metadata or {}
+        items.append({
+            "text": text,
+            "metadata": metadata,
+            "rank": rank,
+            "key": metadata.get("document_id") or metadata.get("filename") or f"#{rank}",
+            "start": metadata.get("start_char"),
+            "end": metadata.get("end_char"),
+            "index": metadata.get("chunk_index"),
+            "embeddings": [embeddings[rank]] if embeddings is not None and embeddings[rank] is not None else [],
+        })
+
+    def position(item):
+        return (item["key"], item["start"] if item["start"] is not None else -1, item["index"] or 0)
+
+    passages: List[Dict[str, Any]] = []
+    for item in sorted(items, key=position):
+        last = passages[-1] if passages else None
+        if last is None or last["key"] != item["key"]:
+            passages.append(item)
+            continue
+        if last["end"] is not None and item["start"] is not None and item["start"] <= last["end"]:
+            if item["end"] > last["end"]:
+                last["text"] += item["text"][last["end"] - item["start"]:]
+                last["end"] = item["end"]
+        elif (last["start"] is None and last["index"] is not None and item["index"] == last["index"] + 1
+              and overlap_length(last["text"], item["text"])):
+            last["text"] += item["text"][overlap_length(last["text"], item["text"]):]
+            last["index"] = item["index"]
+        else:
+            passages.append(item)
+            continue
+        last["rank"] = min(last["rank"], item["rank"])
+        last["embeddings"] += item["embeddings"]
+
+    for passage in passages:
+        passage["embedding"] = np.mean(passage.pop("embeddings"), axis=0) if passage["embeddings"] else None
+    return sorted(passages, key=lambda passage: passage["rank"])
+
+
+def mmr_order(query_embedding, embeddings: List, mmr_lambda: float = 0.7,
+              max_similarity: Optional[float] = None) -> List[int]:
+    """Indices ordered by maximal marginal relevance: lambda * relevance - (1 - lambda) * redundancy
+
+    With max_similarity, items at least that cosine-similar to an item
+    already chosen are dropped from the order.
+    """
+    if not embeddings:
+        return []
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    relevance = vectors @ (query / max(np.linalg.norm(query), 1e-12))
+    similarity = vectors @ vectors.T
+    order = [int(np.argmax(relevance))]
+    redundancy = similarity[order[0]].copy()
+    remaining = set(range(len(vectors))) - set(order)
+    while remaining:
+        if max_similarity is not None:
+            remaining = {i for i in remaining if redundancy[i] < max_similarity}
+            if not remaining:
+                break
+        candidates = np.fromiter(remaining, dtype=np.int64)
+        scores = mmr_lambda * relevance[candidates] - (1 - mmr_lambda) * redundancy[candidates]
+        best = int(candidates[np.argmax(scores)])
+        order.append(best)
+        remaining.discard(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return order
+
+
+def pack_context(documents: List[str], metadatas: List[Dict[str, Any]], budget_tokens: int, encoding,
+                 query_embedding=None,
+                 embeddings: Optional[Union[List[List[float]], Callable[[], List[Optional[List[float]]]]]] = None,
+                 mmr_lambda: float = 0.7, max_similarity: Optional[float] = None,
+                 separator: str = "\n\n") -> Dict[str, Any]:
+    """Build the prompt context from retrieved chunks within budget_tokens
+
+    When every merged passage fits, they are all used in retrieval order
+    and embeddings are never needed. Otherwise passages are taken in MMR
+    order (retrieval order without embeddings), dropping those at least
+    max_similarity similar to one already taken, and skipped if they no
+    longer fit; a first passage larger than the whole budget is truncated.
+    embeddings may be a callable, so they are only fetched when MMR runs;
+    None entries (e.g. chunks deleted since the search) disable MMR.
+    Returns the context, its sources and token counts before and after
+    packing.
+    """
+    raw_tokens = len(encoding.encode_ordinary(separator.join(documents))) if documents else 0
+    separator_tokens = len(encoding.encode_ordinary(separator))
+    token_cache: Dict[str, list] = {}
+
+    def tokens_of(text: str) -> list:
+        if text not in token_cache:
+            token_cache[text] = encoding.encode_ordinary(text)
+        return token_cache[text]
+
+    passages = merge_chunks(documents, metadatas)
+    total = sum(len(tokens_of(passage["text"])) for passage in passages) + separator_tokens * max(len(passages) - 1, 0)
+    if total > budget_tokens and query_embedding is not None and embeddings is not None:
+        vectors = embeddings() if callable(embeddings) else embeddings
+        passages = merge_chunks(documents, metadatas, vectors)
+        if passages and all(p["embedding"] is not None for p in passages):
+            order = mmr_order(query_embedding, [p["embedding"] for p in passages], mmr_lambda, max_similarity)
+            passages = [passages[i] for i in order]
+
+    selected, used = [], 0
+    for passage in passages:
+        tokens = tokens_of(passage["text"])
+        cost = len(tokens) + (separator_tokens if selected else 0)
+        if used + cost <= budget_tokens:
+            selected.append(passage["text"])
+            used += cost
+        elif not selected:
+            selected.append(encoding.decode(tokens[:budget_tokens]))
+            used = budget_tokens
+        else:
+            continue
+        passage["used"] = True
+
+    used_passages = [passage for passage in passages if passage.get("used")]
+    return {
+        "context": separator.join(selected),
+        "sources": [passage["metadata"].get("filename", "Unknown") for passage in used_passages],
+        "tokens": used,
+        "raw_tokens": raw_tokens,
+        "tokens_saved": max(raw_tokens - used, 0),
+        "passages": len(used_passages),
+        "chunks": len(documents),
+    }
@@ -90,7 +90,8 @@ def demo_search_and_query(vector_db, processor):
         print(f"\nQuery: {query}")
         
         # Search for similar documents
-        results = vector_db.search_similar(query, processor.embeddings_model, n_results=2)
+        # The embedding model comes from the process-wide registry shared with the processor
+        results = vector_db.search_similar(query, n_results=2)
         
         if results and results['documents']:
             print("Relevant context found:")
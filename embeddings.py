@@ -0,0 +1,335 @@
+"""
+Embedding helpers for PDF Knowledge Assistant
+Process-wide embedding model registry, a length-bucketed encoding engine
+with an optional int8-quantized CPU backend, a persistent on-disk cache
+of chunk embeddings keyed by model and chunk text, and an in-memory LRU of
+query embeddings
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+_models: Dict[str, object] = {}
+_model_locks: Dict[str, threading.Lock] = {}
+_caches: Dict[str, "EmbeddingCache"] = {}
+_query_caches: Dict[int, "QueryEmbeddingCache"] = {}
+_registry_lock = threading.Lock()
+
+
+EMBEDDING_BACKENDS = ["torch", "int8"]
+
+
+def model_key(model_name: str, backend: str = "torch") -> str:
+    """Registry and cache key for a model/backend pair"""
+    return model_name if backend == "torch" else f"{model_name}#{backend}"
+
+
+def get_embedding_model(model_name: str, backend: str = "torch"):
+    """Return the process-wide SentenceTransformer for model_name, loading it on first use
+
+    Every Streamlit session, PDFProcessor and VectorDatabase in the process
+    shares one copy of the weights. Loading holds a per-model lock so
+    concurrent first calls load the model once. The "int8" backend is a
+    dynamically quantized copy of the model's Linear layers for CPU inference.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    key = model_key(model_name, backend)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _model_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _models:
+            if backend == "int8":
+                _models[key] = _quantize_int8(model_name)
+            else:
+                from sentence_transformers import SentenceTransformer
+                _models[key] = SentenceTransformer(model_name)
+        return _models[key]
+
+
+def _quantize_int8(model_name: str):
+    """Load a fresh copy of the model with int8 dynamically quantized Linear layers"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def token_lengths(model, texts: List[str]) -> List[int]:
+    """Token count of each text as the model sees it (characters if it has no tokenizer)
+
+    Counts are capped at the model's max_seq_length, since encode truncates
+    there anyway; only input IDs are computed, as plain lists.
+    """
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return [len(text) for text in texts]
+    encoded = tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=getattr(model, "max_seq_length", None),
+        return_attention_mask=False,
+        return_token_type_ids=False,
+    )["input_ids"]
+    return [len(ids) for ids in encoded]
+
+
+def encode_bucketed(model, texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """Encode texts in batches of similar token length, returned in input order
+
+    Sorting by token length keeps short chunks out of batches padded to the
+    longest chunk. Each sorted run of batch_size texts is one bucket, so
+    callers should pass several batches' worth of texts at once.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    order = np.argsort(token_lengths(model, texts), kind="stable")
+    out = None
+    for start in range(0, len(texts), batch_size):
+        bucket = order[start:start + batch_size]
+        vectors = model.encode(
+            [texts[i] for i in bucket],
+            batch_size=len(bucket),
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        if out is None:
+            out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+        out[bucket] = vectors
+    return out
+
+
+class EmbeddingEngine:
+    """Length-bucketed encoder over a registry model and backend"""
+
+    def __init__(self, model_name: str, backend: str = "torch", batch_size: int = 64):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+
+    @property
+    def key(self) -> str:
+        return model_key(self.model_name, self.backend)
+
+    @property
+    def model(self):
+        return get_embedding_model(self.model_name, self.backend)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts into a float32 matrix, one row per text"""
+        return encode_bucketed(self.model, texts, self.batch_size)
+
+
+def get_embedding_cache(path: str, max_size_mb: float = 512) -> "EmbeddingCache":
+    """Return the process-wide EmbeddingCache for path, opening it on first use"""
+    with _registry_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path, max_size_mb)
+        return _caches[path]
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so formatting-only differences share a cache entry"""
+    return " ".join(text.split())
+
+
+def text_key(text: str) -> str:
+    """Cache key for a chunk: SHA-1 of its normalized text"""
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed cache of (model name, normalized chunk hash) -> embedding
+
+    The database file can be shared by several processes on the same host.
+    When the stored vectors exceed max_size_mb, the least recently used
+    entries are evicted down to 90% of the limit.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 512):
+        self.path = path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL,"
+                " last_access REAL NOT NULL, PRIMARY KEY (model, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_access)")
+        self._size = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return the cached embedding for each text, or None for a miss"""
+        keys = [text_key(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        unique = list(set(keys))
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE model = ? AND key = ?",
+                        [(now, model, key) for key in found],
+                    )
+            results = [found.get(key) for key in keys]
+            hits = sum(result is not None for result in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """Store embeddings for texts, evicting old entries if over the size limit"""
+        now = time.time()
+        rows = [
+            (model, text_key(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._size += sum(len(row[2]) for row in rows)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until under 90% of the size limit"""
+        self._size = self._stored_bytes()
+        target = int(self.max_bytes * 0.9)
+        with self._conn:
+            while self._size > target:
+                rows = self._conn.execute(
+                    "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT 1000"
+                ).fetchall()
+                if not rows:
+                    break
+                freed = 0
+                doomed = []
+                for rowid, size in rows:
+                    doomed.append((rowid,))
+                    freed += size
+                    if self._size - freed <= target:
+                        break
+                self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", doomed)
+                self._size -= freed
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters since this cache object was created"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_mb": self._size / (1024 * 1024),
+        }
+
+    def close(self):
+        """Close the underlying database connection"""
+        self._conn.close()
+
+
+def get_query_cache(max_entries: int = 1024) -> "QueryEmbeddingCache":
+    """Return the process-wide QueryEmbeddingCache holding up to max_entries queries"""
+    with _registry_lock:
+        if max_entries not in _query_caches:
+            _query_caches[max_entries] = QueryEmbeddingCache(max_entries)
+        return _query_caches[max_entries]
+
+
+class QueryEmbeddingCache:
+    """In-memory LRU of (model, normalized query text) -> query embedding
+
+    Keys hold the model object itself, hashed by identity, so vectors from
+    different models or backends never mix and a model swap needs no
+    explicit flush. Query embeddings do not depend on the indexed documents.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def encode(self, model, query: str) -> np.ndarray:
+        """Embedding of query under model, encoding it only on a miss"""
+        return self.encode_many(model, [query])[0]
+
+    def encode_many(self, model, queries: List[str]) -> np.ndarray:
+        """Embeddings of queries as a matrix; all misses are encoded in one batch"""
+        keys = [(model, normalize_text(query)) for query in queries]
+        found: Dict[tuple, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+            hits = sum(key in found for key in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        missing = {key: query for key, query in zip(keys, queries) if key not in found}
+        if missing:
+            vectors = np.asarray(
+                model.encode(list(missing.values()), batch_size=len(missing), show_progress_bar=False),
+                dtype=np.float32
+            )
+            vectors.setflags(write=False)
+            found.update(zip(missing, vectors))
+            with self._lock:
+                for key in missing:
+                    self._entries[key] = found[key]
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return np.stack([found[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def clear(self):
+        """Drop every cached query embedding"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters since this cache object was created"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
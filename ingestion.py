@@ -0,0 +1,370 @@
+"""
+Ingestion helpers for PDF Knowledge Assistant
+Page-level PDF text extraction that can be spread across worker processes,
+character and token-aware chunkers, and a streaming
+extract -> chunk -> embed -> store pipeline
+"""
+
+import os
+import re
+import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import PyPDF2
+
+
+def split_page_range(num_pages: int, workers: int) -> List[Tuple[int, int]]:
+    """Split [0, num_pages) into at most `workers` contiguous (start, stop) spans"""
+    workers = max(1, min(workers, num_pages))
+    base, extra = divmod(num_pages, workers)
+    spans = []
+    start = 0
+    for i in range(workers):
+        stop = start + base + (1 if i < extra else 0)
+        if stop > start:
+            spans.append((start, stop))
+        start = stop
+    return spans
+
+
+def _extract_page_span(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Worker entry point: extract the text of pages [start, stop) from a PDF on disk"""
+    reader = PyPDF2.PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def _read_pdf_bytes(pdf_file) -> bytes:
+    """Return the raw bytes of an uploaded file, file object or path"""
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as f:
+            return f.read()
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+
+def content_hash(data: bytes) -> str:
+    """Fingerprint an uploaded file by the SHA-256 of its bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_hash(chunk: str, model: str = "") -> str:
+    """Fingerprint a chunk of text so identical chunks can share one embedding
+
+    With model (an EmbeddingEngine key) the fingerprint also covers the
+    model, so embeddings are only shared between chunks embedded alike.
+    """
+    if model:
+        chunk = f"{model}\0{chunk}"
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()
+
+
+def chunk_id(document_id: str, chunk_index: int) -> str:
+    """Stable, globally unique ID for a chunk: owning document plus position"""
+    return f"{document_id}:{chunk_index}"
+
+
+def iter_pages(pdf_file, workers: int = 1, min_pages_per_worker: int = 25,
+               pages_per_span: int = 100) -> Iterator[str]:
+    """Yield the text of every page, in page order
+
+    With workers > 1 the page range is split into contiguous spans of at
+    most `pages_per_span` pages that are extracted in a process pool, with
+    at most `workers` spans in flight so memory stays bounded however far
+    the consumer lags. Small documents (fewer than `min_pages_per_worker`
+    pages per worker) stay on the sequential path, where pool start-up
+    would cost more than it saves.
+    """
+    if isinstance(pdf_file, (str, os.PathLike)):
+        pdf_path, cleanup = os.fspath(pdf_file), False
+    else:
+        # Workers reopen the PDF from disk instead of receiving a pickled copy each
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(_read_pdf_bytes(pdf_file))
+            pdf_path, cleanup = tmp.name, True
+
+    try:
+        reader = PyPDF2.PdfReader(pdf_path)
+        num_pages = len(reader.pages)
+        workers = min(workers, num_pages // max(1, min_pages_per_worker))
+        if workers <= 1:
+            for page in reader.pages:
+                yield page.extract_text()
+            return
+
+        spans = iter(split_page_range(num_pages, max(workers, -(-num_pages // pages_per_span))))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = deque(pool.submit(_extract_page_span, pdf_path, start, stop)
+                              for start, stop in islice(spans, workers))
+            while in_flight:
+                pages = in_flight.popleft().result()
+                for start, stop in islice(spans, 1):
+                    in_flight.append(pool.submit(_extract_page_span, pdf_path, start, stop))
+                yield from pages
+    finally:
+        if cleanup:
+            os.unlink(pdf_path)
+
+
+def extract_pages(pdf_file, workers: int = 1, min_pages_per_worker: int = 25,
+                  pages_per_span: int = 100) -> List[str]:
+    """Extract the text of every page, in page order"""
+    return list(iter_pages(pdf_file, workers, min_pages_per_worker, pages_per_span))
+
+
+def iter_chunk_spans(pages: Iterable[str], chunk_size: int = 1000,
+                     overlap: int = 200) -> Iterator[Tuple[str, int, int]]:
+    """Stream overlapping fixed-size character chunks as (text, start, end)
+
+    Produces exactly the chunks PDFProcessor.chunk_text would for the joined
+    document ("page\\n" per page) while holding at most one chunk plus one
+    page of text at a time. start/end are character offsets into that
+    joined document.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    step = chunk_size - overlap
+    buffer = ""
+    position = 0  # start of the next chunk in buffer; the consumed prefix is dropped once per page
+    offset = 0
+    for page in pages:
+        buffer = buffer[position:] + page + "\n"
+        position = 0
+        while len(buffer) - position >= chunk_size:
+            yield buffer[position:position + chunk_size], offset, offset + chunk_size
+            position += step
+            offset += step
+    while position < len(buffer):
+        yield buffer[position:position + chunk_size], offset, offset + min(chunk_size, len(buffer) - position)
+        position += step
+        offset += step
+
+
+def iter_chunks(pages: Iterable[str], chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+    """Stream overlapping fixed-size character chunks out of page texts"""
+    for text, _, _ in iter_chunk_spans(pages, chunk_size, overlap):
+        yield text
+
+
+# A segment runs to the end of a sentence (plus trailing whitespace) or a line.
+# Possessive runs of non-boundary characters avoid a lazy scan retried at every character.
+_SEGMENT_RE = re.compile(r'[^.!?\n]*+(?:[.!?]["\')\]]*+(?!\s)[^.!?\n]*+)*+(?:[.!?]["\')\]]*+\s+|\n\s*|$)')
+# Characters of page text whose segments are token-counted in one batch call
+_COUNT_BATCH_CHARS = 1 << 18
+_WORD_RE = re.compile(r'\s*\S+\s*|\s+')
+
+
+@lru_cache(maxsize=None)
+def get_token_encoding(name: str = "cl100k_base"):
+    """Load (once per process) the tiktoken encoding used to measure chunks"""
+    import tiktoken
+    return tiktoken.get_encoding(name)
+
+
+def _split_oversized(text: str, start: int, encoding, max_tokens: int) -> List[Tuple[str, int, int, bool]]:
+    """Break a segment longer than max_tokens at word boundaries (or, for giant words, characters)"""
+    words = [word for word in _WORD_RE.findall(text) if word]
+    counts = [len(ids) for ids in encoding.encode_ordinary_batch(words)]
+    pieces = []
+    piece, piece_tokens = "", 0
+    for word, tokens in zip(words, counts):
+        if tokens > max_tokens:
+            step = max(1, len(word) * max_tokens // (tokens + 1))
+            parts = [word[i:i + step] for i in range(0, len(word), step)]
+        else:
+            parts = [word]
+        for part in parts:
+            part_tokens = tokens if len(parts) == 1 else len(encoding.encode_ordinary(part))
+            if piece and piece_tokens + part_tokens > max_tokens:
+                pieces.append((piece, start, piece_tokens, False))
+                start += len(piece)
+                piece, piece_tokens = "", 0
+            piece += part
+            piece_tokens += part_tokens
+    if piece:
+        pieces.append((piece, start, piece_tokens, False))
+    return pieces
+
+
+def iter_token_chunks(pages: Iterable[str], max_tokens: int = 200, overlap_tokens: int = 32,
+                      encoding=None) -> Iterator[Tuple[str, int, int]]:
+    """Stream token-budgeted chunks as (text, start, end) in a single pass
+
+    Pages are split into sentence/line segments, each segment's tokens are
+    counted once with tiktoken (one batch call per _COUNT_BATCH_CHARS of
+    pages), and segments are packed greedily up to max_tokens. When a chunk
+    fills up it is cut at the last paragraph boundary in its second half if
+    there is one, otherwise at the last sentence boundary. Consecutive chunks share up to overlap_tokens of
+    whole trailing segments. start/end are character offsets into the
+    joined document ("page\\n" per page), as with iter_chunk_spans.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+    encoding = encoding or get_token_encoding()
+    min_fill = max_tokens // 2
+
+    # Each entry: (text, start, tokens, ends_paragraph)
+    buffer: deque = deque()
+    buffered_tokens = 0
+    carried = 0  # leading entries of buffer that are overlap from the previous chunk
+
+    def emit(everything: bool):
+        nonlocal buffered_tokens, carried
+        cut = len(buffer)
+        if not everything:
+            total = 0
+            for i, (_, _, tokens, ends_paragraph) in enumerate(buffer):
+                total += tokens
+                if ends_paragraph and i >= carried and total >= min_fill and i + 1 < len(buffer):
+                    cut = i + 1
+        chunk = [buffer.popleft() for _ in range(cut)]
+        text = "".join(entry[0] for entry in chunk)
+        first, last = chunk[0], chunk[-1]
+
+        # Carry whole trailing segments (never the entire chunk) as overlap
+        overlap = []
+        overlap_total = 0
+        for entry in reversed(chunk[1:]):
+            if overlap_total + entry[2] > overlap_tokens:
+                break
+            overlap.append(entry)
+            overlap_total += entry[2]
+        buffer.extendleft(overlap)
+        carried = len(overlap)
+        buffered_tokens = sum(entry[2] for entry in buffer)
+        return text, first[1], last[1] + len(last[0])
+
+    def counted(pages: Iterable[str]) -> Iterator[Tuple[str, int, bool]]:
+        """(text, tokens, ends_paragraph) of every segment, counting tokens one page batch at a time"""
+        texts, ends, size = [], [], 0
+        for page in pages:
+            page_texts = [text for text in _SEGMENT_RE.findall(page + "\n") if text]
+            ends.extend(text.count("\n") >= 2 for text in page_texts)
+            ends[-1] = True
+            texts.extend(page_texts)
+            size += len(page)
+            if size >= _COUNT_BATCH_CHARS:
+                yield from zip(texts, map(len, encoding.encode_ordinary_batch(texts)), ends)
+                texts, ends, size = [], [], 0
+        if texts:
+            yield from zip(texts, map(len, encoding.encode_ordinary_batch(texts)), ends)
+
+    def segments_of(pages: Iterable[str]) -> Iterator[Tuple[str, int, int, bool]]:
+        start = 0
+        for text, tokens, ends_paragraph in counted(pages):
+            if tokens > max_tokens:
+                pieces = _split_oversized(text, start, encoding, max_tokens)
+                pieces[-1] = pieces[-1][:3] + (ends_paragraph,)
+                yield from pieces
+            else:
+                yield text, start, tokens, ends_paragraph
+            start += len(text)
+
+    for segment in segments_of(pages):
+        while buffer and buffered_tokens + segment[2] > max_tokens:
+            if carried == len(buffer):
+                # Only overlap left: drop it rather than emit a duplicate chunk
+                buffer.clear()
+                buffered_tokens = carried = 0
+            else:
+                yield emit(everything=False)
+        buffer.append(segment)
+        buffered_tokens += segment[2]
+
+    if len(buffer) > carried:
+        yield emit(everything=True)
+
+
+def batched(items: Iterable, batch_size: int) -> Iterator[List]:
+    """Group an iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_ingestion(pages: Iterable[str], processor, vector_db, base_metadata: Dict[str, Any],
+                  chunk_size: int = 1000, overlap: int = 200, batch_size: int = 64,
+                  preview_chars: int = 500, reuse_embeddings: bool = True,
+                  unit: str = "characters", encoding=None) -> Dict[str, Any]:
+    """Stream pages -> chunks -> embeddings -> vector store in fixed-size batches
+
+    `processor` needs create_embeddings(chunks) and may name the model
+    they come from as embedding_key; `vector_db` needs
+    add_documents(chunks, embeddings, metadata). Only one batch of embeddings
+    (and at most two batches of chunk text) is alive at a time, so peak
+    memory follows batch_size rather than the document size.
+
+    unit="tokens" measures chunk_size and overlap in tokens with the
+    boundary-respecting iter_token_chunks; "characters" uses the plain
+    sliding window. Each chunk records its start_char/end_char offsets.
+
+    With reuse_embeddings, each chunk is fingerprinted with chunk_hash (text
+    plus embedding_key) and chunks already in the store (via get_embeddings_by_chunk_hash) or repeated
+    within the batch reuse that embedding instead of being encoded again.
+
+    The last chunk is written with document_complete=True (the next batch is
+    read ahead to know which one is last), so a document whose ingestion
+    failed partway is never mistaken for a finished one.
+    """
+    preview = ""
+
+    def tap(page_iter):
+        nonlocal preview
+        for page in page_iter:
+            if len(preview) <= preview_chars:
+                preview += (page + "\n")[:preview_chars + 1 - len(preview)]
+            yield page
+
+    embedding_key = getattr(processor, "embedding_key", "")
+    total_chunks = 0
+    batches = 0
+    reused = 0
+    if unit == "tokens":
+        spans = iter_token_chunks(tap(pages), chunk_size, overlap, encoding)
+    else:
+        spans = iter_chunk_spans(tap(pages), chunk_size, overlap)
+    span_batches = batched(spans, batch_size)
+    span_batch = next(span_batches, None)
+    while span_batch is not None:
+        next_batch = next(span_batches, None)
+        batch = [text for text, _, _ in span_batch]
+        hashes = [chunk_hash(chunk, embedding_key) for chunk in batch]
+        known = vector_db.get_embeddings_by_chunk_hash(hashes) if reuse_embeddings else {}
+        missing = {}
+        for chunk, h in zip(batch, hashes):
+            if h not in known and h not in missing:
+                missing[h] = chunk
+        if missing:
+            known.update(zip(missing, processor.create_embeddings(list(missing.values()))))
+        embeddings = [known[h] for h in hashes]
+        reused += len(batch) - len(missing)
+
+        metadata = [
+            dict(base_metadata, chunk_index=total_chunks + j, chunk_hash=hashes[j],
+                 start_char=span_batch[j][1], end_char=span_batch[j][2])
+            for j in range(len(batch))
+        ]
+        if next_batch is None:
+            metadata[-1]["document_complete"] = True
+        vector_db.add_documents(batch, embeddings, metadata)
+        total_chunks += len(batch)
+        batches += 1
+        span_batch = next_batch
+
+    return {
+        "chunks": total_chunks,
+        "batches": batches,
+        "reused_embeddings": reused,
+        "preview": preview[:preview_chars] + "..." if len(preview) > preview_chars else preview,
+    }
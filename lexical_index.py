@@ -0,0 +1,268 @@
+"""
+Lexical search for PDF Knowledge Assistant
+Incremental BM25 inverted index kept next to the embeddings, and reciprocal
+rank fusion for combining lexical and dense rankings
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import threading
+from collections import Counter, OrderedDict
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Keep identifiers such as "PX-00042", "3.2.1" or "ERR_TIMEOUT" as single terms
+_TERM_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+# Metadata fields whose values map to chunk IDs, so searches can be scoped without a store query
+SCOPE_FIELDS = ("document_id", "filename")
+# Dropped from queries unless the query has nothing else; still indexed
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what "
+    "when where which who why with how does do did can".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms for indexing and querying"""
+    return _TERM_RE.findall(text.lower())
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several ranked ID lists: score(id) = sum of 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """Inverted index of term -> {chunk id: term frequency} with BM25 scoring
+
+    Term lookup is a single dict access. Query stopwords are dropped, and
+    terms found in more than max_df of the chunks only re-score chunks that
+    a rarer query term already matched, so one common word does not walk
+    a posting list the size of the corpus. Scoring runs on per-term
+    snapshots taken under the lock, so searches do not block writers; the
+    most recently used snapshots are kept for later queries up to
+    max_snapshot_postings postings in total.
+
+    Chunks added with metadata are also listed under their SCOPE_FIELDS
+    values, so scoped_ids can turn a document scope into the allowed_ids
+    of a search. Adds and removals update the postings incrementally, and
+    with a path every change is appended to a JSON-lines journal that is
+    replayed on open and rewritten once it holds compaction_ratio times
+    more entries than live chunks.
+    """
+
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75, max_df: float = 0.1,
+                 compaction_ratio: float = 2.0, max_snapshot_postings: int = 200_000):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_df = max_df
+        self.compaction_ratio = compaction_ratio
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self.max_snapshot_postings = max_snapshot_postings
+        self._snapshots: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self._snapshot_postings = 0
+        self._doc_terms: Dict[str, Tuple[str, ...]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._doc_scopes: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+        self._scopes: Dict[Tuple[str, str], Set[str]] = {}
+        self._total_length = 0
+        self._journal_entries = 0
+        # False once any chunk was indexed without its metadata (scoped_ids would miss it)
+        self.scoped = True
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._doc_lengths
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["op"] == "add":
+                    self._add(entry["id"], entry["terms"], entry.get("scopes"))
+                else:
+                    for id in entry["ids"]:
+                        self._remove(id)
+                self._journal_entries += 1
+
+    def _journal(self, entries: List[Dict]):
+        if self.path and entries:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+            self._journal_entries += len(entries)
+            if self._journal_entries > self.compaction_ratio * max(len(self._doc_lengths), 1000):
+                self.compact()
+
+    def compact(self):
+        """Rewrite the journal as one add entry per live chunk"""
+        with self._lock:
+            if not self.path:
+                return
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                for id, terms in self._doc_terms.items():
+                    entry = {"op": "add", "id": id, "terms": {term: self._postings[term][id] for term in terms}}
+                    if self.scoped:
+                        entry["scopes"] = self._doc_scopes.get(id, ())
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(temp_path, self.path)
+            self._journal_entries = len(self._doc_terms)
+
+    def _add(self, id: str, terms: Dict[str, int], scopes: Optional[Iterable] = None):
+        if id in self._doc_lengths:
+            self._remove(id)
+        if scopes is None:
+            self.scoped = False
+        elif scopes:
+            self._doc_scopes[id] = tuple((field, value) for field, value in scopes)
+            for scope in self._doc_scopes[id]:
+                self._scopes.setdefault(scope, set()).add(id)
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[id] = tf
+        if self._snapshots:
+            for term in terms:
+                self._drop_snapshot(term)
+        length = sum(terms.values())
+        self._doc_terms[id] = tuple(terms)
+        self._doc_lengths[id] = length
+        self._total_length += length
+
+    def _remove(self, id: str):
+        if id not in self._doc_lengths:
+            return
+        for term in self._doc_terms.pop(id):
+            if self._snapshots:
+                self._drop_snapshot(term)
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(id)
+        for scope in self._doc_scopes.pop(id, ()):
+            ids = self._scopes.get(scope)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self._scopes[scope]
+
+    def add(self, ids: List[str], texts: List[str], metadatas: List[Optional[Dict]] = None):
+        """Index (or re-index) chunks by ID, listing them under their metadata's SCOPE_FIELDS values"""
+        with self._lock:
+            entries = []
+            for i, (id, text) in enumerate(zip(ids, texts)):
+                terms = dict(Counter(tokenize(text)))
+                entry = {"op": "add", "id": id, "terms": terms}
+                if metadatas is not None:
+                    metadata = metadatas[i] or {}
+                    entry["scopes"] = [(field, metadata[field]) for field in SCOPE_FIELDS if field in metadata]
+                self._add(id, terms, entry.get("scopes"))
+                entries.append(entry)
+            self._journal(entries)
+
+    def remove(self, ids: List[str]):
+        """Drop chunks from the index"""
+        with self._lock:
+            ids = [id for id in ids if id in self._doc_lengths]
+            for id in ids:
+                self._remove(id)
+            if ids:
+                self._journal([{"op": "remove", "ids": ids}])
+
+    def scoped_ids(self, field: str, values: Iterable[str]) -> Set[str]:
+        """IDs of chunks whose metadata field has one of values"""
+        with self._lock:
+            return set().union(*(self._scopes.get((field, value), ()) for value in values))
+
+    def postings(self, term: str) -> Dict[str, int]:
+        """Chunk ID -> term frequency for one (already tokenized) term"""
+        return self._postings.get(term, {})
+
+    def _snapshot(self, term: str) -> Dict[str, int]:
+        """Read-only copy of a term's postings, reused until the term next changes or is evicted"""
+        snapshot = self._snapshots.get(term)
+        if snapshot is not None:
+            self._snapshots.move_to_end(term)
+            return snapshot
+        snapshot = dict(self._postings.get(term, {}))
+        if len(snapshot) <= self.max_snapshot_postings:
+            self._snapshots[term] = snapshot
+            self._snapshot_postings += len(snapshot)
+            while self._snapshot_postings > self.max_snapshot_postings:
+                _, evicted = self._snapshots.popitem(last=False)
+                self._snapshot_postings -= len(evicted)
+        return snapshot
+
+    def _drop_snapshot(self, term: str):
+        snapshot = self._snapshots.pop(term, None)
+        if snapshot is not None:
+            self._snapshot_postings -= len(snapshot)
+
+    def search(self, query: str, n_results: int = 10, allowed_ids: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Top chunks by BM25 score as (id, score), optionally restricted to allowed_ids"""
+        terms = set(tokenize(query))
+        terms = terms - STOPWORDS or terms
+        with self._lock:
+            n = len(self._doc_lengths)
+            if not n:
+                return []
+            avg_length = self._total_length / n
+            postings_by_term = [self._snapshot(term) for term in terms if term in self._postings]
+            doc_lengths = self._doc_lengths
+
+        scores: Dict[str, float] = {}
+        for postings in sorted(postings_by_term, key=len):
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            if scores and len(postings) > self.max_df * n:
+                # Common term: only re-score chunks a rarer term already matched
+                candidates = list(scores)
+            elif allowed_ids is not None and len(allowed_ids) < len(postings):
+                candidates = allowed_ids
+            else:
+                candidates = postings
+            for id in candidates:
+                tf = postings.get(id)
+                length = doc_lengths.get(id)
+                if tf is None or length is None or (allowed_ids is not None and id not in allowed_ids):
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[id] = scores.get(id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(n_results, scores.items(), key=itemgetter(1))
+
+
+_indexes: Dict[Tuple[Optional[str], str], BM25Index] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(directory: Optional[str], collection_name: str) -> BM25Index:
+    """Return the process-wide BM25Index for a collection (journaled under directory if given)"""
+    key = (os.path.abspath(directory) if directory else None, collection_name)
+    with _indexes_lock:
+        if key not in _indexes:
+            path = os.path.join(key[0], "lexical", f"{collection_name}.jsonl") if key[0] else None
+            _indexes[key] = BM25Index(path)
+        return _indexes[key]
+
+
+def drop_lexical_index(directory: Optional[str], collection_name: str):
+    """Forget a collection's BM25Index and delete its journal"""
+    key = (os.path.abspath(directory) if directory else None, collection_name)
+    with _indexes_lock:
+        index = _indexes.pop(key, None)
+    if index and index.path and os.path.exists(index.path):
+        os.remove(index.path)
@@ -0,0 +1,159 @@
+"""
+Async LLM calls for PDF Knowledge Assistant
+A process-wide event loop for provider calls, per-provider concurrency
+limits and hedged requests that race a second provider against a slow one
+"""
+
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from metrics import LatencyRecorder
+
+# (provider name, zero-argument coroutine function producing the answer)
+LLMCall = Tuple[str, Callable[[], Awaitable[str]]]
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_llm_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide event loop for LLM calls, running in a daemon thread
+
+    Async SDK clients and semaphores are bound to the loop they are first
+    used on, so every pooled client must only ever be awaited here.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+        return _loop
+
+
+def run_sync(coroutine: Awaitable[Any], timeout: float = None) -> Any:
+    """Run a coroutine on the LLM loop from synchronous code (e.g. a Streamlit script) and wait for it"""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_llm_loop()).result(timeout)
+
+
+class LLMRouter:
+    """Concurrency-limited, optionally hedged LLM calls
+
+    At most concurrency[provider] calls (default_concurrency for unlisted
+    providers) run at once per provider, streamed answers included; further
+    callers wait their turn. A hedged call starts the primary, and if it has not answered after
+    hedge_delay seconds (or failed sooner) sends the same prompt to the
+    secondary. The first answer wins and the other call is cancelled.
+    """
+
+    def __init__(self, concurrency: Dict[str, int] = None, default_concurrency: int = 4):
+        self.concurrency = dict(concurrency or {})
+        self.default_concurrency = default_concurrency
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.latency = LatencyRecorder()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        """The provider's semaphore; only call on the LLM loop"""
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = self._semaphores[provider] = asyncio.Semaphore(
+                self.concurrency.get(provider, self.default_concurrency)
+            )
+        return semaphore
+
+    async def generate(self, provider: str, call: Callable[[], Awaitable[str]]) -> str:
+        """Run one provider call within that provider's concurrency limit"""
+        async with self._semaphore(provider):
+            return await call()
+
+    async def _acquire(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self._semaphore(provider)
+        await semaphore.acquire()
+        return semaphore
+
+    def stream(self, provider: str, pieces: Iterable[str]) -> Iterator[str]:
+        """Iterate a synchronous streamed answer within the provider's concurrency limit
+
+        The slot is taken (on the LLM loop) before the first piece is
+        requested and released once the stream is exhausted, fails or is
+        closed.
+        """
+        semaphore = run_sync(self._acquire(provider))
+        try:
+            yield from pieces
+        finally:
+            get_llm_loop().call_soon_threadsafe(semaphore.release)
+
+    async def hedged(self, primary: LLMCall, secondary: Optional[LLMCall] = None,
+                     hedge_delay: float = 2.0) -> Dict[str, Any]:
+        """First successful answer of primary and (after hedge_delay) secondary
+
+        Returns the answer, the provider that produced it, whether a hedge
+        was sent and the elapsed seconds. If every call fails, the
+        primary's error is raised.
+        """
+        start = time.perf_counter()
+        first = asyncio.ensure_future(self.generate(*primary))
+        hedge = None
+        winner = None
+        try:
+            pending = {first}
+            if secondary is not None:
+                await asyncio.wait(pending, timeout=hedge_delay)
+                if not first.done() or first.exception() is not None:
+                    hedge = asyncio.ensure_future(self.generate(*secondary))
+                    pending = {first, hedge}
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda task: task is hedge):
+                    if task.exception() is None:
+                        winner = task
+                        break
+        finally:
+            tasks = [task for task in (first, hedge) if task is not None]
+            for task in tasks:
+                task.cancel()
+            # Drain the losers and retrieve every exception so none is reported as never retrieved
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        seconds = time.perf_counter() - start
+        self.requests += 1
+        self.hedges += hedge is not None
+        self.latency.record({"llm": seconds})
+        if winner is None:
+            raise first.exception()
+        self.hedge_wins += winner is hedge
+        return {
+            "answer": winner.result(),
+            "provider": (secondary if winner is hedge else primary)[0],
+            "hedged": hedge is not None,
+            "seconds": seconds,
+        }
+
+    def stats(self) -> Dict[str, float]:
+        """Request and hedge counts, hedge rate and latency percentiles (ms)"""
+        summary = self.latency.summary().get("llm", {})
+        return {
+            "requests": self.requests,
+            "hedged": self.hedges,
+            "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            **{key: value for key, value in summary.items() if key != "count"},
+        }
+
+
+_routers: Dict[tuple, LLMRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_llm_router(concurrency: Dict[str, int] = None, default_concurrency: int = 4) -> LLMRouter:
+    """Return the process-wide LLMRouter for these limits"""
+    key = (tuple(sorted((concurrency or {}).items())), default_concurrency)
+    with _routers_lock:
+        if key not in _routers:
+            _routers[key] = LLMRouter(concurrency, default_concurrency)
+        return _routers[key]
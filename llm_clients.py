@@ -0,0 +1,152 @@
+"""
+LLM client pooling for PDF Knowledge Assistant
+A process-wide pool of provider clients keyed by provider, model, endpoint
+and a hash of the API key, so HTTP connections are reused across questions
+and Streamlit sessions and idle clients are closed
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+
+def client_key(provider: str, model: Optional[str], endpoint: Optional[str], api_key: str) -> tuple:
+    """Pool key for a client; the API key is only kept as a SHA-256 digest"""
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    return (provider, model, endpoint, digest)
+
+
+class ClientPool:
+    """Reusable clients leased per request, evicted after idle_seconds without use
+
+    A lease marks its client busy, so clients are never closed while a
+    request (or a response stream) is still using them. When more than
+    max_clients are pooled, the least recently used idle ones are closed.
+    Clients are built once per key even under concurrent first use.
+    """
+
+    def __init__(self, idle_seconds: float = 600, max_clients: int = 32):
+        self.idle_seconds = idle_seconds
+        self.max_clients = max_clients
+        self._entries: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    @contextmanager
+    def lease(self, key: Hashable, factory: Callable[[], Any]) -> Iterator[Any]:
+        """Borrow the client for key, building it with factory if it is not pooled"""
+        entry = self._acquire(key, factory)
+        try:
+            yield entry["client"]
+        finally:
+            with self._lock:
+                entry["busy"] -= 1
+                entry["last_used"] = time.monotonic()
+                close = entry["discarded"] and not entry["busy"]
+            if close:
+                self._close(entry["client"])
+            self.evict_idle()
+
+    def _acquire(self, key: Hashable, factory: Callable[[], Any]) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["busy"] += 1
+                self._entries.move_to_end(key)
+                self.reused += 1
+                return entry
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry["busy"] += 1
+                    self._entries.move_to_end(key)
+                    self.reused += 1
+                    return entry
+            # Build outside the pool lock: constructing a client can be slow
+            client = factory()
+            with self._lock:
+                entry = {"client": client, "busy": 1, "last_used": time.monotonic(), "discarded": False}
+                self._entries[key] = entry
+                self.created += 1
+                return entry
+
+    def discard(self, key: Hashable):
+        """Drop a client (e.g. one that failed to configure) so the next lease rebuilds it
+
+        A client still leased is closed when its last lease is released.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            self._key_locks.pop(key, None)
+            if entry is not None:
+                entry["discarded"] = True
+        if entry is not None and not entry["busy"]:
+            self._close(entry["client"])
+
+    def evict_idle(self) -> int:
+        """Close clients idle for longer than idle_seconds, then trim to max_clients"""
+        now = time.monotonic()
+        closing = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if not entry["busy"] and now - entry["last_used"] > self.idle_seconds:
+                    closing.append(self._entries.pop(key)["client"])
+                    self._key_locks.pop(key, None)
+            for key, entry in list(self._entries.items()):
+                if len(self._entries) <= self.max_clients:
+                    break
+                if not entry["busy"]:
+                    closing.append(self._entries.pop(key)["client"])
+                    self._key_locks.pop(key, None)
+            self.evicted += len(closing)
+        for client in closing:
+            self._close(client)
+        return len(closing)
+
+    @staticmethod
+    def _close(client: Any):
+        close = getattr(client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._key_locks.clear()
+        for entry in entries:
+            self._close(entry["client"])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "clients": len(self._entries),
+                "busy": sum(1 for entry in self._entries.values() if entry["busy"]),
+                "created": self.created,
+                "reused": self.reused,
+                "evicted": self.evicted,
+            }
+
+
+_pools: Dict[tuple, ClientPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_client_pool(idle_seconds: float = 600, max_clients: int = 32) -> ClientPool:
+    """Return the process-wide ClientPool for these settings"""
+    key = (idle_seconds, max_clients)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ClientPool(idle_seconds, max_clients)
+        return _pools[key]
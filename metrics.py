@@ -0,0 +1,106 @@
+"""
+Latency metrics for PDF Knowledge Assistant
+Per-request stage timers and a process-wide recorder that keeps a window of
+recent samples per stage and summarizes them as percentiles
+"""
+
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterable, Iterator
+
+import numpy as np
+
+
+class StageTimer:
+    """Wall-clock seconds per named stage of one request"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def milliseconds(self) -> Dict[str, float]:
+        """Timings rounded to 0.1 ms, for display and chat history"""
+        return {name: round(seconds * 1000, 1) for name, seconds in self.timings.items()}
+
+
+def timed_stream(chunks: Iterable[str], timer: StageTimer, first: str = "ttft", total: str = "llm") -> Iterator[str]:
+    """Pass a token stream through, timing the first non-empty chunk and the whole stream
+
+    Both stages are measured from the first request for a chunk, so the
+    time to first token includes connecting to the provider.
+    """
+    start = time.perf_counter()
+    pending = True
+    try:
+        for chunk in chunks:
+            if pending and chunk:
+                timer.add(first, time.perf_counter() - start)
+                pending = False
+            yield chunk
+    finally:
+        timer.add(total, time.perf_counter() - start)
+
+
+class LatencyRecorder:
+    """Bounded window of recent latency samples per stage"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, timings: Dict[str, float]):
+        """Add one request's stage timings (seconds)"""
+        with self._lock:
+            for name, seconds in timings.items():
+                self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean and p50/p95/p99 in milliseconds per stage"""
+        with self._lock:
+            samples = {name: np.asarray(values) * 1000 for name, values in self._samples.items() if values}
+        return {
+            name: {
+                "count": len(values),
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+            }
+            for name, values in samples.items()
+        }
+
+    def export_json(self) -> str:
+        """Summary plus raw samples (ms) as JSON"""
+        with self._lock:
+            samples = {name: [round(value * 1000, 3) for value in values] for name, values in self._samples.items()}
+        return json.dumps({"summary": self.summary(), "samples_ms": samples}, indent=2)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+_recorders: Dict[str, LatencyRecorder] = {}
+_recorders_lock = threading.Lock()
+
+
+def get_latency_recorder(name: str = "chat") -> LatencyRecorder:
+    """Return the process-wide LatencyRecorder with this name"""
+    with _recorders_lock:
+        if name not in _recorders:
+            _recorders[name] = LatencyRecorder()
+        return _recorders[name]
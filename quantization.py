@@ -0,0 +1,175 @@
+"""
+Vector quantization for PDF Knowledge Assistant
+Compressed codes for the NumPy backend: int8 scalar quantization and
+product quantization, both scoring squared L2 distances or inner products
+straight from codes
+"""
+
+from typing import Dict
+
+import numpy as np
+
+# Rows converted to float per block while scanning codes, bounding temporary memory
+SCAN_BLOCK = 16384
+
+
+class ScalarQuantizer:
+    """One uint8 code per dimension: x ~= low + scale * code
+
+    low and scale are fitted per dimension from the training vectors;
+    values outside the fitted range are clipped.
+    """
+
+    kind = "int8"
+
+    def __init__(self):
+        self.low = None
+        self.scale = None
+
+    @property
+    def trained(self) -> bool:
+        return self.low is not None
+
+    def code_size(self, dim: int) -> int:
+        return dim
+
+    def fit(self, vectors: np.ndarray):
+        """Fit per-dimension ranges to training vectors"""
+        low, high = vectors.min(axis=0), vectors.max(axis=0)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1.0
+        self.low, self.scale = low.astype(np.float32), scale.astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """uint8 codes, one row per vector"""
+        return np.clip(np.rint((vectors - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def inner_products(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate inner product of each query with each coded row"""
+        offsets = queries @ self.low
+        scaled = (queries * self.scale).T
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK):
+            block = codes[start:start + SCAN_BLOCK].astype(np.float32)
+            out[:, start:start + len(block)] = (block @ scaled).T
+        out += offsets[:, None]
+        return out
+
+    def distances(self, queries: np.ndarray, codes: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """Approximate squared L2 distance of each query to each coded row (norms are exact ||x||^2)"""
+        out = self.inner_products(queries, codes)
+        out *= -2.0
+        out += norms[None, :]
+        out += np.einsum("ij,ij->i", queries, queries)[:, None]
+        return out
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "scale": self.scale}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.low, self.scale = state["low"], state["scale"]
+
+
+class ProductQuantizer:
+    """Split each vector into subvectors and store the nearest of 256 centroids for each
+
+    Distances use asymmetric lookup tables: the query stays full precision
+    and each code byte indexes a precomputed partial distance.
+    """
+
+    kind = "pq"
+
+    def __init__(self, subvectors: int = 48, iterations: int = 15, max_train: int = 20000, seed: int = 0):
+        self.subvectors = subvectors
+        self.iterations = iterations
+        self.max_train = max_train
+        self.seed = seed
+        self.centroids = None  # (subvectors, clusters, dim // subvectors)
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def code_size(self, dim: int) -> int:
+        return self.subvectors
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dim = vectors.shape
+        if dim % self.subvectors:
+            raise ValueError(f"Embedding dimension {dim} is not divisible into {self.subvectors} subvectors")
+        return vectors.reshape(n, self.subvectors, dim // self.subvectors)
+
+    @staticmethod
+    def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (
+            np.einsum("ij,ij->i", centroids, centroids)[None, :]
+            - 2.0 * points @ centroids.T
+        )
+        return distances.argmin(axis=1)
+
+    def fit(self, vectors: np.ndarray):
+        """Train one k-means codebook per subvector on (a sample of) the vectors"""
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.max_train:
+            vectors = vectors[np.sort(rng.choice(len(vectors), self.max_train, replace=False))]
+        parts = self._split(np.asarray(vectors, dtype=np.float32))
+        clusters = min(256, len(vectors))
+        centroids = np.empty((self.subvectors, clusters, parts.shape[2]), dtype=np.float32)
+        for j in range(self.subvectors):
+            points = parts[:, j, :]
+            center = points[rng.choice(len(points), clusters, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = self._nearest(points, center)
+                sums = np.zeros_like(center)
+                np.add.at(sums, assignment, points)
+                counts = np.bincount(assignment, minlength=clusters)
+                filled = counts > 0
+                center[filled] = sums[filled] / counts[filled, None]
+            centroids[j] = center
+        self.centroids = centroids
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """uint8 codes, one byte per subvector"""
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        for start in range(0, len(vectors), SCAN_BLOCK):
+            parts = self._split(np.asarray(vectors[start:start + SCAN_BLOCK], dtype=np.float32))
+            for j in range(self.subvectors):
+                codes[start:start + len(parts), j] = self._nearest(parts[:, j, :], self.centroids[j])
+        return codes
+
+    def _lookup(self, queries: np.ndarray, codes: np.ndarray, table) -> np.ndarray:
+        """Sum, for each query and code row, of the table(query parts) entries the code bytes select"""
+        subspaces = np.arange(self.subvectors)
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for i, query in enumerate(self._split(queries)):
+            # (subvectors, clusters) partial scores of this query against every centroid
+            scores = table(query)
+            for start in range(0, len(codes), SCAN_BLOCK):
+                block = codes[start:start + SCAN_BLOCK]
+                out[i, start:start + len(block)] = scores[subspaces, block].sum(axis=1)
+        return out
+
+    def distances(self, queries: np.ndarray, codes: np.ndarray, norms: np.ndarray = None) -> np.ndarray:
+        """Approximate squared L2 distance of each query to each coded row"""
+        return self._lookup(queries, codes, lambda query: np.sum((self.centroids - query[:, None, :]) ** 2, axis=2))
+
+    def inner_products(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate inner product of each query with each coded row"""
+        return self._lookup(queries, codes, lambda query: np.einsum("scd,sd->sc", self.centroids, query))
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.centroids = state["centroids"]
+        self.subvectors = self.centroids.shape[0]
+
+
+QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
+
+
+def make_quantizer(kind: str, subvectors: int = 48):
+    """Untrained quantizer of the given kind ("int8" or "pq")"""
+    if kind not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization: {kind}")
+    return ProductQuantizer(subvectors) if kind == "pq" else ScalarQuantizer()
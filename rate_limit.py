@@ -0,0 +1,177 @@
+"""
+Rate limiting for PDF Knowledge Assistant
+Per provider/model token buckets for requests and tokens per minute that
+queue callers instead of failing, plus retries of transient provider
+errors with jittered exponential backoff within a deadline
+"""
+
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import LatencyRecorder
+
+# HTTP statuses worth retrying: rate limited, server errors, Anthropic "overloaded"
+TRANSIENT_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# SDK exception names without a status code that are still transient
+TRANSIENT_ERRORS = {
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ServiceUnavailable", "ResourceExhausted", "DeadlineExceeded", "TimeoutError", "ConnectionError",
+}
+
+
+class RateLimitTimeout(TimeoutError):
+    """The call could not be admitted or completed before its deadline"""
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an SDK error (openai, anthropic, google) if it carries one"""
+    for source in (error, getattr(error, "response", None)):
+        for attribute in ("status_code", "code", "status"):
+            value = getattr(source, attribute, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether retrying the same request may succeed"""
+    if isinstance(error, RateLimitTimeout):
+        return False
+    status = status_code(error)
+    if status is not None:
+        return status in TRANSIENT_STATUS
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+class TokenBucket:
+    """Refills at rate per second up to capacity; reservations may overdraw, which queues later callers"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def wait_for(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken (requests larger than capacity wait for a full bucket)"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Request and token budgets for one provider/model with queueing and retries
+
+    Callers reserve one request and their estimated tokens from the
+    per-minute buckets and sleep until the reservation comes due, so
+    concurrent callers are admitted in arrival order rather than rejected.
+    Transient errors (429, 5xx, connection errors) are retried after a
+    full-jitter exponential backoff; nothing is retried or queued past the
+    deadline. Queue waits and retry counts are kept as metrics.
+    """
+
+    def __init__(self, requests_per_minute: float = 60, tokens_per_minute: float = 40000,
+                 max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 20,
+                 deadline_seconds: float = 60, rng: random.Random = None):
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline_seconds = deadline_seconds
+        self.rng = rng or random.Random()
+        self.queue_waits = LatencyRecorder()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.gave_up = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float, deadline: float) -> float:
+        """Reserve a request and tokens, returning the seconds to wait before using them"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_for(1, now), self.tokens.wait_for(tokens, now))
+            if now + wait > deadline:
+                self.gave_up += 1
+                raise RateLimitTimeout(f"rate limit queue wait of {wait:.1f}s exceeds the deadline")
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.calls += 1
+        self.queue_waits.record({"queue_wait": wait})
+        return wait
+
+    def _retry_delay(self, error: BaseException, attempt: int, deadline: float) -> float:
+        """Backoff before retry number attempt, or re-raise error if it should not be retried"""
+        if not is_transient(error):
+            raise error
+        delay = self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self._lock:
+            self.throttled += status_code(error) == 429
+            if attempt + 1 >= self.max_attempts or time.monotonic() + delay > deadline:
+                self.gave_up += 1
+                raise error
+            self.retries += 1
+        return delay
+
+    def call(self, fn: Callable[[], Any], tokens: float = 0, deadline_seconds: float = None) -> Any:
+        """Run fn within the budgets, retrying transient errors"""
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        attempt = 0
+        while True:
+            time.sleep(self._reserve(tokens, deadline))
+            try:
+                return fn()
+            except Exception as e:
+                time.sleep(self._retry_delay(e, attempt, deadline))
+                attempt += 1
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], tokens: float = 0,
+                    deadline_seconds: float = None) -> Any:
+        """Async counterpart of call for coroutine functions"""
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._reserve(tokens, deadline))
+            try:
+                return await fn()
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, attempt, deadline))
+                attempt += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Call, retry, 429 and give-up counts plus queue wait percentiles (ms)"""
+        summary = self.queue_waits.summary().get("queue_wait", {})
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "gave_up": self.gave_up,
+            **{f"queue_{key}": value for key, value in summary.items() if key != "count"},
+        }
+
+
+_limiters: Dict[tuple, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, model: Optional[str], **settings) -> RateLimiter:
+    """Return the process-wide RateLimiter for a provider and model, created with settings on first use"""
+    key = (provider, model)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(**settings)
+        return _limiters[key]
+
+
+def rate_limit_stats() -> Dict[str, Dict[str, float]]:
+    """stats() of every rate limiter in the process, keyed "provider/model" """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {f"{provider}/{model}": limiter.stats() for (provider, model), limiter in limiters.items()}
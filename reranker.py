@@ -0,0 +1,139 @@
+"""
+Re-ranking for PDF Knowledge Assistant
+A CPU cross-encoder stage that re-scores bi-encoder candidates in
+budget-sized batches under a per-query time budget, falling back to bi-encoder order
+"""
+
+import time
+import threading
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+
+_models: Dict[str, object] = {}
+_model_locks: Dict[str, threading.Lock] = {}
+_rerankers: Dict[tuple, "CrossEncoderReranker"] = {}
+_registry_lock = threading.Lock()
+
+
+def get_cross_encoder(model_name: str):
+    """Return the process-wide CrossEncoder for model_name, loading it on first use"""
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _model_locks.setdefault(model_name, threading.Lock())
+    with lock:
+        if model_name not in _models:
+            from sentence_transformers import CrossEncoder
+            _models[model_name] = CrossEncoder(model_name, device="cpu")
+        return _models[model_name]
+
+
+def get_reranker(model_name: str, batch_size: int = 32, time_budget_ms: float = 250,
+                 reprobe_seconds: float = 30) -> "CrossEncoderReranker":
+    """Return the process-wide CrossEncoderReranker for these settings"""
+    key = (model_name, batch_size, time_budget_ms, reprobe_seconds)
+    with _registry_lock:
+        if key not in _rerankers:
+            _rerankers[key] = CrossEncoderReranker(model_name, batch_size, time_budget_ms, reprobe_seconds)
+        return _rerankers[key]
+
+
+def reorder_results(results: Dict[str, Any], order: List[int]) -> Dict[str, Any]:
+    """Apply a new order (and truncation) to a single-query result laid out like collection.query"""
+    size = len(results['ids'][0])
+    reordered = {}
+    for key, value in results.items():
+        if isinstance(value, list) and value and isinstance(value[0], list) and len(value[0]) == size:
+            reordered[key] = [[value[0][i] for i in order]]
+        else:
+            reordered[key] = value
+    return reordered
+
+
+class CrossEncoderReranker:
+    """Batched cross-encoder scoring bounded by a per-query time budget
+
+    A running estimate of seconds per pair is kept. The first call scores a
+    small probe batch; later batches are sized to about a quarter of the
+    budget (at most batch_size), so the budget check between batches can
+    stop scoring in time. If scoring is predicted to overrun the budget, or
+    the budget is used up between batches, the bi-encoder order is kept
+    instead. A skipped reranker probes again every reprobe_seconds, so one
+    slow (e.g. cold) call does not disable re-ranking for good.
+    """
+
+    probe_size = 4
+
+    def __init__(self, model_name: str, batch_size: int = 32, time_budget_ms: float = 250,
+                 reprobe_seconds: float = 30):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.time_budget = time_budget_ms / 1000
+        self.reprobe_seconds = reprobe_seconds
+        self.seconds_per_pair = None
+        self.reranked = 0
+        self.fallbacks = 0
+        self._last_scored = 0.0
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = get_cross_encoder(self.model_name)
+        return self._model
+
+    def _next_batch_size(self) -> int:
+        if self.seconds_per_pair is None:
+            return min(self.batch_size, self.probe_size)
+        return max(1, min(self.batch_size, int(self.time_budget / 4 / self.seconds_per_pair)))
+
+    def rerank(self, query: str, results: Dict[str, Any], n_results: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Top n_results of results re-ordered by cross-encoder score, plus stage info
+
+        Reranked results gain per-result 'rerank_scores'. The info dict
+        reports whether re-ranking was applied, the candidate count, the
+        scoring time and why the budget was not met, if it was not.
+        """
+        documents = results['documents'][0]
+        model = self.model  # load outside the timed budget
+        info = {"reranked": False, "candidates": len(documents), "seconds": 0.0, "reason": None}
+        fallback = list(range(min(n_results, len(documents))))
+        if not documents:
+            return results, info
+        predicted_over = self.seconds_per_pair and self.seconds_per_pair * len(documents) > self.time_budget
+        if predicted_over and time.monotonic() - self._last_scored < self.reprobe_seconds:
+            info["reason"] = "predicted over budget"
+            self.fallbacks += 1
+            return reorder_results(results, fallback), info
+
+        start = time.perf_counter()
+        self._last_scored = time.monotonic()
+        scores: List[float] = []
+        while len(scores) < len(documents):
+            batch = documents[len(scores):len(scores) + self._next_batch_size()]
+            batch_start = time.perf_counter()
+            scores.extend(model.predict([(query, document) for document in batch],
+                                        batch_size=len(batch), show_progress_bar=False))
+            per_pair = (time.perf_counter() - batch_start) / len(batch)
+            self.seconds_per_pair = per_pair if self.seconds_per_pair is None else 0.5 * self.seconds_per_pair + 0.5 * per_pair
+            if time.perf_counter() - start > self.time_budget:
+                break
+        info["seconds"] = time.perf_counter() - start
+
+        if len(scores) < len(documents):
+            info["reason"] = "over budget"
+            self.fallbacks += 1
+            return reorder_results(results, fallback), info
+        if info["seconds"] > self.time_budget:
+            # Every candidate was scored, so the ordering is still worth returning
+            info["reason"] = "over budget"
+
+        order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")[:n_results].tolist()
+        reranked = reorder_results(results, order)
+        reranked['rerank_scores'] = [[float(scores[i]) for i in order]]
+        info["reranked"] = True
+        self.reranked += 1
+        return reranked, info
@@ -0,0 +1,344 @@
+"""
+Sharded vector store for PDF Knowledge Assistant
+Spreads a collection over N worker processes, each owning one Chroma or
+NumPy shard. Chunks are placed by a hash of their document ID; queries are
+scattered to the shards in parallel and the per-shard top-k gathered by
+distance. The client and collection mirror the chromadb API used by
+VectorDatabase, like the NumPy backend
+"""
+
+import os
+import json
+import atexit
+import hashlib
+import threading
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+from vector_backends import get_numpy_client
+
+
+def shard_for(document_id: str, num_shards: int) -> int:
+    """Shard that owns a document: SHA-1 of its ID modulo the shard count"""
+    digest = hashlib.sha1(document_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def document_of(chunk_id: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+    """Document a chunk belongs to: its document_id metadata, else the ID's "<document_id>:<chunk_index>" prefix"""
+    if metadata and metadata.get("document_id") is not None:
+        return str(metadata["document_id"])
+    return chunk_id.rsplit(":", 1)[0]
+
+
+def _open_client(backend: str, directory: Optional[str]):
+    if backend == "numpy":
+        return get_numpy_client(directory)
+    import chromadb
+    return chromadb.PersistentClient(path=directory) if directory else chromadb.Client()
+
+
+def _shard_worker(conn, backend: str, directory: Optional[str]):
+    """Serve (op, collection, method, args, kwargs) requests for one shard until told to stop"""
+    client = _open_client(backend, directory)
+    collections = {}
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        op, name, method, args, kwargs = request
+        try:
+            if op == "create":
+                collections[name] = client.create_collection(name=name, metadata=kwargs.get("metadata"))
+                result = None
+            elif op == "get":
+                collections[name] = client.get_collection(name=name)
+                result = None
+            elif op == "delete":
+                collections.pop(name, None)
+                result = client.delete_collection(name)
+            else:
+                if name not in collections:
+                    collections[name] = client.get_collection(name=name)
+                collection = collections[name]
+                if method == "query":
+                    # Clamp locally so the parent needs no count round trip before querying
+                    kwargs["n_results"] = min(kwargs["n_results"], collection.count())
+                    if not kwargs["n_results"]:
+                        queries = len(kwargs["query_embeddings"])
+                        result = {key: [[] for _ in range(queries)] for key in ["ids"] + kwargs["include"]}
+                        conn.send(("ok", result))
+                        continue
+                result = getattr(collection, method)(*args, **kwargs)
+            conn.send(("ok", result))
+        except Exception as e:
+            try:
+                conn.send(("error", e))
+            except Exception:
+                conn.send(("error", RuntimeError(repr(e))))
+    conn.close()
+
+
+class _Shard:
+    """Parent-side handle of one worker process"""
+
+    def __init__(self, index: int, backend: str, directory: Optional[str], context):
+        self.index = index
+        self.lock = threading.Lock()
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_shard_worker, args=(child, backend, directory), daemon=True)
+        self.process.start()
+        child.close()
+
+    def send(self, request):
+        self.conn.send(request)
+
+    def receive(self):
+        status, result = self.conn.recv()
+        if status == "error":
+            raise result
+        return result
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.send(None)
+                self.conn.close()
+            except (OSError, BrokenPipeError):
+                pass
+        self.process.join(timeout=5)
+
+
+class ShardedClient:
+    """Minimal stand-in for a chromadb client whose collections are split across worker processes
+
+    Chunks are placed by shard_for(document, num_shards), so a persisted
+    store can only be reopened with the shard count it was written with;
+    that count is recorded in shards.json and checked on open.
+    """
+
+    def __init__(self, num_shards: int, backend: str = "chroma", path: str = None):
+        self.num_shards = num_shards
+        self.backend = backend
+        self.path = path
+        if path:
+            self._check_layout(path, num_shards, backend)
+        # Spawned workers do not inherit the parent's threads or open handles
+        context = multiprocessing.get_context("spawn")
+        self.shards = [
+            _Shard(i, backend, os.path.join(path, f"shard-{i}") if path else None, context)
+            for i in range(num_shards)
+        ]
+        atexit.register(self.close)
+
+    @staticmethod
+    def _check_layout(path: str, num_shards: int, backend: str):
+        """Record the shard layout of a new store, or refuse to open one written with another"""
+        layout_path = os.path.join(path, "shards.json")
+        if os.path.exists(layout_path):
+            with open(layout_path, encoding="utf-8") as f:
+                layout = json.load(f)
+            if (layout["num_shards"], layout["backend"]) != (num_shards, backend):
+                raise ValueError(
+                    f"Sharded store at {path} was written with {layout['num_shards']} {layout['backend']} shards, "
+                    f"not {num_shards} {backend} shards"
+                )
+            return
+        os.makedirs(path, exist_ok=True)
+        with open(layout_path, "w", encoding="utf-8") as f:
+            json.dump({"num_shards": num_shards, "backend": backend}, f)
+
+    def scatter(self, requests: Dict[int, tuple]) -> Dict[int, Any]:
+        """Send one request per shard, then gather the replies; the shards work in parallel
+
+        Every shard a request reached is drained even if a later send
+        fails, so no reply is left behind for the next caller to read.
+        """
+        shards = [self.shards[i] for i in sorted(requests)]
+        for shard in shards:
+            shard.lock.acquire()
+        try:
+            sent, error = [], None
+            for shard in shards:
+                try:
+                    shard.send(requests[shard.index])
+                except Exception as e:
+                    error = e
+                    break
+                sent.append(shard)
+            replies = {}
+            for shard in sent:
+                try:
+                    replies[shard.index] = shard.receive()
+                except Exception as e:
+                    error = error or e
+            if error:
+                raise error
+            return replies
+        finally:
+            for shard in shards:
+                shard.lock.release()
+
+    def _all(self, op: str, name: str, **kwargs) -> Dict[int, Any]:
+        return self.scatter({i: (op, name, None, (), kwargs) for i in range(self.num_shards)})
+
+    def create_collection(self, name: str, metadata: Dict[str, Any] = None) -> "ShardedCollection":
+        self._all("create", name, metadata=metadata)
+        return ShardedCollection(self, name)
+
+    def get_collection(self, name: str) -> "ShardedCollection":
+        self._all("get", name)
+        return ShardedCollection(self, name)
+
+    def delete_collection(self, name: str):
+        self._all("delete", name)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+class ShardedCollection:
+    """chromadb Collection API over one collection spread across every shard
+
+    Writes go only to the shard owning the chunk's document_id (taken from
+    the ID when the metadata has none), and filters on document_id are
+    routed the same way. Lookups and deletes by ID, whose document is not
+    known, and other filters are scattered to every shard. Query results
+    are merged by ascending distance.
+    """
+
+    def __init__(self, client: ShardedClient, name: str):
+        self.client = client
+        self.name = name
+
+    def _owner(self, chunk_id: str, metadata: Optional[Dict[str, Any]] = None) -> int:
+        return shard_for(document_of(chunk_id, metadata), self.client.num_shards)
+
+    def _shards_for_where(self, where: Optional[Dict[str, Any]]) -> List[int]:
+        condition = (where or {}).get("document_id")
+        if len(where or {}) == 1 and condition is not None:
+            if isinstance(condition, dict):
+                (op, operand), = condition.items()
+                values = operand if op == "$in" else [operand] if op == "$eq" else None
+            else:
+                values = [condition]
+            if values is not None:
+                return sorted({shard_for(value, self.client.num_shards) for value in values})
+        return list(range(self.client.num_shards))
+
+    def _call(self, shards: List[int], method: str, args_by_shard: Dict[int, Dict[str, Any]] = None,
+              **kwargs) -> Dict[int, Any]:
+        return self.client.scatter({
+            i: ("call", self.name, method, (), {**kwargs, **((args_by_shard or {}).get(i, {}))})
+            for i in shards
+        })
+
+    def count(self) -> int:
+        return sum(self._call(list(range(self.client.num_shards)), "count").values())
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str] = None,
+               metadatas: List[Dict[str, Any]] = None):
+        batches: Dict[int, Dict[str, list]] = {}
+        for i, id in enumerate(ids):
+            owner = self._owner(id, metadatas[i] if metadatas else None)
+            batch = batches.setdefault(owner, {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+            batch["ids"].append(id)
+            batch["embeddings"].append(list(embeddings[i]))
+            batch["documents"].append(documents[i] if documents else None)
+            batch["metadatas"].append(metadatas[i] if metadatas else None)
+        for batch in batches.values():
+            if not any(batch["documents"]):
+                del batch["documents"]
+            if not any(batch["metadatas"]):
+                del batch["metadatas"]
+        if batches:
+            self._call(sorted(batches), "upsert", batches)
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str] = None,
+            metadatas: List[Dict[str, Any]] = None):
+        self.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids: List[str] = None, where: Dict[str, Any] = None):
+        if ids is not None:
+            if ids:
+                self._call(list(range(self.client.num_shards)), "delete", ids=ids, where=where)
+        elif where:
+            self._call(self._shards_for_where(where), "delete", where=where)
+
+    def get(self, ids: List[str] = None, where: Dict[str, Any] = None, limit: int = None,
+            offset: int = None, include: List[str] = ["metadatas", "documents"]) -> Dict[str, Any]:
+        keys = ["ids"] + list(include)
+        if ids is not None:
+            replies = self._call(list(range(self.client.num_shards)), "get", ids=ids,
+                                 where=where, include=include) if ids else {}
+            found = {}
+            for reply in replies.values():
+                for j, id in enumerate(reply["ids"]):
+                    found[id] = {key: reply[key][j] for key in keys}
+            ordered = [found[id] for id in ids if id in found][offset or 0:]
+            ordered = ordered[:limit] if limit is not None else ordered
+            return {key: [row[key] for row in ordered] for key in keys}
+
+        shards = self._shards_for_where(where)
+        if where or (limit is None and not offset):
+            replies = self._call(shards, "get", where=where, include=include)
+            if limit is not None or offset:
+                merged = self._merge(replies, keys)
+                stop = None if limit is None else (offset or 0) + limit
+                return {key: values[offset or 0:stop] for key, values in merged.items()}
+        else:
+            # Page through the shards in order, asking each only for its slice of the window
+            counts = self._call(shards, "count")
+            replies, skip, remaining = {}, offset or 0, limit
+            for i in shards:
+                if remaining is not None and remaining <= 0:
+                    break
+                if skip >= counts[i]:
+                    skip -= counts[i]
+                    continue
+                replies[i] = self._call([i], "get", include=include, limit=remaining, offset=skip)[i]
+                skip = 0
+                if remaining is not None:
+                    remaining -= len(replies[i]["ids"])
+        return self._merge(replies, keys)
+
+    @staticmethod
+    def _merge(replies: Dict[int, Dict[str, Any]], keys: List[str]) -> Dict[str, Any]:
+        merged = {key: [] for key in keys}
+        for i in sorted(replies):
+            for key in keys:
+                merged[key].extend(replies[i][key] or [])
+        return merged
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Dict[str, Any] = None,
+              include: List[str] = ["metadatas", "documents", "distances"]) -> Dict[str, Any]:
+        include = list(include) if "distances" in include else list(include) + ["distances"]
+        shards = self._shards_for_where(where)
+        keys = ["ids"] + include
+        result = {key: [[] for _ in query_embeddings] for key in keys}
+        # Each shard clamps n_results to its own size
+        replies = self._call(shards, "query", query_embeddings=query_embeddings, n_results=n_results,
+                             where=where, include=include)
+        for q in range(len(query_embeddings)):
+            rows = [
+                {key: replies[i][key][q][j] for key in keys}
+                for i in shards for j in range(len(replies[i]["ids"][q]))
+            ]
+            rows.sort(key=lambda row: row["distances"])
+            for key in keys:
+                result[key][q] = [row[key] for row in rows[:n_results]]
+        return result
+
+
+_clients: Dict[tuple, ShardedClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_sharded_client(path: str = None, num_shards: int = 2, backend: str = "chroma") -> ShardedClient:
+    """Return the process-wide ShardedClient for path, starting its workers on first use"""
+    key = (os.path.abspath(path) if path else None, num_shards, backend)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = ShardedClient(num_shards, backend, key[0])
+        return _clients[key]
@@ -32,6 +32,10 @@ class TestPDFProcessor(unittest.TestCase):
         # Check chunk sizes
         for chunk in chunks:
             self.assertLessEqual(len(chunk), 100)
+        
+        # Overlap no larger than the chunk size used to loop forever
+        with self.assertRaises(ValueError):
+            self.processor.chunk_text(test_text, chunk_size=100, overlap=100)
     
     def test_embeddings_creation(self):
         """Test embedding creation"""
@@ -47,6 +51,1213 @@ class TestPDFProcessor(unittest.TestCase):
             self.assertIsInstance(embedding, list)
             self.assertGreater(len(embedding), 0)
 
+class TestModelRegistry(unittest.TestCase):
+    """Test the process-wide embedding model registry"""
+    
+    def test_model_loaded_once_across_threads(self):
+        """Test that concurrent first calls share one model instance"""
+        import threading
+        from unittest import mock
+        import embeddings
+        
+        loads = []
+        
+        def fake_model(name):
+            loads.append(name)
+            return object()
+        
+        results = []
+        with mock.patch("sentence_transformers.SentenceTransformer", side_effect=fake_model):
+            threads = [
+                threading.Thread(target=lambda: results.append(embeddings.get_embedding_model("fake-model")))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        embeddings._models.pop("fake-model", None)
+        
+        self.assertEqual(loads, ["fake-model"])
+        self.assertEqual(len(set(map(id, results))), 1)
+
+class TestBucketedEncoding(unittest.TestCase):
+    """Test length-bucketed batched encoding"""
+    
+    def test_buckets_sorted_and_order_restored(self):
+        """Test that batches hold similar lengths and output follows input order"""
+        import numpy as np
+        from embeddings import encode_bucketed
+        
+        class FakeModel:
+            tokenizer = None
+            
+            def __init__(self):
+                self.batches = []
+            
+            def encode(self, texts, batch_size, convert_to_numpy, show_progress_bar):
+                self.batches.append([len(text) for text in texts])
+                return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+        
+        texts = ["x" * n for n in (50, 3, 40, 1, 30, 2, 20)]
+        model = FakeModel()
+        vectors = encode_bucketed(model, texts, batch_size=3)
+        
+        self.assertEqual(model.batches, [[1, 2, 3], [20, 30, 40], [50]])
+        self.assertEqual(vectors[:, 0].tolist(), [len(text) for text in texts])
+    
+    def test_lengths_truncated_at_model_limit(self):
+        """Test that token lengths are capped at max_seq_length and ingest batches span several buckets"""
+        from config import VECTOR_DB_CONFIG
+        from embeddings import token_lengths
+        
+        class FakeTokenizer:
+            def __call__(self, texts, **kwargs):
+                self.kwargs = kwargs
+                limit = kwargs["max_length"] if kwargs["truncation"] else None
+                return {"input_ids": [text.split()[:limit] for text in texts]}
+        
+        class FakeModel:
+            tokenizer = FakeTokenizer()
+            max_seq_length = 4
+        
+        self.assertEqual(token_lengths(FakeModel(), ["a b", "a b c d e f"]), [2, 4])
+        self.assertFalse(FakeModel.tokenizer.kwargs["return_attention_mask"])
+        self.assertGreaterEqual(VECTOR_DB_CONFIG["ingest_batch_size"], 4 * VECTOR_DB_CONFIG["embedding_batch_size"])
+
+class TestParallelExtraction(unittest.TestCase):
+    """Test process-pool PDF text extraction"""
+    
+    def test_split_page_range(self):
+        """Test that page spans cover every page exactly once"""
+        from ingestion import split_page_range
+        
+        spans = split_page_range(10, 3)
+        self.assertEqual(spans, [(0, 4), (4, 7), (7, 10)])
+        self.assertEqual(split_page_range(2, 8), [(0, 1), (1, 2)])
+    
+    def test_parallel_matches_sequential(self):
+        """Test that parallel extraction returns pages in page order"""
+        from benchmark import build_sample_pdf
+        from ingestion import extract_pages
+        
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(build_sample_pdf(6, lines_per_page=2))
+        try:
+            sequential = extract_pages(tmp.name, workers=1)
+            parallel = extract_pages(tmp.name, workers=3, min_pages_per_worker=1)
+        finally:
+            os.unlink(tmp.name)
+        
+        self.assertEqual(len(sequential), 6)
+        self.assertEqual(parallel, sequential)
+        self.assertIn("Section 5.", parallel[5])
+    
+    def test_parallel_spans_submitted_in_bounded_window(self):
+        """Test that no more than `workers` spans are extracting or waiting to be consumed"""
+        import ingestion
+        from benchmark import build_sample_pdf
+        
+        submitted = []
+        
+        class RecordingPool(ingestion.ProcessPoolExecutor):
+            def submit(self, fn, *args):
+                submitted.append(args[1:])
+                return super().submit(fn, *args)
+        
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(build_sample_pdf(8, lines_per_page=2))
+        original = ingestion.ProcessPoolExecutor
+        ingestion.ProcessPoolExecutor = RecordingPool
+        try:
+            pages = ingestion.iter_pages(tmp.name, workers=2, min_pages_per_worker=1, pages_per_span=2)
+            first = next(pages)
+            self.assertEqual(submitted, [(0, 2), (2, 4), (4, 6)])
+            rest = list(pages)
+        finally:
+            ingestion.ProcessPoolExecutor = original
+            os.unlink(tmp.name)
+        
+        self.assertEqual(len(submitted), 4)
+        self.assertEqual(len([first] + rest), 8)
+
+class TestStreamingIngestion(unittest.TestCase):
+    """Test the streaming extract -> chunk -> embed -> store pipeline"""
+    
+    def test_streamed_chunks_match_full_text(self):
+        """Test that streaming chunks equal slicing the joined document"""
+        from ingestion import iter_chunks
+        
+        pages = [f"Page {i} " + "word " * (37 * i) for i in range(8)]
+        text = "".join(page + "\n" for page in pages)
+        expected = [text[start:start + 100] for start in range(0, len(text), 80)]
+        
+        self.assertEqual(list(iter_chunks(pages, chunk_size=100, overlap=20)), expected)
+        with self.assertRaises(ValueError):
+            list(iter_chunks(pages, chunk_size=100, overlap=100))
+    
+    def test_batches_are_bounded(self):
+        """Test that embeddings are created and stored one batch at a time"""
+        from ingestion import run_ingestion
+        
+        class FakeProcessor:
+            def create_embeddings(self, chunks):
+                return [[float(len(chunk))] for chunk in chunks]
+        
+        class FakeStore:
+            def __init__(self):
+                self.calls = []
+            
+            def add_documents(self, chunks, embeddings, metadata, ids=None):
+                self.calls.append((len(chunks), ids, metadata))
+            
+            def get_embeddings_by_chunk_hash(self, hashes):
+                return {}
+        
+        store = FakeStore()
+        pages = ("x" * 500 for _ in range(20))
+        result = run_ingestion(pages, FakeProcessor(), store, {"document_id": "doc"},
+                               chunk_size=100, overlap=0, batch_size=16)
+        
+        self.assertTrue(all(size <= 16 for size, _, _ in store.calls))
+        self.assertEqual(sum(size for size, _, _ in store.calls), result["chunks"])
+        self.assertEqual(store.calls[1][2][0]["chunk_index"], 16)
+        self.assertTrue(result["preview"].endswith("..."))
+
+class WhitespaceEncoding:
+    """Stand-in for a tiktoken encoding that counts whitespace-separated words"""
+    
+    def encode_ordinary(self, text):
+        return text.split()
+    
+    def encode_ordinary_batch(self, texts):
+        return [text.split() for text in texts]
+    
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+class TestTokenChunker(unittest.TestCase):
+    """Test the token-aware, boundary-respecting chunker"""
+    
+    def setUp(self):
+        self.pages = [
+            " ".join(f"Sentence {p}.{i} has exactly six words." for i in range(12)) + "\n\n" +
+            " ".join(f"Closing {p}.{i} is five words." for i in range(5))
+            for p in range(4)
+        ]
+        self.document = "".join(page + "\n" for page in self.pages)
+    
+    def chunks(self, max_tokens=40, overlap_tokens=10, pages=None):
+        from ingestion import iter_token_chunks
+        return list(iter_token_chunks(pages or self.pages, max_tokens, overlap_tokens, WhitespaceEncoding()))
+    
+    def test_budget_offsets_and_boundaries(self):
+        """Test token budget, character offsets and sentence-aligned cuts"""
+        chunks = self.chunks()
+        covered = set()
+        for text, start, end in chunks:
+            self.assertLessEqual(len(text.split()), 40)
+            self.assertEqual(self.document[start:end], text)
+            self.assertRegex(text, r"[.]\s*$")
+            covered.update(range(start, end))
+        self.assertEqual(covered, set(range(len(self.document))))
+    
+    def test_overlap_and_paragraph_preference(self):
+        """Test that chunks overlap by whole sentences and cut at paragraph ends"""
+        chunks = self.chunks(max_tokens=80, overlap_tokens=6)
+        for (_, _, previous_end), (_, start, _) in zip(chunks, chunks[1:]):
+            self.assertLessEqual(start, previous_end)
+        self.assertTrue(any(text.endswith("words.\n\n") for text, _, _ in chunks))
+    
+    def test_oversized_sentence_and_invalid_overlap(self):
+        """Test splitting a sentence longer than the budget and rejecting bad overlap"""
+        chunks = self.chunks(max_tokens=10, overlap_tokens=0, pages=["word " * 35 + "end."])
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual("".join(text for text, _, _ in chunks), "word " * 35 + "end.\n")
+        with self.assertRaises(ValueError):
+            self.chunks(max_tokens=10, overlap_tokens=10)
+
+class TestContextPacking(unittest.TestCase):
+    """Test merging, MMR ordering and token budgeting of the prompt context"""
+    
+    def test_overlapping_chunks_are_merged(self):
+        """Test that overlapping chunks become one passage without repeated text"""
+        from ingestion import iter_chunk_spans
+        from context import pack_context
+        
+        document = " ".join(f"word{i}" for i in range(400))
+        spans = list(iter_chunk_spans([document], chunk_size=300, overlap=60))[:3]
+        documents = [text for text, _, _ in spans]
+        metadatas = [{"document_id": "d", "filename": "d.pdf", "chunk_index": i, "start_char": start, "end_char": end}
+                     for i, (_, start, end) in enumerate(spans)]
+        
+        packed = pack_context(documents[::-1], metadatas[::-1], 10_000, WhitespaceEncoding())
+        self.assertEqual(packed["context"], (document + "\n")[:spans[-1][2]])
+        self.assertEqual(packed["passages"], 1)
+        self.assertLess(packed["tokens"], packed["raw_tokens"])
+        self.assertEqual(packed["tokens_saved"], packed["raw_tokens"] - packed["tokens"])
+        
+        # Chunks stored before offsets existed are merged by chunk_index and text overlap
+        legacy = [{"document_id": "d", "filename": "d.pdf", "chunk_index": i} for i in range(3)]
+        self.assertEqual(pack_context(documents, legacy, 10_000, WhitespaceEncoding())["context"],
+                         (document + "\n")[:spans[-1][2]])
+    
+    def test_mmr_and_budget(self):
+        """Test that near-duplicates are deprioritised and the budget is never exceeded"""
+        from context import mmr_order, pack_context
+        
+        query = [1.0, 0.0]
+        embeddings = [[1.0, 0.0], [0.99, 0.05], [0.7, 0.7]]
+        self.assertEqual(mmr_order(query, embeddings, mmr_lambda=0.3), [0, 2, 1])
+        
+        documents = ["alpha " * 30, "alpha again " * 15, "beta " * 30]
+        metadatas = [{"filename": f"{i}.pdf", "document_id": str(i)} for i in range(3)]
+        packed = pack_context(documents, metadatas, 65, WhitespaceEncoding(), query, embeddings, mmr_lambda=0.3)
+        self.assertEqual(packed["sources"], ["0.pdf", "2.pdf"])
+        self.assertLessEqual(packed["tokens"], 65)
+        
+        truncated = pack_context(documents, metadatas, 10, WhitespaceEncoding())
+        self.assertEqual((truncated["tokens"], truncated["passages"]), (10, 1))
+    
+    def test_embeddings_fetched_only_over_budget(self):
+        """Test that fitting passages skip the embedding fetch and near-duplicates are dropped over budget"""
+        from context import pack_context
+        
+        query = [1.0, 0.0]
+        documents = ["alpha " * 30, "alpha again " * 15, "beta " * 30]
+        metadatas = [{"filename": f"{i}.pdf", "document_id": str(i)} for i in range(3)]
+        fetches = []
+        
+        def fetch():
+            fetches.append(1)
+            return [[1.0, 0.0], [0.99, 0.05], None]
+        
+        packed = pack_context(documents, metadatas, 1000, WhitespaceEncoding(), query, fetch)
+        self.assertEqual((packed["passages"], fetches), (3, []))
+        # A chunk deleted since the search has no embedding: fall back to retrieval order
+        packed = pack_context(documents, metadatas, 65, WhitespaceEncoding(), query, fetch)
+        self.assertEqual((packed["sources"], len(fetches)), (["0.pdf", "1.pdf"], 1))
+        
+        embeddings = [[1.0, 0.0], [0.99, 0.05], [0.7, 0.7]]
+        packed = pack_context(documents, metadatas, 85, WhitespaceEncoding(), query, embeddings,
+                              mmr_lambda=0.9, max_similarity=0.95)
+        self.assertEqual(packed["sources"], ["0.pdf", "2.pdf"])
+
+class TestContentDeduplication(unittest.TestCase):
+    """Test content-hash deduplication of uploads and chunks"""
+    
+    def setUp(self):
+        from app import VectorDatabase
+        self.vector_db = VectorDatabase()
+        self.vector_db.create_collection("test_dedup_collection")
+    
+    def tearDown(self):
+        self.vector_db.client.delete_collection("test_dedup_collection")
+    
+    def test_known_chunks_are_not_re_embedded(self):
+        """Test that a second document reuses embeddings of identical chunks"""
+        from ingestion import run_ingestion
+        
+        class CountingProcessor:
+            encoded = 0
+            embedding_key = "model-a"
+            
+            def create_embeddings(self, chunks):
+                self.encoded += len(chunks)
+                return [[float(len(chunk)), 1.0, 0.0] for chunk in chunks]
+        
+        processor = CountingProcessor()
+        pages = [f"Shared paragraph {i}. " * 5 for i in range(10)]
+        first = run_ingestion(pages, processor, self.vector_db,
+                              {"document_id": "a", "content_hash": "hash-a"}, chunk_size=50, overlap=0)
+        encoded_first = processor.encoded
+        second = run_ingestion(pages, processor, self.vector_db,
+                               {"document_id": "b", "content_hash": "hash-b"}, chunk_size=50, overlap=0)
+        
+        self.assertEqual(processor.encoded, encoded_first)
+        self.assertEqual(second["reused_embeddings"], second["chunks"])
+        self.assertEqual(self.vector_db.collection.count(), first["chunks"] + second["chunks"])
+        self.assertTrue(self.vector_db.has_content_hash("hash-a"))
+        self.assertFalse(self.vector_db.has_content_hash("hash-c"))
+        
+        # Another embedding model never reuses vectors from the first one
+        processor.embedding_key = "model-b"
+        third = run_ingestion(pages, processor, self.vector_db,
+                              {"document_id": "c", "content_hash": "hash-c"}, chunk_size=50, overlap=0)
+        self.assertEqual(third["reused_embeddings"], first["reused_embeddings"])
+        self.assertEqual(processor.encoded, encoded_first * 2)
+
+    def test_partial_ingestion_is_not_marked_indexed(self):
+        """Test that a document whose ingestion fails partway is not skipped as already indexed"""
+        from ingestion import run_ingestion
+
+        class FailingProcessor:
+            calls = 0
+
+            def create_embeddings(self, chunks):
+                self.calls += 1
+                if self.calls > 1:
+                    raise RuntimeError("embedding service unavailable")
+                return [[float(len(chunk)), 1.0, 0.0] for chunk in chunks]
+
+        pages = [f"Paragraph {i} of a long report. " * 5 for i in range(10)]
+        with self.assertRaises(RuntimeError):
+            run_ingestion(pages, FailingProcessor(), self.vector_db,
+                          {"document_id": "partial", "content_hash": "hash-p"},
+                          chunk_size=50, overlap=0, batch_size=4)
+        self.assertGreater(self.vector_db.collection.count(), 0)
+        self.assertFalse(self.vector_db.has_content_hash("hash-p"))
+
+        self.vector_db.remove_documents(document_ids=["partial"])
+        self.assertEqual(self.vector_db.collection.count(), 0)
+
+class TestEmbeddingCache(unittest.TestCase):
+    """Test the persistent embedding cache"""
+    
+    def setUp(self):
+        from embeddings import EmbeddingCache
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite3")
+        self.cache = EmbeddingCache(self.path, max_size_mb=1)
+    
+    def tearDown(self):
+        self.cache.close()
+        self.tmpdir.cleanup()
+    
+    def test_round_trip_across_instances(self):
+        """Test that cached embeddings survive reopening and count hits and misses"""
+        from embeddings import EmbeddingCache
+        
+        self.cache.put_many("model-a", ["hello  world"], [[0.5, 0.25]])
+        reopened = EmbeddingCache(self.path)
+        try:
+            results = reopened.get_many("model-a", ["hello world", "unseen"])
+            self.assertEqual(results, [[0.5, 0.25], None])
+            self.assertEqual(reopened.get_many("model-b", ["hello world"]), [None])
+            self.assertEqual((reopened.stats()["hits"], reopened.stats()["misses"]), (1, 2))
+        finally:
+            reopened.close()
+    
+    def test_size_based_eviction(self):
+        """Test that the least recently used entries are evicted past the size limit"""
+        vector = [0.0] * 384
+        for i in range(1000):
+            self.cache.put_many("model", [f"chunk {i}"], [vector])
+        
+        self.assertLessEqual(self.cache.stats()["size_mb"], 1)
+        self.assertIsNone(self.cache.get_many("model", ["chunk 0"])[0])
+        self.assertIsNotNone(self.cache.get_many("model", ["chunk 999"])[0])
+
+class TestChunkIds(unittest.TestCase):
+    """Test globally unique chunk IDs and batched upserts"""
+    
+    def setUp(self):
+        from app import VectorDatabase
+        self.vector_db = VectorDatabase()
+        self.vector_db.create_collection("test_chunk_ids")
+    
+    def tearDown(self):
+        self.vector_db.client.delete_collection("test_chunk_ids")
+    
+    def add(self, document_id, count, batch_size=None):
+        self.vector_db.add_documents(
+            [f"{document_id} chunk {i}" for i in range(count)],
+            [[float(i), 1.0, 0.0] for i in range(count)],
+            [{"document_id": document_id, "chunk_index": i} for i in range(count)],
+            batch_size=batch_size
+        )
+    
+    def test_documents_do_not_collide(self):
+        """Test that two documents keep all of their chunks"""
+        self.add("first", 5)
+        self.add("second", 5)
+        self.assertEqual(self.vector_db.collection.count(), 10)
+        self.assertEqual(self.vector_db.collection.get(ids=["second:4"])['documents'], ["second chunk 4"])
+    
+    def test_bulk_removal_by_metadata(self):
+        """Test removing several documents by id and one by filename"""
+        for document_id in ["one", "two", "three", "four"]:
+            self.add(document_id, 3)
+        self.vector_db.collection.update(ids=["four:0", "four:1", "four:2"],
+                                         metadatas=[{"document_id": "four", "filename": "four.pdf"}] * 3)
+        
+        result = self.vector_db.remove_documents(document_ids=["one", "two"])
+        self.assertEqual(result["removed"], 6)
+        self.assertGreaterEqual(result["seconds"], 0)
+        self.assertTrue(self.vector_db.remove_document("four.pdf"))
+        self.assertFalse(self.vector_db.remove_document("missing.pdf"))
+        self.assertEqual(sorted(self.vector_db.collection.get()['ids']), ["three:0", "three:1", "three:2"])
+    
+    def test_reingest_is_idempotent(self):
+        """Test that re-adding a document in small batches does not duplicate it"""
+        self.add("doc", 7, batch_size=3)
+        self.add("doc", 7, batch_size=2)
+        self.assertEqual(self.vector_db.collection.count(), 7)
+
+class TestPersistentVectorDatabase(unittest.TestCase):
+    """Test the persistent storage mode and warm start"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_reopen_and_list_documents(self):
+        """Test that a new client reopens the collection and rebuilds the document list"""
+        from app import VectorDatabase
+        
+        vector_db = VectorDatabase(self.tmpdir.name)
+        vector_db.create_collection("persisted")
+        metadata = [
+            {"filename": "a.pdf", "document_id": "a", "chunk_index": i, "upload_time": "2024-01-01"}
+            for i in range(3)
+        ] + [{"filename": "b.pdf", "document_id": "b", "chunk_index": 0, "upload_time": "2024-01-02"}]
+        vector_db.add_documents(
+            ["a0", "a1", "a2", "b0"],
+            [[0.1, 0.2, 0.3]] * 4,
+            metadata,
+            ids=["a_0", "a_1", "a_2", "b_0"]
+        )
+        
+        reopened = VectorDatabase(self.tmpdir.name)
+        self.assertFalse(reopened.open_collection("missing"))
+        self.assertTrue(reopened.open_collection("persisted"))
+        documents = reopened.list_documents()
+        
+        self.assertEqual([(doc["filename"], doc["chunks"]) for doc in documents], [("a.pdf", 3), ("b.pdf", 1)])
+        self.assertEqual(documents[0]["text"], "a0")
+
+class FakeEmbeddingModel:
+    """Stand-in for SentenceTransformer that maps known words to fixed vectors"""
+    
+    VECTORS = {"apple": [1.0, 0.0, 0.0], "banana": [0.0, 1.0, 0.0], "cherry": [0.0, 0.0, 1.0]}
+    
+    def encode(self, texts, **kwargs):
+        import numpy as np
+        return np.array([self.VECTORS.get(text.split()[0], [0.5, 0.5, 0.5]) for text in texts], dtype=np.float32)
+
+class TestNumpyBackend(unittest.TestCase):
+    """Test the in-process NumPy vector index backend"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def make_db(self):
+        from app import VectorDatabase
+        vector_db = VectorDatabase(self.tmpdir.name, backend="numpy")
+        vector_db.create_collection("numpy_test")
+        return vector_db
+    
+    def add_fruit(self, vector_db):
+        chunks = ["apple pie", "banana bread", "cherry tart"]
+        vector_db.add_documents(
+            chunks,
+            FakeEmbeddingModel().encode(chunks).tolist(),
+            [{"filename": f"{chunk.split()[0]}.pdf", "document_id": chunk.split()[0], "chunk_index": 0}
+             for chunk in chunks]
+        )
+    
+    def test_drop_in_api(self):
+        """Test add, search and remove through the unchanged VectorDatabase API"""
+        vector_db = self.make_db()
+        self.add_fruit(vector_db)
+        
+        results = vector_db.search_similar("banana split", FakeEmbeddingModel(), n_results=2)
+        self.assertEqual(results['documents'][0][0], "banana bread")
+        self.assertEqual(len(results['ids'][0]), 2)
+        self.assertAlmostEqual(results['distances'][0][0], 0.0, places=5)
+        
+        self.assertTrue(vector_db.remove_document("banana.pdf"))
+        results = vector_db.search_similar("banana split", FakeEmbeddingModel(), n_results=5)
+        self.assertNotIn("banana bread", results['documents'][0])
+        self.assertEqual(vector_db.collection.count(), 2)
+    
+    def test_tombstones_compaction_and_reopen(self):
+        """Test that deletes compact the matrix and the index survives reopening"""
+        from vector_backends import NumpyCollection
+        
+        vector_db = self.make_db()
+        self.add_fruit(vector_db)
+        vector_db.add_documents(["apple pie"], [[0.9, 0.1, 0.0]], [{"document_id": "apple", "chunk_index": 0}])
+        self.assertEqual(vector_db.collection.count(), 3)
+        vector_db.remove_documents(document_ids=["cherry"])
+        # Two of four rows were tombstoned, which is past the compaction ratio
+        self.assertEqual(vector_db.collection._size, 2)
+        
+        reopened = NumpyCollection("numpy_test", os.path.join(self.tmpdir.name, "numpy_test"))
+        self.assertEqual(sorted(reopened.get()['ids']), ["apple:0", "banana:0"])
+        self.assertEqual(reopened.get(ids=["apple:0"], include=["embeddings"])['embeddings'],
+                         [[0.8999999761581421, 0.10000000149011612, 0.0]])
+    
+    def test_quantized_scan_with_rerank(self):
+        """Test int8 and PQ codes keep recall@5 high, re-rank exactly and survive reopening"""
+        import numpy as np
+        from vector_backends import NumpyCollection
+        
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((40, 32)).astype(np.float32)
+        vectors = centers[rng.integers(0, 40, 3000)] + 0.3 * rng.standard_normal((3000, 32)).astype(np.float32)
+        queries = vectors[rng.choice(3000, 20, replace=False)] + 0.05
+        ids = [f"v{i}" for i in range(len(vectors))]
+        exact = NumpyCollection("exact")
+        exact.upsert(ids=ids, embeddings=vectors)
+        expected = exact.query(queries, n_results=5, include=["distances"])
+        
+        for kind in ["int8", "pq"]:
+            directory = os.path.join(self.tmpdir.name, kind)
+            metadata = {"quantization": kind, "quantization:subvectors": 8, "quantization:scan": "codes"}
+            collection = NumpyCollection(kind, directory, metadata=metadata)
+            collection.upsert(ids=ids[:2000], embeddings=vectors[:2000])
+            collection.upsert(ids=ids[2000:], embeddings=vectors[2000:])
+            self.assertTrue(collection.quantizer.trained)
+            self.assertEqual(collection._codes.shape[1], 32 if kind == "int8" else 8)
+            
+            for found in [collection.query(queries, n_results=5, include=["distances"]),
+                          NumpyCollection(kind, directory).query(queries, n_results=5, include=["distances"])]:
+                recall = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(found['ids'], expected['ids'])])
+                self.assertGreaterEqual(recall, 0.9)
+                # Distances of returned rows are exact, not approximations
+                row = ids.index(found['ids'][0][0])
+                self.assertAlmostEqual(found['distances'][0][0], float(np.sum((vectors[row] - queries[0]) ** 2)), places=3)
+            # Codes are reopened from disk, not re-encoded
+            self.assertIsInstance(NumpyCollection(kind, directory)._codes, np.memmap)
+    
+    def test_code_scan_ranks_in_collection_space(self):
+        """Test that codes are scanned by default and shortlist rows by cosine or inner product"""
+        import numpy as np
+        from vector_backends import NumpyCollection
+        
+        rng = np.random.default_rng(2)
+        directions = rng.standard_normal((3000, 32)).astype(np.float32)
+        vectors = directions * rng.uniform(0.2, 5.0, (3000, 1)).astype(np.float32)
+        queries = vectors[rng.choice(3000, 20, replace=False)] + 0.05
+        ids = [f"v{i}" for i in range(len(vectors))]
+        for space in ["cosine", "ip"]:
+            exact = NumpyCollection("exact", metadata={"hnsw:space": space})
+            exact.upsert(ids=ids, embeddings=vectors)
+            expected = exact.query(queries, n_results=10, include=[])
+            for kind in ["int8", "pq"]:
+                # A shortlist of exactly k rows: the result is the code scan's own ranking
+                collection = NumpyCollection(kind, metadata={
+                    "hnsw:space": space, "quantization": kind, "quantization:subvectors": 16,
+                    "quantization:rerank_factor": 1,
+                })
+                collection.upsert(ids=ids, embeddings=vectors)
+                self.assertTrue(collection._scan_codes)
+                found = collection.query(queries, n_results=10, include=[])
+                recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(found['ids'], expected['ids'])])
+                self.assertGreaterEqual(recall, 0.8, (space, kind))
+    
+    def test_quantizer_refits_as_collection_grows(self):
+        """Test that the quantizer is refitted after the collection doubles and the scan choice is measured"""
+        import numpy as np
+        from vector_backends import NumpyCollection
+        
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((5000, 16)).astype(np.float32)
+        ids = [f"v{i}" for i in range(len(vectors))]
+        directory = os.path.join(self.tmpdir.name, "refit")
+        collection = NumpyCollection("refit", directory, metadata={"quantization": "int8", "quantization:scan": "auto"})
+        collection.upsert(ids=ids[:1200], embeddings=vectors[:1200])
+        self.assertEqual((collection._codes_generation, collection._trained_rows), (1, 1200))
+        collection.upsert(ids=ids[1200:2000], embeddings=vectors[1200:2000])
+        self.assertEqual(collection._codes_generation, 1)
+        collection.upsert(ids=ids[2000:], embeddings=vectors[2000:])
+        self.assertEqual((collection._codes_generation, collection._trained_rows), (2, 5000))
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ["codes-2.npy", "collection.json", "manifest.json", "quantizer-2.npz",
+                          "rows-0.jsonl", "vectors-0.npy"])
+        self.assertIsInstance(collection._scan_codes, bool)
+        
+        collection.delete(ids=ids[:2000])  # compaction rewrites the codes as a new generation
+        reopened = NumpyCollection("refit", directory)
+        self.assertEqual((reopened._rows_generation, reopened._codes_generation, reopened.count()), (1, 3, 3000))
+        np.testing.assert_array_equal(reopened._codes[:3000], collection.quantizer.encode(vectors[2000:]))
+    
+    def test_indexed_filters_and_atomic_compaction(self):
+        """Test that only filterable fields are indexed and an interrupted compaction keeps the old files"""
+        import numpy as np
+        from vector_backends import NumpyCollection
+        
+        directory = os.path.join(self.tmpdir.name, "indexed")
+        collection = NumpyCollection("indexed", directory, compaction_ratio=10)
+        collection.upsert(
+            ids=[f"c{i}" for i in range(6)],
+            embeddings=np.eye(6, dtype=np.float32).tolist(),
+            metadatas=[{"document_id": f"d{i % 3}", "page": i, "chunk_text": f"text {i}"} for i in range(6)],
+        )
+        self.assertEqual({field for field, _ in collection._index}, {"document_id"})
+        
+        collection.delete(ids=["c0"])
+        self.assertEqual(collection.get(where={"document_id": "d0"})['ids'], ["c3"])
+        self.assertEqual(collection.get(where={"$and": [{"document_id": {"$in": ["d1", "d2"]}},
+                                                        {"page": {"$gte": 4}}]})['ids'], ["c4", "c5"])
+        self.assertEqual(collection.get(where={"$or": [{"document_id": "d1"}, {"page": 5}]})['ids'], ["c1", "c4", "c5"])
+        self.assertEqual(collection.get(where={"page": {"$lt": 2}})['ids'], ["c1"])
+        
+        # A compaction that died before switching the manifest leaves only stray files behind
+        open(os.path.join(directory, "vectors-1.npy"), "wb").close()
+        open(os.path.join(directory, "rows-1.jsonl.tmp"), "wb").close()
+        reopened = NumpyCollection("indexed", directory)
+        self.assertEqual(reopened.count(), 5)
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ["rows-0.jsonl", "vectors-0.npy"])
+        
+        reopened.compact()
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ["manifest.json", "rows-1.jsonl", "vectors-1.npy"])
+        self.assertEqual(NumpyCollection("indexed", directory).get(where={"document_id": "d0"})['ids'], ["c3"])
+    
+    def test_distance_spaces(self):
+        """Test that hnsw:space selects squared L2, cosine or inner-product distances"""
+        import numpy as np
+        from vector_backends import NumpyCollection
+        
+        vectors = [[3.0, 0.0], [0.0, 1.0]]
+        query = [1.0, 2.0]
+        expected = {
+            "l2": [8.0, 2.0],
+            "cosine": [1 - 1 / np.sqrt(5), 1 - 2 / np.sqrt(5)],
+            "ip": [1 - 3.0, 1 - 2.0],
+        }
+        for space, distances in expected.items():
+            collection = NumpyCollection(space, metadata={"hnsw:space": space})
+            collection.upsert(ids=["a", "b"], embeddings=vectors)
+            found = collection.query([query], n_results=2, include=["distances"])
+            by_id = dict(zip(found['ids'][0], found['distances'][0]))
+            self.assertAlmostEqual(by_id["a"], distances[0], places=5)
+            self.assertAlmostEqual(by_id["b"], distances[1], places=5)
+            # Inner product favours the long vector; L2 and cosine favour the closer direction
+            self.assertEqual(found['ids'][0][0], "a" if space == "ip" else "b")
+        with self.assertRaises(ValueError):
+            NumpyCollection("bad", metadata={"hnsw:space": "manhattan"})
+    
+    def test_per_collection_index_params(self):
+        """Test that index settings default from config, can be overridden and persist with the collection"""
+        from app import VectorDatabase
+        from config import VECTOR_DB_CONFIG
+        from vector_backends import NumpyCollection
+        
+        vector_db = VectorDatabase(self.tmpdir.name, backend="numpy")
+        vector_db.create_collection("defaults")
+        self.assertEqual(vector_db.collection.metadata["hnsw:M"], VECTOR_DB_CONFIG["index"]["M"])
+        self.assertEqual(vector_db.collection.space, VECTOR_DB_CONFIG["index"]["space"])
+        
+        vector_db.create_collection("tuned", index_params={"space": "ip", "search_ef": 64})
+        self.assertEqual(vector_db.collection.metadata["hnsw:search_ef"], 64)
+        self.assertEqual(vector_db.collection.metadata["hnsw:M"], VECTOR_DB_CONFIG["index"]["M"])
+        reopened = NumpyCollection("tuned", vector_db.collection.directory)
+        self.assertEqual(reopened.space, "ip")
+
+class TestShardedBackend(unittest.TestCase):
+    """Test scatter-gather search over shard worker processes"""
+    
+    def test_matches_single_store_and_routes_by_document(self):
+        """Test that sharded results equal a single store and writes hit only the owning shard"""
+        import numpy as np
+        from unittest.mock import patch
+        from app import VectorDatabase, VECTOR_DB_CONFIG
+        from sharding import shard_for
+        
+        chunks = [f"{word} note {i}" for i, word in enumerate(["apple", "banana", "cherry", "plain"] * 6)]
+        metadata = [{"filename": f"doc{i % 6}.pdf", "document_id": f"doc{i % 6}", "chunk_index": i // 6}
+                    for i in range(len(chunks))]
+        rng = np.random.default_rng(0)
+        embeddings = rng.standard_normal((len(chunks), 8)).tolist()
+        query = rng.standard_normal(8)
+        
+        with patch.dict(VECTOR_DB_CONFIG, {"num_shards": 3, "shard_backend": "numpy"}):
+            sharded = VectorDatabase(backend="sharded")
+        single = VectorDatabase(backend="numpy")
+        for vector_db in (sharded, single):
+            vector_db.create_collection("sharded_test")
+            vector_db.add_documents(chunks, embeddings, metadata)
+        try:
+            for hybrid in (False, True):
+                expected = single.search_similar("banana note 5", n_results=4, hybrid=hybrid, query_embedding=query)
+                found = sharded.search_similar("banana note 5", n_results=4, hybrid=hybrid, query_embedding=query)
+                self.assertEqual(found['ids'], expected['ids'])
+                self.assertEqual(len(found['ids'][0]), 4)
+            
+            pages = [sharded.collection.get(limit=5, offset=offset, include=[])['ids'] for offset in range(0, 24, 5)]
+            self.assertEqual(sorted(id for page in pages for id in page), sorted(single.collection.get(include=[])['ids']))
+            self.assertEqual(len(sharded.list_documents()), 6)
+            
+            owner = shard_for("doc2", 3)
+            before = sharded.client.scatter({i: ("call", "sharded_test", "count", (), {}) for i in range(3)})
+            self.assertEqual(sharded.remove_documents(document_ids=["doc2"])["removed"], 4)
+            after = sharded.client.scatter({i: ("call", "sharded_test", "count", (), {}) for i in range(3)})
+            self.assertEqual({i: before[i] - after[i] for i in range(3)}, {i: 4 if i == owner else 0 for i in range(3)})
+        finally:
+            for vector_db in (sharded, single):
+                vector_db.client.delete_collection("sharded_test")
+    
+    def test_layout_checked_and_failed_scatter_drained(self):
+        """Test that a store reopens only with its shard count and a failed send leaves no stale reply"""
+        from unittest.mock import patch
+        from sharding import ShardedClient
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = ShardedClient(2, "numpy", tmpdir)
+            try:
+                collection = client.create_collection("drain_test")
+                collection.upsert(ids=["a:0", "b:0"], embeddings=[[1.0, 0.0], [0.0, 1.0]])
+                with patch.object(client.shards[1], "send", side_effect=BrokenPipeError("worker gone")):
+                    with self.assertRaises(BrokenPipeError):
+                        collection.count()
+                self.assertEqual(collection.count(), 2)
+                self.assertEqual(collection.query([[1.0, 0.0]], n_results=10, include=[])['ids'], [["a:0", "b:0"]])
+                with self.assertRaises(ValueError):
+                    ShardedClient(3, "numpy", tmpdir)
+            finally:
+                client.close()
+
+    def test_custom_ids_placed_by_document_id(self):
+        """Test that chunks whose IDs do not embed the document ID live on the document's shard"""
+        from sharding import ShardedClient, shard_for
+        
+        client = ShardedClient(3, "numpy")
+        try:
+            collection = client.create_collection("custom_ids")
+            ids = [f"a_{i}" for i in range(4)]
+            collection.upsert(ids=ids, embeddings=[[1.0, float(i)] for i in range(4)],
+                              metadatas=[{"document_id": "a"}] * 4)
+            collection.upsert(ids=["b:0"], embeddings=[[0.0, 1.0]])
+            counts = client.scatter({i: ("call", "custom_ids", "count", (), {}) for i in range(3)})
+            self.assertEqual(counts[shard_for("a", 3)], 4 + (shard_for("b", 3) == shard_for("a", 3)))
+            
+            self.assertEqual(sorted(collection.get(where={"document_id": "a"}, include=[])['ids']), ids)
+            self.assertEqual(collection.get(ids=["a_2", "b:0", "missing"], include=[])['ids'], ["a_2", "b:0"])
+            collection.delete(ids=["a_3"])
+            collection.delete(where={"document_id": "a"})
+            self.assertEqual(collection.get(include=[])['ids'], ["b:0"])
+        finally:
+            client.close()
+
+class TestHybridSearch(unittest.TestCase):
+    """Test BM25 indexing and hybrid dense + lexical retrieval"""
+    
+    def test_bm25_incremental_and_journaled(self):
+        """Test that the index ranks exact identifiers and survives add/remove/reopen"""
+        from lexical_index import BM25Index
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "index.jsonl")
+            index = BM25Index(path)
+            index.add(["a", "b", "c"], ["Replace valve PX-00042 yearly", "Clause 3.2.1 covers valves", "General notes"])
+            self.assertEqual(index.search("px-00042")[0][0], "a")
+            self.assertEqual(index.search("3.2.1")[0][0], "b")
+            
+            index.remove(["a"])
+            index.add(["d"], ["PX-00042 is obsolete"])
+            reopened = BM25Index(path)
+            self.assertEqual([id for id, _ in reopened.search("PX-00042")], ["d"])
+            self.assertEqual(len(reopened), 3)
+
+    def test_bm25_common_terms_and_compaction(self):
+        """Test that common terms only re-score rarer matches and the journal is compacted"""
+        from lexical_index import BM25Index
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "index.jsonl")
+            index = BM25Index(path, compaction_ratio=0.01)
+            for round in range(5):
+                index.add([f"c{i}" for i in range(20)], [f"valve report round {round}"] * 19 + ["valve PX-7"])
+            with open(path) as f:
+                self.assertLess(len(f.readlines()), 5 * 20)
+
+            self.assertEqual([id for id, _ in index.search("the valve PX-7")], ["c19"])
+            self.assertEqual(len(index.search("valve", n_results=50)), 20)
+
+            reopened = BM25Index(path)
+            self.assertEqual(len(reopened), 20)
+            self.assertEqual(reopened.search("px-7"), index.search("px-7"))
+    
+    def test_bm25_snapshot_cache_bounded(self):
+        """Test that cached posting snapshots stay under their cap without changing results"""
+        from lexical_index import BM25Index
+        
+        texts = [f"term{i % 7} term{i % 11} shared{i % 3}" for i in range(200)]
+        capped, uncapped = BM25Index(max_snapshot_postings=60), BM25Index()
+        for index in (capped, uncapped):
+            index.add([f"c{i}" for i in range(200)], texts)
+        for query in ["term1 shared0", "term2 term3", "shared1", "term4 term10 shared2"] * 2:
+            self.assertEqual(capped.search(query, n_results=20), uncapped.search(query, n_results=20))
+            self.assertLessEqual(capped._snapshot_postings, 60)
+        self.assertEqual(capped._snapshot_postings, sum(map(len, capped._snapshots.values())))
+        self.assertGreater(uncapped._snapshot_postings, 60)
+    
+    def test_fusion_surfaces_lexical_match(self):
+        """Test that an exact-term match missing from the dense top-k is fused in"""
+        from app import VectorDatabase
+        from lexical_index import reciprocal_rank_fusion
+        
+        self.assertEqual(reciprocal_rank_fusion([["x", "y"], ["y", "z"]])[0][0], "y")
+        
+        vector_db = VectorDatabase(backend="numpy")
+        vector_db.create_collection("hybrid_test")
+        try:
+            chunks = ["apple pie"] * 5 + ["cherry code ERR_TIMEOUT"]
+            vector_db.add_documents(
+                chunks,
+                FakeEmbeddingModel().encode(chunks).tolist(),
+                [{"document_id": "doc", "chunk_index": i} for i in range(len(chunks))]
+            )
+            dense = vector_db.search_similar("apple ERR_TIMEOUT", FakeEmbeddingModel(), n_results=3, hybrid=False)
+            hybrid = vector_db.search_similar("apple ERR_TIMEOUT", FakeEmbeddingModel(), n_results=3, hybrid=True)
+        finally:
+            vector_db.client.delete_collection("hybrid_test")
+        
+        self.assertNotIn("doc:5", dense['ids'][0])
+        self.assertIn("doc:5", hybrid['ids'][0])
+        self.assertEqual(len(hybrid['scores'][0]), 3)
+
+class TestQueryCaches(unittest.TestCase):
+    """Test the query embedding LRU and the semantic answer cache"""
+    
+    def test_query_embedding_lru(self):
+        """Test that repeat queries skip encoding and old entries are evicted"""
+        from embeddings import QueryEmbeddingCache
+        
+        class CountingModel(FakeEmbeddingModel):
+            calls = 0
+            
+            def encode(self, texts, **kwargs):
+                CountingModel.calls += len(texts)
+                return super().encode(texts, **kwargs)
+        
+        model = CountingModel()
+        cache = QueryEmbeddingCache(max_entries=2)
+        cache.encode(model, "apple  pie")
+        self.assertEqual(cache.encode(model, "apple pie").tolist(), [1.0, 0.0, 0.0])
+        self.assertEqual(CountingModel.calls, 1)
+        
+        cache.encode(model, "banana")
+        cache.encode(model, "cherry")
+        cache.encode(model, "apple pie")
+        self.assertEqual(CountingModel.calls, 4)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()["hits"], 1)
+        # A different model never sees another model's vectors
+        cache.encode(CountingModel(), "apple pie")
+        self.assertEqual(CountingModel.calls, 5)
+    
+    def test_semantic_answers_invalidated_on_add_and_remove(self):
+        """Test threshold matching and invalidation through VectorDatabase writes"""
+        from app import VectorDatabase
+        from answer_cache import get_answer_cache
+        
+        vector_db = VectorDatabase(backend="numpy")
+        vector_db.create_collection("answer_cache_test")
+        cache = get_answer_cache(threshold=0.9, max_entries=10)
+        try:
+            chunks = ["apple pie", "banana bread"]
+            vector_db.add_documents(
+                chunks,
+                FakeEmbeddingModel().encode(chunks).tolist(),
+                [{"document_id": chunk.split()[0], "chunk_index": 0} for chunk in chunks]
+            )
+            key, version = vector_db.collection_key, vector_db.version
+            cache.store(key, version, "apple?", [1.0, 0.0, 0.0], "Pie.", ["apple.pdf"], scope="gpt")
+            
+            hit = cache.lookup(key, version, [0.99, 0.05, 0.0], scope="gpt")
+            self.assertEqual((hit["answer"], hit["sources"]), ("Pie.", ["apple.pdf"]))
+            self.assertIsNone(cache.lookup(key, version, [0.0, 1.0, 0.0], scope="gpt"))
+            self.assertIsNone(cache.lookup(key, version, [1.0, 0.0, 0.0], scope="claude"))
+            
+            # Removing a document bumps the version and drops the answers
+            vector_db.remove_documents(document_ids=["banana"])
+            self.assertGreater(vector_db.version, version)
+            self.assertEqual(len(cache), 0)
+            self.assertIsNone(cache.lookup(key, vector_db.version, [1.0, 0.0, 0.0], scope="gpt"))
+            self.assertEqual(cache.stats()["hits"], 1)
+        finally:
+            vector_db.client.delete_collection("answer_cache_test")
+
+class TestResponseCache(unittest.TestCase):
+    """Test the disk-backed exact-match LLM response cache"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "responses.sqlite3")
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_keys_ttl_and_sharing(self):
+        """Test key components, expiry and that a second connection sees stored responses"""
+        import time
+        from answer_cache import ResponseCache, response_key
+        
+        key = response_key("OpenAI", "gpt-4", 0.7, "Context: x")
+        self.assertNotEqual(key, response_key("OpenAI", "gpt-4", 0.2, "Context: x"))
+        self.assertNotEqual(key, response_key("Claude", "gpt-4", 0.7, "Context: x"))
+        self.assertNotEqual(key, response_key("OpenAI", "gpt-4", 0.7, "Context: y"))
+        
+        writer = ResponseCache(self.path, ttl_seconds=0.2)
+        reader = ResponseCache(self.path, ttl_seconds=0.2)  # as another process would open it
+        self.assertIsNone(reader.get(key))
+        writer.put(key, "Answer.")
+        self.assertEqual(reader.get(key), "Answer.")
+        time.sleep(0.3)
+        self.assertIsNone(reader.get(key))
+        self.assertEqual((reader.stats()["hits"], reader.stats()["misses"]), (1, 2))
+        writer.close()
+        reader.close()
+    
+    def test_size_eviction_least_recently_used(self):
+        """Test that the least recently used responses go once over the size limit"""
+        from answer_cache import ResponseCache
+        
+        cache = ResponseCache(self.path, max_size_mb=3000 / (1024 * 1024))
+        for name in ["a", "b", "c"]:
+            cache.put(name, name * 1000)
+        cache.get("a")
+        cache.put("d", "d" * 1000)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "a" * 1000)
+        self.assertEqual(cache.get("d"), "d" * 1000)
+        self.assertLessEqual(cache.stats()["size_mb"] * 1024 * 1024, 3000)
+        cache.close()
+    
+    def test_size_shared_across_connections(self):
+        """Test that replacing a key is not double-counted and the limit holds across processes"""
+        from answer_cache import ResponseCache
+        
+        first = ResponseCache(self.path, max_size_mb=3000 / (1024 * 1024))
+        second = ResponseCache(self.path, max_size_mb=3000 / (1024 * 1024))  # as another process would open it
+        for _ in range(5):
+            first.put("a", "a" * 1000)
+        self.assertEqual(second.stats()["size_mb"] * 1024 * 1024, 1000)
+        first.put("b", "b" * 1000)
+        second.put("c", "c" * 1000)
+        second.put("d", "d" * 1000)
+        self.assertIsNone(first.get("a"))
+        self.assertLessEqual(first.stats()["size_mb"] * 1024 * 1024, 3000)
+        first.close()
+        second.close()
+    
+    def test_generate_response_reuses_cached_answer(self):
+        """Test that a repeated prompt is answered from the cache without calling the LLM"""
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from app import LLMProvider
+        import config
+        
+        class FakeLangChain:
+            calls = 0
+            
+            def invoke(self, prompt):
+                FakeLangChain.calls += 1
+                return SimpleNamespace(content=f"Answer {FakeLangChain.calls}")
+        
+        llm = LLMProvider("InvalidProvider", "fake_key")
+        llm.provider, llm.client = "Claude", FakeLangChain()
+        with patch.dict(config.RESPONSE_CACHE_CONFIG, {"path": self.path}):
+            self.assertEqual(llm.generate_response("q", "ctx"), "Answer 1")
+            self.assertEqual(llm.generate_response("q", "ctx"), "Answer 1")
+            self.assertEqual(llm.generate_response("q", "other ctx"), "Answer 2")
+        self.assertEqual(FakeLangChain.calls, 2)
+
+class TestBatchSearch(unittest.TestCase):
+    """Test the batched multi-query search API"""
+    
+    def test_batch_matches_single_queries(self):
+        """Test one encode pass and one store query give the same per-query results"""
+        from app import VectorDatabase
+        
+        class CountingModel(FakeEmbeddingModel):
+            batches = 0
+            
+            def encode(self, texts, **kwargs):
+                CountingModel.batches += 1
+                return super().encode(texts, **kwargs)
+        
+        vector_db = VectorDatabase(backend="numpy")
+        vector_db.create_collection("batch_test")
+        try:
+            chunks = ["apple pie", "banana bread", "cherry tart", "plain notes PX-7"]
+            vector_db.add_documents(
+                chunks,
+                FakeEmbeddingModel().encode(chunks).tolist(),
+                [{"document_id": f"doc{i}", "chunk_index": 0} for i in range(len(chunks))]
+            )
+            queries = ["banana batch", "cherry batch", "apple PX-7 batch"]
+            model = CountingModel()
+            batch = vector_db.search_similar_batch(queries, model, n_results=2, hybrid=True)
+            self.assertEqual(CountingModel.batches, 1)
+            
+            single = [vector_db.search_similar(query, model, n_results=2, hybrid=True) for query in queries]
+            self.assertEqual(CountingModel.batches, 1)  # served from the query LRU
+            self.assertEqual(batch, single)
+            self.assertEqual(batch[0]['documents'][0][0], "banana bread")
+            self.assertIn("doc3:0", batch[2]['ids'][0])
+            
+            dense = vector_db.search_similar_batch(queries, model, n_results=1, hybrid=False)
+            self.assertEqual([result['ids'][0] for result in dense], [["doc1:0"], ["doc2:0"], ["doc0:0"]])
+        finally:
+            vector_db.client.delete_collection("batch_test")
+
+class TestScopedSearch(unittest.TestCase):
+    """Test document-scoped search with a store-side filter"""
+    
+    def test_scope_by_document_id_and_filename(self):
+        """Test that dense and lexical hits outside the scoped documents are excluded"""
+        from app import VectorDatabase
+        
+        for backend in ["numpy", "chroma"]:
+            vector_db = VectorDatabase(backend=backend)
+            vector_db.create_collection("scoped_test")
+            try:
+                chunks = ["apple pie", "apple crumble", "banana bread PX-9", "banana apple PX-9"]
+                vector_db.add_documents(
+                    chunks,
+                    FakeEmbeddingModel().encode(chunks).tolist(),
+                    [{"filename": f"{name}.pdf", "document_id": name, "chunk_index": i}
+                     for i, name in enumerate(["a", "a", "b", "c"])]
+                )
+                unscoped = vector_db.search_similar("apple PX-9", FakeEmbeddingModel(), n_results=4)
+                self.assertEqual(len(unscoped['ids'][0]), 4)
+                
+                scoped = vector_db.search_similar("apple PX-9", FakeEmbeddingModel(), n_results=4, document_ids=["b"])
+                self.assertEqual(scoped['ids'][0], ["b:2"])
+                dense = vector_db.search_similar("apple", FakeEmbeddingModel(), n_results=4, hybrid=False,
+                                                 filenames=["b.pdf", "c.pdf"])
+                self.assertEqual(sorted(dense['ids'][0]), ["b:2", "c:3"])
+                batch = vector_db.search_similar_batch(["apple", "PX-9"], FakeEmbeddingModel(), n_results=4,
+                                                       document_ids=["a"], filenames=["c.pdf"])
+                self.assertTrue(all(id.split(":")[0] in ("a", "c") for result in batch for id in result['ids'][0]))
+            finally:
+                vector_db.client.delete_collection("scoped_test")
+
+    def test_lexical_scope_without_store_lookup(self):
+        """Test that the BM25 allow-set comes from the lexical index and its scopes survive reopening"""
+        from unittest.mock import patch
+        from app import VectorDatabase
+        from lexical_index import BM25Index
+
+        vector_db = VectorDatabase(backend="numpy")
+        vector_db.create_collection("scoped_lexical_test")
+        try:
+            chunks = ["apple pie", "banana bread PX-9", "banana apple PX-9"]
+            vector_db.add_documents(
+                chunks,
+                FakeEmbeddingModel().encode(chunks).tolist(),
+                [{"filename": f"{name}.pdf", "document_id": name, "chunk_index": i}
+                 for i, name in enumerate(["a", "b", "c"])]
+            )
+            with patch.object(vector_db.collection, "get", side_effect=AssertionError("store lookup")):
+                scoped = vector_db.search_similar("PX-9", FakeEmbeddingModel(), n_results=4, filenames=["c.pdf"])
+            self.assertEqual(scoped['ids'][0], ["c:2"])
+        finally:
+            vector_db.client.delete_collection("scoped_lexical_test")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "index.jsonl")
+            index = BM25Index(path)
+            index.add(["a:0", "b:0"], ["apple", "banana"], [{"document_id": "a"}, {"document_id": "b", "filename": "b.pdf"}])
+            index.remove(["a:0"])
+            reopened = BM25Index(path)
+            self.assertTrue(reopened.scoped)
+            self.assertEqual(reopened.scoped_ids("filename", ["b.pdf"]), {"b:0"})
+            self.assertEqual(reopened.scoped_ids("document_id", ["a", "b"]), {"b:0"})
+            reopened.add(["c:0"], ["cherry"])
+            self.assertFalse(reopened.scoped)
+
+class TestReranking(unittest.TestCase):
+    """Test the cross-encoder re-ranking stage and stage timings"""
+    
+    class FakeCrossEncoder:
+        """Scores a pair by how many query words the document contains"""
+        
+        def __init__(self, delay=0.0):
+            self.delay = delay
+            self.batches = []
+        
+        def predict(self, pairs, batch_size=32, show_progress_bar=False):
+            import time
+            time.sleep(self.delay)
+            self.batches.append(len(pairs))
+            return [float(sum(word in document.split() for word in query.split())) for query, document in pairs]
+    
+    def results(self):
+        documents = ["apple", "banana cherry", "cherry", "apple banana cherry"]
+        return {
+            "ids": [[f"c{i}" for i in range(4)]],
+            "documents": [documents],
+            "metadatas": [[{"filename": f"{i}.pdf"} for i in range(4)]],
+            "distances": [[0.1, 0.2, 0.3, 0.4]],
+            "embeddings": None
+        }
+    
+    def test_rerank_in_one_batch(self):
+        """Test that candidates are scored in one batch and re-ordered"""
+        from reranker import CrossEncoderReranker
+        
+        reranker = CrossEncoderReranker("fake", batch_size=32, time_budget_ms=1000)
+        reranker._model = self.FakeCrossEncoder()
+        reranked, info = reranker.rerank("banana cherry", self.results(), n_results=2)
+        self.assertEqual(reranker._model.batches, [4])
+        self.assertTrue(info["reranked"])
+        self.assertEqual(reranked['ids'], [["c1", "c3"]])
+        self.assertEqual(reranked['distances'], [[0.2, 0.4]])
+        self.assertEqual(reranked['rerank_scores'], [[2.0, 2.0]])
+    
+    def test_fallback_when_over_budget(self):
+        """Test that bi-encoder order is kept when scoring overruns the budget"""
+        from reranker import CrossEncoderReranker
+        
+        reranker = CrossEncoderReranker("fake", batch_size=2, time_budget_ms=5)
+        reranker._model = self.FakeCrossEncoder(delay=0.02)
+        fallback, info = reranker.rerank("banana cherry", self.results(), n_results=2)
+        self.assertFalse(info["reranked"])
+        self.assertEqual(reranker._model.batches, [2])  # stopped after the first batch
+        self.assertEqual(fallback['ids'], [["c0", "c1"]])
+        # The learned per-pair cost now skips scoring up front
+        _, info = reranker.rerank("banana cherry", self.results(), n_results=2)
+        self.assertEqual(info["reason"], "predicted over budget")
+        self.assertEqual(reranker.fallbacks, 2)
+    
+    def test_reprobe_and_budget_sized_batches(self):
+        """Test that a slow first call is interrupted and scoring is retried after the cooldown"""
+        from reranker import CrossEncoderReranker
+        
+        results = self.results()
+        results = {key: [value[0] * 5] if isinstance(value, list) else value for key, value in results.items()}
+        reranker = CrossEncoderReranker("fake", batch_size=32, time_budget_ms=10, reprobe_seconds=0)
+        reranker._model = self.FakeCrossEncoder(delay=0.02)
+        _, info = reranker.rerank("banana cherry", results, n_results=2)
+        self.assertEqual(info["reason"], "over budget")
+        self.assertEqual(reranker._model.batches, [CrossEncoderReranker.probe_size])
+        
+        # The model warmed up: the re-probe scores again and re-ranking resumes
+        reranker._model.delay = 0.0
+        for _ in range(3):
+            reranked, info = reranker.rerank("banana cherry", results, n_results=2)
+        self.assertTrue(info["reranked"])
+        self.assertIsNone(info["reason"])
+        self.assertEqual(reranked['ids'][0][0], "c1")
+    
+    def test_stage_timings(self):
+        """Test stage timers and the percentile summary"""
+        from metrics import LatencyRecorder, StageTimer
+        
+        timer = StageTimer()
+        with timer.stage("search"):
+            pass
+        timer.add("llm", 0.5)
+        recorder = LatencyRecorder(window=3)
+        for _ in range(5):
+            recorder.record(timer.timings)
+        summary = recorder.summary()
+        self.assertEqual(summary["llm"]["count"], 3)
+        self.assertAlmostEqual(summary["llm"]["p95_ms"], 500.0)
+        self.assertIn('"samples_ms"', recorder.export_json())
+
 class TestVectorDatabase(unittest.TestCase):
     """Test vector database functionality"""
     
@@ -83,6 +1294,372 @@ class TestLLMProvider(unittest.TestCase):
         # Test with invalid provider
         provider = LLMProvider("InvalidProvider", "fake_key")
         self.assertIsNone(provider.client)
+    
+    def test_sdk_retries_disabled_for_every_provider(self):
+        """Test that every provider's client is built without SDK retries while the rate limiter retries"""
+        from unittest.mock import patch
+        import app
+        from app import LLMProvider
+        
+        built = {}
+        
+        def recorder(name):
+            def build(*args, **kwargs):
+                built[name] = kwargs
+                return object()
+            return build
+        
+        with patch.object(app, "ChatOpenAI", recorder("OpenAI")), \
+                patch.object(app, "ChatAnthropic", recorder("Claude")), \
+                patch.object(app, "AzureOpenAI", recorder("Azure")), \
+                patch.object(app, "ChatGoogleGenerativeAI", recorder("Grok")), \
+                patch.object(app.genai, "configure"):
+            providers = {name: LLMProvider(name, "key", f"retry-test-{name}", "https://example.invalid")
+                         for name in ["OpenAI", "Claude", "Azure", "Grok"]}
+        
+        self.assertEqual({name: kwargs.get("max_retries") for name, kwargs in built.items()},
+                         {"OpenAI": 0, "Claude": 0, "Azure": 0, "Grok": 0})
+        # Gemini's LangChain wrapper retries regardless, so its limiter does not add retries
+        self.assertEqual(providers["Grok"].rate_limiter.max_attempts, 1)
+        self.assertGreater(providers["Claude"].rate_limiter.max_attempts, 1)
+    
+    def test_stream_response(self):
+        """Test that Azure and LangChain streams yield text pieces and time the first token"""
+        import time
+        from types import SimpleNamespace
+        from app import LLMProvider
+        from metrics import StageTimer, timed_stream
+        
+        def azure_chunk(text):
+            return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))] if text is not None else [])
+        
+        class FakeAzure:
+            def __init__(self):
+                self.chat = SimpleNamespace(completions=self)
+            
+            def create(self, stream=False, **kwargs):
+                self.kwargs = kwargs
+                return iter([azure_chunk(None), azure_chunk("Hel"), azure_chunk(None), azure_chunk("lo")])
+        
+        class FakeLangChain:
+            def stream(self, prompt):
+                time.sleep(0.02)
+                yield SimpleNamespace(content="")
+                yield SimpleNamespace(content="Hi")
+                yield SimpleNamespace(content=[{"type": "text", "text": " there"}])
+        
+        azure = LLMProvider("InvalidProvider", "fake_key")
+        azure.provider, azure.client = "Azure", FakeAzure()
+        self.assertEqual(list(azure.stream_response("q", "ctx")), ["Hel", "lo"])
+        self.assertIn("Question: q", azure.client.kwargs["messages"][1]["content"])
+        
+        claude = LLMProvider("InvalidProvider", "fake_key")
+        claude.provider, claude.client = "Claude", FakeLangChain()
+        timer = StageTimer()
+        self.assertEqual("".join(timed_stream(claude.stream_response("q", "ctx"), timer)), "Hi there")
+        self.assertGreaterEqual(timer.timings["ttft"], 0.02)
+        self.assertGreaterEqual(timer.timings["llm"], timer.timings["ttft"])
+        
+        with self.assertRaises(RuntimeError):
+            list(LLMProvider("InvalidProvider", "fake_key").stream_response("q", "ctx"))
+
+class TestLLMClientPool(unittest.TestCase):
+    """Test the process-wide pool of reusable LLM clients"""
+    
+    class FakeClient:
+        def __init__(self):
+            self.closed = False
+        
+        def close(self):
+            self.closed = True
+    
+    def test_clients_reused_and_built_once(self):
+        """Test that concurrent leases of one key share a single client"""
+        import threading
+        import time
+        from llm_clients import ClientPool, client_key
+        
+        pool = ClientPool()
+        built = []
+        
+        def factory():
+            time.sleep(0.02)
+            built.append(self.FakeClient())
+            return built[-1]
+        
+        key = client_key("OpenAI", "gpt-4", None, "sk-secret")
+        self.assertNotIn("sk-secret", repr(key))
+        self.assertNotEqual(key, client_key("OpenAI", "gpt-4", None, "sk-other"))
+        leased = []
+        
+        def worker():
+            with pool.lease(key, factory) as client:
+                leased.append(client)
+        
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(built), 1)
+        self.assertEqual(len(set(map(id, leased))), 1)
+        self.assertEqual(pool.stats()["created"], 1)
+        self.assertEqual(pool.stats()["reused"], 7)
+    
+    def test_idle_and_overflow_eviction(self):
+        """Test that idle clients are closed, but never while leased"""
+        from llm_clients import ClientPool
+        
+        pool = ClientPool(idle_seconds=0, max_clients=1)
+        with pool.lease("a", self.FakeClient) as a:
+            with pool.lease("b", self.FakeClient) as b:
+                pool.evict_idle()
+                self.assertFalse(a.closed or b.closed)
+            # b was released and is over budget
+            self.assertTrue(b.closed)
+            self.assertFalse(a.closed)
+        self.assertTrue(a.closed)
+        self.assertEqual(pool.stats()["clients"], 0)
+        
+        pool = ClientPool(idle_seconds=60, max_clients=1)
+        with pool.lease("a", self.FakeClient) as a:
+            pass
+        with pool.lease("b", self.FakeClient):
+            pass
+        self.assertTrue(a.closed)
+        self.assertEqual(pool.stats()["clients"], 1)
+    
+    def test_discarded_client_closed_after_last_lease(self):
+        """Test that discarding a leased client closes it once every lease is released"""
+        from llm_clients import ClientPool
+        
+        pool = ClientPool()
+        with pool.lease("a", self.FakeClient) as first:
+            with pool.lease("a", self.FakeClient) as second:
+                self.assertIs(first, second)
+                pool.discard("a")
+                self.assertFalse(first.closed)
+            self.assertFalse(first.closed)
+            with pool.lease("a", self.FakeClient) as rebuilt:
+                self.assertIsNot(rebuilt, first)
+        self.assertTrue(first.closed)
+        self.assertFalse(rebuilt.closed)
+        self.assertEqual(pool.stats()["clients"], 1)
+
+class TestLLMRouter(unittest.TestCase):
+    """Test concurrency-limited and hedged async LLM calls"""
+    
+    def call(self, delay, answer="ok", error=None, log=None):
+        import asyncio
+        
+        async def run():
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                if log is not None:
+                    log.append(f"cancelled {answer}")
+                raise
+            if error:
+                raise error
+            return answer
+        return run
+    
+    def test_concurrency_limit(self):
+        """Test that no more than the provider's limit run at once"""
+        import asyncio
+        from llm_async import LLMRouter, run_sync
+        
+        router = LLMRouter({"OpenAI": 2}, default_concurrency=3)
+        running, peak = {"OpenAI": 0, "Claude": 0}, {"OpenAI": 0, "Claude": 0}
+        
+        def tracked(provider):
+            async def run():
+                running[provider] += 1
+                peak[provider] = max(peak[provider], running[provider])
+                await asyncio.sleep(0.01)
+                running[provider] -= 1
+                return provider
+            return run
+        
+        async def burst():
+            return await asyncio.gather(*(
+                router.generate(name, tracked(name)) for name in ["OpenAI", "Claude"] * 6
+            ))
+        
+        self.assertEqual(run_sync(burst()).count("OpenAI"), 6)
+        self.assertEqual(peak, {"OpenAI": 2, "Claude": 3})
+    
+    def test_streams_share_the_concurrency_limit(self):
+        """Test that a streamed answer holds its provider's slot until the stream ends"""
+        import asyncio
+        from llm_async import LLMRouter, run_sync
+        
+        router = LLMRouter({"OpenAI": 1})
+        stream = router.stream("OpenAI", iter(["a", "b"]))
+        self.assertEqual(next(stream), "a")
+        
+        async def waits_for_slot():
+            try:
+                await asyncio.wait_for(router.generate("OpenAI", self.call(0, "later")), 0.05)
+                return False
+            except asyncio.TimeoutError:
+                return True
+        self.assertTrue(run_sync(waits_for_slot()))
+        self.assertEqual(list(stream), ["b"])
+        self.assertEqual(run_sync(router.generate("OpenAI", self.call(0, "now"))), "now")
+        
+        # A stream that fails releases its slot too
+        def failing():
+            yield "a"
+            raise ValueError("dropped")
+        with self.assertRaises(ValueError):
+            list(router.stream("OpenAI", failing()))
+        self.assertEqual(run_sync(router.generate("OpenAI", self.call(0, "again"))), "again")
+    
+    def test_hedged_requests(self):
+        """Test that a slow primary is hedged, the loser cancelled and hedge stats reported"""
+        from llm_async import LLMRouter, run_sync
+        
+        router = LLMRouter()
+        fast = run_sync(router.hedged(("OpenAI", self.call(0.01, "primary")), ("Claude", self.call(0.01, "hedge")), 0.2))
+        self.assertEqual((fast["answer"], fast["hedged"]), ("primary", False))
+        
+        log = []
+        slow = run_sync(router.hedged(("OpenAI", self.call(1.0, "primary", log=log)),
+                                      ("Claude", self.call(0.01, "hedge")), 0.05))
+        self.assertEqual((slow["answer"], slow["provider"], slow["hedged"]), ("hedge", "Claude", True))
+        self.assertLess(slow["seconds"], 0.5)
+        self.assertEqual(log, ["cancelled primary"])
+        
+        # A failed primary is hedged straight away; if both fail the primary's error is raised
+        failed = run_sync(router.hedged(("OpenAI", self.call(0, error=ValueError("429"))),
+                                        ("Claude", self.call(0.01, "hedge")), 5))
+        self.assertEqual(failed["answer"], "hedge")
+        self.assertLess(failed["seconds"], 1)
+        with self.assertRaisesRegex(ValueError, "429"):
+            run_sync(router.hedged(("OpenAI", self.call(0, error=ValueError("429"))),
+                                   ("Claude", self.call(0, error=KeyError("x"))), 5))
+        
+        stats = router.stats()
+        self.assertEqual((stats["requests"], stats["hedged"], stats["hedge_wins"]), (4, 3, 2))
+        self.assertAlmostEqual(stats["hedge_rate"], 0.75)
+        self.assertIn("p99_ms", stats)
+
+    def test_hedged_retrieves_every_exception(self):
+        """Test that a failed call finishing alongside the winner is drained, not reported as unretrieved"""
+        import gc
+        from llm_async import LLMRouter, get_llm_loop, run_sync
+        
+        loop = get_llm_loop()
+        reported = []
+        previous = loop.get_exception_handler()
+        loop.set_exception_handler(lambda loop, context: reported.append(context["message"]))
+        try:
+            router = LLMRouter()
+            for _ in range(5):
+                result = run_sync(router.hedged(("OpenAI", self.call(0.01, "primary")),
+                                                ("Claude", self.call(0.01, error=ValueError("529"))), 0))
+                self.assertEqual(result["answer"], "primary")
+            gc.collect()
+            run_sync(self.call(0.01)())
+        finally:
+            loop.set_exception_handler(previous)
+        self.assertEqual(reported, [])
+
+class TestRateLimiter(unittest.TestCase):
+    """Test token-bucket rate limiting and retries with backoff"""
+    
+    class HTTPError(Exception):
+        def __init__(self, status_code):
+            super().__init__(f"HTTP {status_code}")
+            self.status_code = status_code
+    
+    def flaky(self, failures, error):
+        calls = []
+        
+        def call():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise error
+            return "ok"
+        return call, calls
+    
+    def test_callers_queue_for_tokens(self):
+        """Test that an exhausted bucket delays the next caller instead of failing it"""
+        import time
+        from rate_limit import RateLimiter, RateLimitTimeout
+        
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+        start = time.monotonic()
+        limiter.call(lambda: None, tokens=6000)
+        self.assertLess(time.monotonic() - start, 0.05)
+        limiter.call(lambda: None, tokens=10)  # 10 tokens at 100/s
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        with self.assertRaises(RateLimitTimeout):
+            limiter.call(lambda: None, tokens=6000, deadline_seconds=0.5)
+        stats = limiter.stats()
+        self.assertEqual((stats["calls"], stats["gave_up"]), (2, 1))
+        self.assertGreaterEqual(stats["queue_p99_ms"], 90)
+    
+    def test_transient_errors_retried_with_backoff(self):
+        """Test retries of 429/5xx up to max_attempts, and no retry of other errors"""
+        import asyncio
+        import random
+        from rate_limit import RateLimiter, is_transient
+        
+        self.assertTrue(is_transient(self.HTTPError(429)))
+        self.assertTrue(is_transient(type("RateLimitError", (Exception,), {})()))
+        self.assertFalse(is_transient(self.HTTPError(401)))
+        self.assertFalse(is_transient(ValueError("bad prompt")))
+        
+        limiter = RateLimiter(max_attempts=3, base_delay=0.01, rng=random.Random(0))
+        call, calls = self.flaky(2, self.HTTPError(429))
+        self.assertEqual(limiter.call(call), "ok")
+        self.assertEqual(len(calls), 3)
+        
+        call, calls = self.flaky(5, self.HTTPError(503))
+        with self.assertRaises(self.HTTPError):
+            limiter.call(call)
+        self.assertEqual(len(calls), 3)
+        
+        call, calls = self.flaky(1, ValueError("bad prompt"))
+        with self.assertRaises(ValueError):
+            limiter.call(call)
+        self.assertEqual(len(calls), 1)
+        
+        call, calls = self.flaky(1, self.HTTPError(500))
+        
+        async def acall():
+            return call()
+        self.assertEqual(asyncio.run(limiter.acall(acall)), "ok")
+        
+        stats = limiter.stats()
+        self.assertEqual((stats["retries"], stats["throttled"], stats["gave_up"]), (5, 2, 1))
+    
+    def test_stream_retried_until_first_token(self):
+        """Test that a stream failing before its first token is reopened"""
+        from types import SimpleNamespace
+        from app import LLMProvider
+        from rate_limit import RateLimiter
+        
+        error = self.HTTPError(529)
+        
+        class OverloadedOnce:
+            attempts = 0
+            
+            def stream(self, prompt):
+                OverloadedOnce.attempts += 1
+                if OverloadedOnce.attempts == 1:
+                    raise error
+                yield SimpleNamespace(content="Hello")
+                yield SimpleNamespace(content=" world")
+        
+        llm = LLMProvider("InvalidProvider", "fake_key")
+        llm.provider, llm.client = "Claude", OverloadedOnce()
+        llm.rate_limiter = RateLimiter(base_delay=0.01)
+        self.assertEqual("".join(llm.stream_response("q", "ctx")), "Hello world")
+        self.assertEqual(OverloadedOnce.attempts, 2)
+        self.assertEqual(llm.rate_limiter.stats()["retries"], 1)
 
 class TestConfiguration(unittest.TestCase):
     """Test configuration functionality"""
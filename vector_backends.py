@@ -0,0 +1,667 @@
+"""
+Vector store backends for PDF Knowledge Assistant
+An in-process NumPy index that mirrors the part of the chromadb client and
+collection API used by VectorDatabase, so it can be swapped in unchanged,
+optionally scanning compressed (int8 or product-quantized) codes
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from quantization import make_quantizer
+
+# Metadata fields with row postings; where clauses on other fields are checked row by row
+INDEXED_FIELDS = ("document_id", "filename", "content_hash", "chunk_hash")
+_GENERATION_FILE_RE = re.compile(r"^(vectors|rows|codes|quantizer)-\d+\.(npy|jsonl|npz)(\.tmp)?$")
+
+_RANGE_OPS = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+}
+
+
+def matches_where(metadata: Optional[Dict[str, Any]], where: Dict[str, Any]) -> bool:
+    """Evaluate a Chroma-style where filter against one metadata dict"""
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            (op, operand), = condition.items()
+            value = metadata.get(key)
+            if op == "$eq" and value != operand:
+                return False
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op == "$nin" and value in operand:
+                return False
+            if op in _RANGE_OPS and (value is None or not _RANGE_OPS[op](value, operand)):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class NumpyCollection:
+    """Contiguous float32 matrix of embeddings with side arrays for IDs and metadata
+
+    Rows are append-only: deletes and overwrites mark the old row with a
+    tombstone, and the matrix is compacted once tombstones exceed
+    compaction_ratio of the rows. With a directory, embeddings live in a
+    memory-mapped vectors-<n>.npy and rows are journaled to rows-<n>.jsonl,
+    so a reopened collection needs no recomputation. Compaction writes the
+    next generation of both files and switches to it by replacing
+    manifest.json, so an interrupted compaction leaves the previous files
+    in use. Queries are one matmul plus argpartition top-k, returning
+    distances in the collection's "hnsw:space" like Chroma: squared L2
+    (default), 1 - cosine similarity or 1 - inner product. The other hnsw:*
+    settings are stored but unused, since the scan is exact. Where filters
+    on INDEXED_FIELDS use append-only row postings; other fields are only
+    checked on the rows the indexed clauses leave.
+
+    With metadata {"quantization": "int8" | "pq"} the collection also keeps
+    compressed codes (codes-<m>.npy with quantizer-<m>.npz when persisted)
+    once it holds min_train_rows vectors. The quantizer is fitted on a
+    sample of at most max_train_rows vectors and refitted whenever the
+    collection has grown retrain_ratio times since the last fit. Queries can
+    then scan the codes and re-rank a shortlist of rerank_factor * k rows at
+    full precision, so only the codes and the shortlisted rows are paged in.
+    Codes are scored in the collection's space; for cosine they encode the
+    unit-normalized vectors. "quantization:scan" defaults to "codes";
+    "exact" always scans the full-precision vectors, and "auto" scans codes
+    only if that timed faster than the exact scan on this collection.
+    """
+
+    min_train_rows = 1024
+    max_train_rows = 20000
+    retrain_ratio = 2.0
+
+    def __init__(self, name: str, directory: str = None, compaction_ratio: float = 0.25,
+                 metadata: Dict[str, Any] = None):
+        self.name = name
+        self.directory = directory
+        self.compaction_ratio = compaction_ratio
+        self._lock = threading.RLock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            if metadata is None and os.path.exists(self._settings_path):
+                with open(self._settings_path, encoding="utf-8") as f:
+                    metadata = json.load(f)
+            elif metadata is not None:
+                with open(self._settings_path, "w", encoding="utf-8") as f:
+                    json.dump(metadata, f)
+        self.metadata = metadata
+        metadata = metadata or {}
+        self.quantizer = make_quantizer(
+            metadata["quantization"], metadata.get("quantization:subvectors", 48)
+        ) if metadata.get("quantization") else None
+        self.rerank_factor = metadata.get("quantization:rerank_factor", 10)
+        self.scan = metadata.get("quantization:scan", "codes")
+        if self.scan not in ("auto", "codes", "exact"):
+            raise ValueError(f"Unknown quantization scan: {self.scan}")
+        self._scan_codes = self.scan == "codes"
+        # File generations: rows for vectors/journal, codes for codes/quantizer state
+        self._rows_generation = 0
+        self._codes_generation = 0
+        self._trained_rows = 0
+        self.space = metadata.get("hnsw:space", "l2")
+        if self.space not in ("l2", "cosine", "ip"):
+            raise ValueError(f"Unknown distance space: {self.space}")
+        self._reset()
+        if directory:
+            self._load()
+
+    # ----- storage -------------------------------------------------------
+
+    def _reset(self):
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._codes = np.zeros((0, 0), dtype=np.uint8)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._ids: List[Optional[str]] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict[str, Any]]] = []
+        self._rows: Dict[str, int] = {}
+        self._index: Dict[tuple, array] = {}
+        self._dead = 0
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, f"vectors-{self._rows_generation}.npy")
+
+    @property
+    def _journal_path(self) -> str:
+        return os.path.join(self.directory, f"rows-{self._rows_generation}.jsonl")
+
+    @property
+    def _settings_path(self) -> str:
+        return os.path.join(self.directory, "collection.json")
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    @property
+    def _quantizer_path(self) -> str:
+        return os.path.join(self.directory, f"quantizer-{self._codes_generation}.npz")
+
+    @property
+    def _codes_path(self) -> Optional[str]:
+        return os.path.join(self.directory, f"codes-{self._codes_generation}.npy") if self.directory else None
+
+    def _write_manifest(self):
+        """Atomically switch to the current file generations, then delete every other generation"""
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"rows": self._rows_generation, "codes": self._codes_generation}, f)
+        os.replace(tmp_path, self._manifest_path)
+        self._remove_stale_files()
+
+    def _remove_stale_files(self):
+        current = {os.path.basename(path) for path in
+                   (self._vectors_path, self._journal_path, self._codes_path, self._quantizer_path)}
+        for name in os.listdir(self.directory):
+            if _GENERATION_FILE_RE.match(name) and name not in current:
+                os.remove(os.path.join(self.directory, name))
+
+    def _load(self):
+        """Reopen the memory-mapped matrix of the current generation and replay its row journal"""
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._rows_generation, self._codes_generation = manifest["rows"], manifest["codes"]
+        # Drop files of an interrupted compaction or refit
+        self._remove_stale_files()
+        if not os.path.exists(self._vectors_path):
+            return
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+        self._alive = np.zeros(self._vectors.shape[0], dtype=bool)
+        self._norms = np.zeros(self._vectors.shape[0], dtype=np.float32)
+        with open(self._journal_path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["op"] == "add":
+                    self._append_row(entry["id"], entry["document"], entry["metadata"])
+                else:
+                    self._tombstone(entry["row"])
+        self._norms[:self._size] = np.einsum("ij,ij->i", self._vectors[:self._size], self._vectors[:self._size])
+        if self.quantizer and os.path.exists(self._quantizer_path):
+            with np.load(self._quantizer_path) as state:
+                state = dict(state)
+            self.quantizer.load_state(state)
+            self._trained_rows = int(state["trained_rows"])
+            capacity, dim = self._vectors.shape
+            shape = (capacity, self.quantizer.code_size(dim))
+            if os.path.exists(self._codes_path):
+                self._codes = np.load(self._codes_path, mmap_mode="r+")
+            if self._codes.shape != shape:
+                # Missing or from an interrupted write: rebuild from the vectors
+                self._codes = self._grown(self._codes_path, self._codes, shape, np.uint8)
+                self._encode_rows(0, self._size)
+                self._codes.flush()
+            self._calibrate()
+
+    def _journal(self, entries: List[Dict[str, Any]]):
+        if self.directory and entries:
+            with open(self._journal_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    def _ensure_capacity(self, rows: int, dim: int):
+        """Grow the matrix (doubling) so it can hold `rows` rows"""
+        capacity = self._vectors.shape[0]
+        if self._vectors.shape[1] not in (0, dim) and self._size:
+            raise ValueError(f"Embedding dimension {dim} does not match collection dimension {self._vectors.shape[1]}")
+        if rows <= capacity and self._vectors.shape[1] == dim:
+            return
+        new_capacity = max(1024, capacity * 2, rows)
+        self._vectors = self._grown(self._vectors_path if self.directory else None,
+                                    self._vectors, (new_capacity, dim), np.float32)
+        norms = np.zeros(new_capacity, dtype=np.float32)
+        norms[:self._size] = self._norms[:self._size]
+        self._norms = norms
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._alive = alive
+        if self.quantizer:
+            self._codes = self._grown(self._codes_path if self._quantized else None,
+                                      self._codes, (new_capacity, self.quantizer.code_size(dim)), np.uint8)
+
+    def _grown(self, path: Optional[str], array: np.ndarray, shape: tuple, dtype) -> np.ndarray:
+        """array's live rows copied into a larger one, memory-mapped from path if given
+
+        The file is written under a temporary name and moved into place, so
+        a crash never leaves a truncated matrix behind.
+        """
+        keep = self._size if array.shape[1:] == shape[1:] else 0
+        if path:
+            tmp_path = path + ".tmp"
+            grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+            if keep:
+                grown[:keep] = array[:keep]
+            grown.flush()
+            del grown
+            os.replace(tmp_path, path)
+            return np.load(path, mmap_mode="r+")
+        grown = np.zeros(shape, dtype=dtype)
+        if keep:
+            grown[:keep] = array[:keep]
+        return grown
+
+    # ----- quantization --------------------------------------------------
+
+    @property
+    def _quantized(self) -> bool:
+        return self.quantizer is not None and self.quantizer.trained
+
+    def _coded(self, vectors: np.ndarray) -> np.ndarray:
+        """Vectors as the quantizer sees them: unit-normalized for cosine, unchanged otherwise"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.space != "cosine":
+            return vectors
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def _approximate(self, queries: np.ndarray, codes: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """Distances of each query to each coded row in the collection's space, ranked like _distances"""
+        if self.space == "l2":
+            return self.quantizer.distances(queries, codes, norms)
+        return 1.0 - self.quantizer.inner_products(self._coded(queries), codes)
+
+    def _encode_rows(self, start: int, stop: int):
+        """Refresh the compressed codes of rows [start, stop)"""
+        for block in range(start, stop, 65536):
+            end = min(stop, block + 65536)
+            self._codes[block:end] = self.quantizer.encode(self._coded(self._vectors[block:end]))
+
+    def _maybe_train(self):
+        """Fit the quantizer on a sample once enough vectors exist, refitting as the collection grows
+
+        A refit writes every row's codes and the quantizer state as a new
+        codes generation before the manifest switches to it, so codes on
+        disk always match the saved quantizer.
+        """
+        live_count = self.count()
+        if not self.quantizer or live_count < self.min_train_rows:
+            return
+        if self.quantizer.trained and live_count < self.retrain_ratio * self._trained_rows:
+            return
+        live = np.flatnonzero(self._alive[:self._size])
+        if len(live) > self.max_train_rows:
+            live = np.sort(np.random.default_rng(len(live)).choice(live, self.max_train_rows, replace=False))
+        self.quantizer.fit(self._coded(self._vectors[live]))
+        self._trained_rows = live_count
+        self._codes_generation += 1
+        capacity, dim = self._vectors.shape
+        self._codes = self._grown(self._codes_path, np.zeros((0, 0), dtype=np.uint8),
+                                  (capacity, self.quantizer.code_size(dim)), np.uint8)
+        self._encode_rows(0, self._size)
+        if self.directory:
+            self._save_quantizer()
+            self._write_manifest()
+        self._calibrate()
+
+    def _save_quantizer(self):
+        """Flush the codes and write the quantizer state of the current codes generation"""
+        if isinstance(self._codes, np.memmap):
+            self._codes.flush()
+        with open(self._quantizer_path, "wb") as f:
+            np.savez(f, trained_rows=self._trained_rows, **self.quantizer.state())
+
+    def _calibrate(self, probes: int = 3):
+        """With scan "auto", scan codes only if that timed faster than the exact scan here"""
+        if self.scan != "auto" or not self.count():
+            return
+        live = np.flatnonzero(self._alive[:self._size])
+        queries = np.asarray(self._vectors[live[np.linspace(0, len(live) - 1, probes).astype(int)]])
+        timings = {}
+        for scan_codes in (True, False):
+            self._scan_codes = scan_codes
+            seconds = []
+            for query in queries:
+                start = time.perf_counter()
+                self.query([query], 10, include=[])
+                seconds.append(time.perf_counter() - start)
+            timings[scan_codes] = min(seconds)
+        self._scan_codes = timings[True] < timings[False]
+
+    def _append_row(self, id: str, document: Optional[str], metadata: Optional[Dict[str, Any]]) -> int:
+        row = self._size
+        if id in self._rows:
+            self._tombstone(self._rows[id])
+        self._ids.append(id)
+        self._documents.append(document)
+        self._metadatas.append(metadata)
+        self._alive[row] = True
+        self._rows[id] = row
+        if metadata:
+            for field in INDEXED_FIELDS:
+                value = metadata.get(field)
+                if isinstance(value, (str, int, float, bool)):
+                    postings = self._index.get((field, value))
+                    if postings is None:
+                        postings = self._index[(field, value)] = array("q")
+                    postings.append(row)
+        self._size += 1
+        return row
+
+    def _tombstone(self, row: int):
+        # Postings keep the row; filtering skips rows that are not alive
+        if not self._alive[row]:
+            return
+        self._alive[row] = False
+        self._dead += 1
+        del self._rows[self._ids[row]]
+        self._ids[row] = self._documents[row] = self._metadatas[row] = None
+
+    def compact(self):
+        """Rewrite the matrix and journal without tombstoned rows
+
+        The compacted rows are written as the next file generation; the
+        manifest switch makes them current and deletes the old files.
+        """
+        with self._lock:
+            live = np.flatnonzero(self._alive[:self._size])
+            vectors = np.array(self._vectors[live]) if self._size else self._vectors
+            entries = [(self._ids[r], self._documents[r], self._metadatas[r]) for r in live]
+            dim = self._vectors.shape[1]
+            quantized = self._quantized
+            self._reset()
+            self._rows_generation += 1
+            if quantized:
+                self._codes_generation += 1
+            if entries:
+                self._ensure_capacity(len(entries), dim)
+                self._vectors[:len(entries)] = vectors
+                self._norms[:len(entries)] = np.einsum("ij,ij->i", vectors, vectors)
+                if quantized:
+                    self._encode_rows(0, len(entries))
+                for id, document, metadata in entries:
+                    self._append_row(id, document, metadata)
+                self._journal([
+                    {"op": "add", "id": id, "document": document, "metadata": metadata}
+                    for id, document, metadata in entries
+                ])
+                self._flush()
+            if self.directory:
+                if quantized:
+                    self._save_quantizer()
+                self._write_manifest()
+
+    def _maybe_compact(self):
+        if self._size and self._dead > self.compaction_ratio * self._size:
+            self.compact()
+
+    def _flush(self):
+        if self.directory:
+            for matrix in (self._vectors, self._codes):
+                if isinstance(matrix, np.memmap):
+                    matrix.flush()
+
+    # ----- filtering -----------------------------------------------------
+
+    def _filter_rows(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Sorted live rows matching a where filter
+
+        $and clauses are flattened; equality and $in clauses on
+        INDEXED_FIELDS are answered from the postings, and the remaining
+        clauses are checked only on the rows those leave.
+        """
+        live = np.flatnonzero(self._alive[:self._size])
+        if not where:
+            return live
+        clauses, pending = [], [where]
+        while pending:
+            for key, condition in pending.pop().items():
+                if key == "$and":
+                    pending.extend(condition)
+                else:
+                    clauses.append((key, condition))
+        rows, residual = None, []
+        for key, condition in clauses:
+            if key == "$or":
+                found = np.zeros(0, dtype=np.int64)
+                for clause in condition:
+                    found = np.union1d(found, self._filter_rows(clause))
+            elif key in INDEXED_FIELDS and (not isinstance(condition, dict) or next(iter(condition)) in ("$eq", "$in")):
+                if isinstance(condition, dict):
+                    (op, operand), = condition.items()
+                    values = operand if op == "$in" else [operand]
+                else:
+                    values = [condition]
+                postings = [np.array(self._index[(key, value)], dtype=np.int64)
+                            for value in values if (key, value) in self._index]
+                found = np.unique(np.concatenate(postings)) if postings else np.zeros(0, dtype=np.int64)
+                found = found[self._alive[found]]
+            else:
+                residual.append({key: condition})
+                continue
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+        if residual:
+            candidates = live if rows is None else rows
+            rows = np.fromiter(
+                (r for r in candidates.tolist() if all(matches_where(self._metadatas[r], c) for c in residual)),
+                dtype=np.int64
+            )
+        return rows
+
+    # ----- chromadb Collection API ---------------------------------------
+
+    def count(self) -> int:
+        return self._size - self._dead
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str] = None,
+            metadatas: List[Dict[str, Any]] = None):
+        self.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str] = None,
+               metadatas: List[Dict[str, Any]] = None):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if len(ids) == 0:
+            return
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            self._ensure_capacity(self._size + len(ids), vectors.shape[1])
+            start = self._size
+            self._vectors[start:start + len(ids)] = vectors
+            self._norms[start:start + len(ids)] = np.einsum("ij,ij->i", vectors, vectors)
+            if self._quantized:
+                self._codes[start:start + len(ids)] = self.quantizer.encode(self._coded(vectors))
+            journal = []
+            for id, document, metadata in zip(ids, documents, metadatas):
+                if id in self._rows:
+                    journal.append({"op": "del", "row": self._rows[id]})
+                self._append_row(id, document, metadata)
+                journal.append({"op": "add", "id": id, "document": document, "metadata": metadata})
+            self._flush()
+            self._journal(journal)
+            self._maybe_compact()
+            self._maybe_train()
+
+    def update(self, ids: List[str], embeddings: List[List[float]] = None, documents: List[str] = None,
+               metadatas: List[Dict[str, Any]] = None):
+        with self._lock:
+            current = self.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+            self.upsert(
+                ids=current["ids"],
+                embeddings=embeddings if embeddings is not None else current["embeddings"],
+                documents=documents if documents is not None else current["documents"],
+                metadatas=metadatas if metadatas is not None else current["metadatas"],
+            )
+
+    def delete(self, ids: List[str] = None, where: Dict[str, Any] = None):
+        with self._lock:
+            rows = set(self._filter_rows(where).tolist()) if where else set()
+            if ids is not None:
+                id_rows = {self._rows[id] for id in ids if id in self._rows}
+                rows = rows & id_rows if where else id_rows
+            rows = sorted(rows)
+            for row in rows:
+                self._tombstone(row)
+            self._journal([{"op": "del", "row": row} for row in rows])
+            self._maybe_compact()
+
+    def get(self, ids: List[str] = None, where: Dict[str, Any] = None, limit: int = None,
+            offset: int = None, include: List[str] = ["metadatas", "documents"]) -> Dict[str, Any]:
+        with self._lock:
+            if ids is not None:
+                rows = [self._rows[id] for id in ids if id in self._rows]
+                if where:
+                    allowed = set(self._filter_rows(where).tolist())
+                    rows = [r for r in rows if r in allowed]
+            else:
+                rows = self._filter_rows(where).tolist()
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._rows_result(rows, include)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Dict[str, Any] = None,
+              include: List[str] = ["metadatas", "documents", "distances"]) -> Dict[str, Any]:
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock:
+            if where:
+                candidates = self._filter_rows(where)
+                available = len(candidates)
+            else:
+                candidates = np.arange(self._size)
+                available = self.count()
+            result = {key: [] for key in ["ids"] + list(include)}
+            if not available:
+                for key in result:
+                    result[key] = [[] for _ in queries]
+                return result
+
+            k = min(n_results, available)
+            shortlist = k * self.rerank_factor
+            if self._quantized and self._scan_codes and available > shortlist:
+                # Scan compressed codes, then re-rank the shortlist at full precision
+                codes = self._codes[candidates] if where else self._codes[:self._size]
+                approximate = self._approximate(queries, codes, self._norms[candidates])
+                if not where and self._dead:
+                    approximate[:, ~self._alive[:self._size]] = np.inf
+                shortlists = [
+                    np.sort(candidates[np.argpartition(row, shortlist - 1)[:shortlist]])
+                    for row in approximate
+                ]
+            else:
+                shortlists = None
+
+            if shortlists is None:
+                if where:
+                    vectors, norms = self._vectors[candidates], self._norms[candidates]
+                else:
+                    # Scan the contiguous matrix in place; tombstoned rows are pushed to +inf
+                    vectors, norms = self._vectors[:self._size], self._norms[:self._size]
+                distances = self._distances(queries, vectors, norms)
+                if not where and self._dead:
+                    distances[:, ~self._alive[:self._size]] = np.inf
+                ranked = [(candidates, row_distances) for row_distances in distances]
+            else:
+                ranked = []
+                for query, rows in zip(queries, shortlists):
+                    vectors = np.asarray(self._vectors[rows])
+                    ranked.append((rows, self._distances(query[None, :], vectors, self._norms[rows])[0]))
+
+            for rows, row_distances in ranked:
+                top = np.argpartition(row_distances, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+                top = top[np.argsort(row_distances[top], kind="stable")][:k]
+                found = self._rows_result(rows[top].tolist(), include)
+                found["distances"] = row_distances[top].tolist()
+                for key in result:
+                    result[key].append(found[key])
+            return result
+
+    def _distances(self, queries: np.ndarray, vectors: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """Distances of each query to each vector in the collection's space (norms are ||x||^2)"""
+        distances = queries @ vectors.T
+        if self.space == "ip":
+            return 1.0 - distances
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        if self.space == "cosine":
+            distances /= np.maximum(np.sqrt(query_norms[:, None] * norms[None, :]), 1e-12)
+            return 1.0 - distances
+        distances *= -2.0
+        distances += norms[None, :]
+        distances += query_norms[:, None]
+        return distances
+
+    def _rows_result(self, rows: Iterable[int], include: List[str]) -> Dict[str, Any]:
+        rows = list(rows)
+        return {
+            "ids": [self._ids[r] for r in rows],
+            "embeddings": [self._vectors[r].tolist() for r in rows] if "embeddings" in include else None,
+            "documents": [self._documents[r] for r in rows] if "documents" in include else None,
+            "metadatas": [self._metadatas[r] for r in rows] if "metadatas" in include else None,
+        }
+
+
+_clients: Dict[Optional[str], "NumpyClient"] = {}
+_clients_lock = threading.Lock()
+
+
+def get_numpy_client(path: str = None) -> "NumpyClient":
+    """Return the process-wide NumpyClient for path (None = shared in-memory client)
+
+    Like chromadb clients for the same path, every VectorDatabase in the
+    process sees the same collections.
+    """
+    key = os.path.abspath(path) if path else None
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = NumpyClient(key)
+        return _clients[key]
+
+
+class NumpyClient:
+    """Minimal stand-in for a chromadb client that manages NumpyCollections"""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._collections: Dict[str, NumpyCollection] = {}
+        self._lock = threading.Lock()
+
+    def _directory(self, name: str) -> Optional[str]:
+        return os.path.join(self.path, name) if self.path else None
+
+    def _exists(self, name: str) -> bool:
+        directory = self._directory(name)
+        return name in self._collections or bool(directory and os.path.isdir(directory))
+
+    def create_collection(self, name: str, metadata: Dict[str, Any] = None) -> NumpyCollection:
+        with self._lock:
+            if self._exists(name):
+                raise ValueError(f"Collection {name} already exists")
+            self._collections[name] = NumpyCollection(name, self._directory(name), metadata=metadata)
+            return self._collections[name]
+
+    def get_collection(self, name: str) -> NumpyCollection:
+        with self._lock:
+            if not self._exists(name):
+                raise ValueError(f"Collection {name} does not exist")
+            if name not in self._collections:
+                self._collections[name] = NumpyCollection(name, self._directory(name))
+            return self._collections[name]
+
+    def delete_collection(self, name: str):
+        with self._lock:
+            self._collections.pop(name, None)
+            directory = self._directory(name)
+            if directory and os.path.isdir(directory):
+                shutil.rmtree(directory)